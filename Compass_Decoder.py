@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import math
+
+import cv2
+import numpy as np
+
+"""
+File:Compass_Decoder.py
+
+Description:
+  Decodes the navpoint dot of the compass without template matching. Once the compass dial has been
+  located, the dot is the only bright blue-white feature inside the dial (the dial and the rest of the HUD
+  are orange, with little blue). The blue channel is thresholded inside a fixed circular mask and the dot
+  is found from the image moments.
+  The front/behind state is read from the colour of the dot: a white dot when the target is in front and a
+  cyan ring when it is behind (see templates/navpoint.png and navpoint-behind.png). The HUD is drawn over
+  the scene, so the colour is taken as the dot less the background just around it, and the behind ring is
+  the one with almost no red in it.
+"""
+
+
+class CompassDecoder:
+    def __init__(self, dot_threshold: int = 90, mask_radius: float = 0.8, behind_saturation: float = 0.85,
+                 behind_hue=(80, 130), min_area: int = 6):
+        """
+        @param dot_threshold: The blue channel level (0-255) above which a pixel is part of the dot.
+        @param mask_radius: The radius of the search mask as a fraction of the dial radius. Less than 1.0
+        to exclude the dial ring.
+        @param behind_saturation: The saturation (0.0-1.0) of the dot colour at or above which it is the cyan
+        behind ring, below it is the white front dot.
+        @param behind_hue: The (low, high) hue range (OpenCV 0-180) of the cyan behind ring.
+        @param min_area: The minimum number of dot pixels, below this no dot is found.
+        """
+        self.dot_threshold = dot_threshold
+        self.mask_radius = mask_radius
+        self.behind_saturation = behind_saturation
+        self.behind_hue = behind_hue
+        self.min_area = min_area
+        self._masks = {}  # (h, w): circular mask
+
+    def _mask(self, h: int, w: int):
+        """ Returns the circular mask for a dial image of the size, created once per size. """
+        mask = self._masks.get((h, w))
+        if mask is None:
+            mask = np.zeros((h, w), dtype=np.uint8)
+            radius = int(min(h, w) / 2 * self.mask_radius)
+            cv2.circle(mask, (w // 2, h // 2), radius, 255, -1)
+            self._masks[(h, w)] = mask
+        return mask
+
+    def dot_color(self, image, binary, cx: float, cy: float, rms: float):
+        """ Returns the (hue, saturation) of the dot over the background around it. The hue is 0-180 as
+        in OpenCV, the saturation 0.0-1.0.
+        @param image: The BGR or BGRA dial.
+        @param binary: The dot pixels as 1.
+        @param cx, cy, rms: The centre and rms radius of the dot pixels.
+        """
+        h, w = image.shape[:2]
+        # The dot is within about 1.4 times the rms radius, the background is the band just outside it
+        r = rms * 1.4
+        outer = r + 4
+        x0, x1 = max(0, int(cx - outer)), min(w, int(cx + outer) + 1)
+        y0, y1 = max(0, int(cy - outer)), min(h, int(cy + outer) + 1)
+        yy, xx = np.ogrid[y0:y1, x0:x1]
+        dist2 = (xx - cx) ** 2 + (yy - cy) ** 2
+        window = image[y0:y1, x0:x1, :3]
+
+        dot = (binary[y0:y1, x0:x1] > 0) & (dist2 <= r * r)
+        band = (dist2 > (r + 1) ** 2) & (dist2 <= outer * outer)
+        background = np.median(window[band], axis=0) if band.any() else np.zeros(3)
+        color = np.clip(window[dot].mean(axis=0) - background, 0, None)
+
+        brightest = color.max()
+        if brightest <= 0:
+            return 0, 0.0
+        saturation = float((brightest - color.min()) / brightest)
+        pixel = np.uint8([[color / brightest * 255]])
+        hue = int(cv2.cvtColor(pixel, cv2.COLOR_BGR2HSV)[0, 0, 0])
+        return hue, saturation
+
+    def decode(self, image, fmt: str = 'BGR') -> dict | None:
+        """ Decode the navpoint dot in an image of the compass dial.
+        @param image: The compass dial, cropped to the matched compass template.
+        @param fmt: The channel layout of the image, 'BGRA', 'BGR' (blue is the first channel of both) or
+        'GRAY'. A 'GRAY' image has no colour, so the front/behind state is not known.
+        @return: None if no dot was found, else a dict with:
+            'x': The horizontal offset of the dot from the centre, -100 (left) to 100 (right).
+            'y': The vertical offset of the dot from the centre, -100 (down) to 100 (up).
+            'z': 1 if the target is in front, -1 if behind, 0 if not known.
+            'roll': The angle of the dot from straight up, -180 to 180 degrees, positive clockwise.
+            'dist': The distance of the dot from the centre, 0 to 100.
+            'hue': The hue of the dot colour, 0 to 180.
+            'saturation': The saturation of the dot colour, 0.0 (white) to 1.0.
+        """
+        h, w = image.shape[:2]
+        blue = image if fmt == 'GRAY' else cv2.extractChannel(image, 0)
+
+        ret, binary = cv2.threshold(blue, self.dot_threshold, 1, cv2.THRESH_BINARY)
+        binary = cv2.bitwise_and(binary, binary, mask=self._mask(h, w))
+
+        m = cv2.moments(binary, binaryImage=True)
+        if m['m00'] < self.min_area:
+            return None
+        cx = m['m10'] / m['m00']
+        cy = m['m01'] / m['m00']
+
+        z = 0
+        hue, saturation = 0, 0.0
+        if fmt != 'GRAY':
+            rms = math.sqrt((m['mu20'] + m['mu02']) / m['m00'])
+            hue, saturation = self.dot_color(image, binary, cx, cy, rms)
+            cyan = self.behind_hue[0] <= hue <= self.behind_hue[1] and saturation >= self.behind_saturation
+            z = -1 if cyan else 1
+
+        # Offsets from the dial centre, as a percentage of the dial radius
+        radius = min(h, w) / 2
+        x = (cx - w / 2) / radius * 100
+        y = (h / 2 - cy) / radius * 100
+        return {'x': round(x, 2), 'y': round(y, 2),
+                'z': z,
+                'roll': round(math.degrees(math.atan2(x, y)), 2),
+                'dist': round(min(100.0, math.hypot(x, y)), 2),
+                'hue': hue,
+                'saturation': round(saturation, 2)}
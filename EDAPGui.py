@@ -1,5 +1,6 @@
 # EDAPGui.py
 
+import multiprocessing
 import tkinter as tk
 import tkinter.ttk as ttk
 import os
@@ -20,6 +21,7 @@ class APGui:
         self.root = root
         self.root.title("ED Autopilot")
         self.root.geometry("600x400")
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
 
         self.setup_gui()
 
@@ -58,6 +60,11 @@ class APGui:
         logger.info("Autopilot arrêté")
         self.ed_ap.stop()
 
+    def close(self):
+        """ Release the OCR engine and workers, then close the window. """
+        self.ed_ap.shutdown()
+        self.root.destroy()
+
     def load_config(self):
         try:
             with open(CONFIG_FILE, 'r') as f:
@@ -95,4 +102,6 @@ def main():
 
 
 if __name__ == '__main__':
+    # The OCR workers are processes, in the frozen exe they must run the worker, not open another GUI
+    multiprocessing.freeze_support()
     main()
@@ -1,5 +1,6 @@
 # ED_AP.py
 
+import threading
 import time
 from EDKeys import EDKeys
 from EDShipControl import EDShipControl
@@ -11,6 +12,7 @@ from EDInternalStatusPanel import EDInternalStatusPanel
 from EDStationServicesInShip import EDStationServicesInShip
 from Screen import Screen
 from OCR import OCR
+from OCR_Service import OCRService
 from Voice import Voice
 from EDlogger import logger
 
@@ -28,6 +30,9 @@ class EDAutopilot:
         self.config = {}
 
         self.ocr = None
+        self.ocr_service = None
+        self._ocr_settings = None  # (language, workers) the OCR was started with
+        self._ocr_lock = threading.Lock()
         self.ed_controls = None
         self.overlay = None
 
@@ -50,19 +55,61 @@ class EDAutopilot:
 
     def load_config(self, config):
         self.config = config
+        self.start_ocr()
+
+    def start_ocr(self):
+        """ Start loading the OCR engine in the background, so it is loaded and warmed up by the time an
+        assist needs it. Does nothing if it is already started with the configured settings.
+        The panels hold the OCR, so while the autopilot is running changed settings are not applied until
+        it is restarted. """
+        with self._ocr_lock:
+            language = self.config.get('OCRLanguage', 'en')
+            # With OCRWorkers set, OCR runs in worker processes instead of the autopilot thread
+            workers = self.config.get('OCRWorkers', 0)
+            if self.ocr is not None and self._ocr_settings == (language, workers):
+                return
+            if self.ocr is not None and self.running:
+                logger.warning("OCR settings changed, they will be used when the autopilot is restarted.")
+                return
+
+            # A reload while the previous engine is loading cancels that load instead of waiting for it
+            self._stop_ocr(wait=False)
+            if workers > 0:
+                self.ocr_service = OCRService(self.scr.screen_width, self.scr.screen_height, workers,
+                                              language=language)
+            self.ocr = OCR(self.scr, language, service=self.ocr_service, background=True)
+            self._ocr_settings = (language, workers)
+
+    def stop_ocr(self, wait: bool = False):
+        """ Stop the OCR started by start_ocr() and shut down the OCR workers. The engine is kept while the
+        autopilot is stopped and started, so only call this when the application exits.
+        @param wait: Wait for a background engine load in progress to finish, else it is dropped when done.
+        """
+        with self._ocr_lock:
+            self._stop_ocr(wait)
+
+    def _stop_ocr(self, wait: bool):
+        if self.ocr is not None:
+            self.ocr.close(wait)
+        if self.ocr_service is not None:
+            self.ocr_service.shutdown()
+        self.ocr = None
+        self.ocr_service = None
+        self._ocr_settings = None
 
     def run(self):
         if self.running:
             logger.warning("Autopilot is already running.")
             return
 
+        # Normally already loading since the config was loaded
+        self.start_ocr()
+
         self.running = True
         logger.info("Autopilot started")
         self.voice.say("Autopilot activé")
 
         try:
-            self.ocr = OCR(self.scr, self.config.get('OCRLanguage', 'en'))
-
             self.ship_control = EDShipControl(self.scr, self.ocr, self.keys, self.config)
             self.nav_panel = EDNavigationPanel(self.scr, self.ocr, self.keys, self.config)
             self.galaxy_map = GalaxyMap(self.scr, self)
@@ -82,8 +129,25 @@ class EDAutopilot:
             return
 
         self.running = False
+
+        # Release the panels created by run(). The OCR is kept loaded for the next run.
+        self.ship_control = None
+        self.nav_panel = None
+        self.galaxy_map = None
+        self.sys_map = None
+        self.internal_panel = None
+        self.station_services = None
+        # Apply OCR settings changed while running, does nothing otherwise
+        self.start_ocr()
         logger.info("Autopilot stopped")
         self.voice.say("Autopilot désactivé")
 
+    def shutdown(self):
+        """ Stop the autopilot if running and release the OCR engine and workers. Call when the application
+        exits. """
+        if self.running:
+            self.stop()
+        self.stop_ocr()
+
     def set_callback(self, cb):
         self.cb = cb
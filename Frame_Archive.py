@@ -0,0 +1,250 @@
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import queue
+import threading
+import zlib
+
+import numpy as np
+
+from EDlogger import logger
+
+"""
+File:Frame_Archive.py
+
+Description:
+  Session recorder. Appends every captured region (name, rect, frame id, time, raw and filtered pixels)
+  to an append-only archive on a background thread, so the control loop only pays for a copy of the
+  region.
+
+  The archive is a directory:
+    meta.json           Screen width and height.
+    chunk_NNNNNN.bin    A zlib compressed chunk of concatenated image data.
+    index.jsonl         One line per chunk listing its records and their offsets in the chunk.
+  Chunks are written once and read back through a memory map. When the archive grows over its size
+  limit, the oldest chunks are deleted, so it can run continuously with bounded disk usage.
+  Recorded archives can be replayed with Screen_Capture.ArchiveBackend.
+"""
+
+_INDEX_FILE = 'index.jsonl'
+_META_FILE = 'meta.json'
+
+
+class FrameArchiveWriter:
+    """ Records captured regions to a frame archive. """
+
+    def __init__(self, path: str, width: int, height: int, chunk_bytes: int = 16 * 1024 * 1024,
+                 max_bytes: int = 1024 * 1024 * 1024, compress_level: int = 1, queue_size: int = 256):
+        """
+        @param path: The archive directory. Created if it does not exist. An existing archive is appended to.
+        @param width: The screen width in pixels.
+        @param height: The screen height in pixels.
+        @param chunk_bytes: The uncompressed size at which a chunk is compressed and written.
+        @param max_bytes: The maximum size of the archive on disk. The oldest chunks are deleted above this.
+        @param compress_level: The zlib compression level (1 fastest - 9 smallest).
+        @param queue_size: The number of records that may be waiting to be written. Records are
+        dropped rather than blocking the caller when the queue is full.
+        """
+        self.path = path
+        self.chunk_bytes = chunk_bytes
+        self.max_bytes = max_bytes
+        self.compress_level = compress_level
+
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, _META_FILE), 'w') as fp:
+            json.dump({'width': width, 'height': height}, fp)
+
+        # Continue numbering after any existing chunks
+        self._chunks = _read_index(path)
+        self._chunk_num = max([c['chunk'] for c in self._chunks], default=0) + 1
+        self._disk_bytes = sum(c['bytes'] for c in self._chunks)
+
+        self._buffer = []  # Image data of the open chunk
+        self._buffer_bytes = 0
+        self._records = []  # Index records of the open chunk
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self.recorded = 0
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._write_loop, name="FrameArchiveWriter", daemon=True)
+        self._thread.start()
+
+    def record(self, name: str, rect, frame_id: int, frame_time: float, raw=None, filtered=None) -> bool:
+        """ Queue a captured region to be recorded. The images are copied, so the caller may reuse them.
+        @param name: The region name.
+        @param rect: The region rect [L, T, R, B] in pixels.
+        @param frame_id: The frame id of the capture.
+        @param frame_time: The time of the capture.
+        @param raw: The captured image (BGRA) or None.
+        @param filtered: The filtered image or None.
+        @return: True if queued, False if dropped because the writer is behind.
+        """
+        item = {'name': name, 'rect': [int(v) for v in rect], 'frame_id': int(frame_id), 'time': frame_time,
+                'raw': None if raw is None else np.array(raw),
+                'filtered': None if filtered is None else np.array(filtered)}
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            self.dropped = self.dropped + 1
+            return False
+
+    def close(self):
+        """ Write any queued records and the open chunk, then stop the writer. """
+        self._queue.put(None)
+        self._thread.join()
+        logger.debug(f"FrameArchiveWriter closed. Recorded {self.recorded}, dropped {self.dropped}.")
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            self._append(item)
+        self._flush_chunk()
+
+    def _append(self, item):
+        """ Add a record to the open chunk. Runs on the writer thread. """
+        rec = {'name': item['name'], 'rect': item['rect'], 'frame_id': item['frame_id'], 'time': item['time']}
+        for key in ['raw', 'filtered']:
+            img = item[key]
+            if img is None:
+                rec[key] = None
+                continue
+            img = np.ascontiguousarray(img)
+            rec[key] = {'offset': self._buffer_bytes, 'shape': list(img.shape), 'dtype': str(img.dtype)}
+            self._buffer.append(img.tobytes())
+            self._buffer_bytes = self._buffer_bytes + img.nbytes
+        self._records.append(rec)
+        self.recorded = self.recorded + 1
+
+        if self._buffer_bytes >= self.chunk_bytes:
+            self._flush_chunk()
+
+    def _flush_chunk(self):
+        """ Compress and write the open chunk and add it to the index. Runs on the writer thread. """
+        if len(self._records) == 0:
+            return
+
+        data = zlib.compress(b''.join(self._buffer), self.compress_level)
+        file_name = f"chunk_{self._chunk_num:06d}.bin"
+        with open(os.path.join(self.path, file_name), 'wb') as fp:
+            fp.write(data)
+
+        entry = {'chunk': self._chunk_num, 'file': file_name, 'bytes': len(data),
+                 'raw_bytes': self._buffer_bytes, 'records': self._records}
+        with open(os.path.join(self.path, _INDEX_FILE), 'a') as fp:
+            fp.write(json.dumps(entry) + '\n')
+
+        self._chunks.append({'chunk': self._chunk_num, 'file': file_name, 'bytes': len(data)})
+        self._disk_bytes = self._disk_bytes + len(data)
+        self._chunk_num = self._chunk_num + 1
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._records = []
+
+        if self._disk_bytes > self.max_bytes:
+            self._trim()
+
+    def _trim(self):
+        """ Delete the oldest chunks until the archive is under the size limit, and rewrite the index. """
+        while self._disk_bytes > self.max_bytes and len(self._chunks) > 1:
+            oldest = self._chunks.pop(0)
+            try:
+                os.remove(os.path.join(self.path, oldest['file']))
+            except OSError as e:
+                logger.warning(f"FrameArchiveWriter: unable to delete {oldest['file']}: {e}")
+            self._disk_bytes = self._disk_bytes - oldest['bytes']
+
+        keep = set(c['chunk'] for c in self._chunks)
+        index_file = os.path.join(self.path, _INDEX_FILE)
+        with open(index_file, 'r') as fp:
+            lines = [line for line in fp if line.strip() and json.loads(line)['chunk'] in keep]
+        with open(index_file + '.tmp', 'w') as fp:
+            fp.writelines(lines)
+        os.replace(index_file + '.tmp', index_file)
+
+
+class FrameArchiveReader:
+    """ Reads a frame archive. Chunk files are memory mapped and decompressed on first access, the
+    last decompressed chunk is kept, so reading records in order decompresses each chunk once. """
+
+    def __init__(self, path: str):
+        """
+        @param path: The archive directory.
+        """
+        self.path = path
+        with open(os.path.join(path, _META_FILE), 'r') as fp:
+            meta = json.load(fp)
+        self.width = meta['width']
+        self.height = meta['height']
+
+        # Flatten the index into a record list
+        self.records = []
+        for entry in _read_index(path, full=True):
+            for rec in entry['records']:
+                rec['chunk_file'] = entry['file']
+                self.records.append(rec)
+
+        self._chunk_file = None
+        self._chunk_data = None
+
+    def __len__(self):
+        return len(self.records)
+
+    def frame_ids(self) -> list[int]:
+        """ Returns the distinct frame ids in recorded order. """
+        return list(dict.fromkeys(rec['frame_id'] for rec in self.records))
+
+    def read(self, index: int) -> dict:
+        """ Read a record.
+        @return: A dict with name, rect, frame_id, time, raw and filtered (images or None).
+        """
+        rec = self.records[index]
+        data = self._load_chunk(rec['chunk_file'])
+        out = {'name': rec['name'], 'rect': rec['rect'], 'frame_id': rec['frame_id'], 'time': rec['time']}
+        for key in ['raw', 'filtered']:
+            info = rec[key]
+            if info is None:
+                out[key] = None
+            else:
+                count = int(np.prod(info['shape']))
+                out[key] = np.frombuffer(data, dtype=info['dtype'], count=count,
+                                         offset=info['offset']).reshape(info['shape'])
+        return out
+
+    def read_frame(self, frame_id: int) -> list[dict]:
+        """ Read all the records of a frame. """
+        return [self.read(i) for i, rec in enumerate(self.records) if rec['frame_id'] == frame_id]
+
+    def _load_chunk(self, file_name: str):
+        if file_name != self._chunk_file:
+            with open(os.path.join(self.path, file_name), 'rb') as fp:
+                with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    self._chunk_data = zlib.decompress(mm)
+            self._chunk_file = file_name
+        return self._chunk_data
+
+
+def _read_index(path: str, full: bool = False) -> list[dict]:
+    """ Read the chunk index of an archive, skipping chunks whose file no longer exists.
+    @param full: Include the record list of each chunk.
+    """
+    index_file = os.path.join(path, _INDEX_FILE)
+    if not os.path.exists(index_file):
+        return []
+
+    chunks = []
+    with open(index_file, 'r') as fp:
+        for line in fp:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if not os.path.exists(os.path.join(path, entry['file'])):
+                continue
+            if not full:
+                entry = {'chunk': entry['chunk'], 'file': entry['file'], 'bytes': entry['bytes']}
+            chunks.append(entry)
+    return chunks
@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import os
+
+import cv2
+import numpy as np
+
+from EDlogger import logger
+
+"""
+File:Glyph_OCR.py
+
+Description:
+  A fast OCR for single lines of text in the fixed HUD font (menu labels, tab names, system and commodity
+  names). Characters are segmented by column projection and each is classified by the nearest learned
+  glyph, for all characters of the line in one matrix product. Recognition takes about a millisecond,
+  where PaddleOCR takes tens to hundreds.
+
+  The glyphs are learned from PaddleOCR: learn() takes a line image with its text, i.e. from PaddleOCR
+  recognition of a recorded crop, and keeps the glyphs if the number of segmented characters agrees with
+  the text. OCR does this as it runs when the glyph engine is selected, see OCR.image_line_ocr, and the
+  glyphs can be saved and loaded.
+  Characters that touch are segmented as one and will not match, so recognize() returns a low confidence
+  and the caller should fall back to PaddleOCR.
+"""
+
+
+class GlyphOCR:
+    def __init__(self, glyph_width: int = 16, glyph_height: int = 24, max_per_char: int = 8):
+        """
+        @param glyph_width: The width of the normalized glyph.
+        @param glyph_height: The height of the normalized glyph, the height of the line of text.
+        @param max_per_char: The maximum number of glyphs kept for each character.
+        """
+        self.glyph_width = glyph_width
+        self.glyph_height = glyph_height
+        self.max_per_char = max_per_char
+        self.space_ratio = 0.35  # A gap wider than this fraction of the text height is a space
+        self.glyphs = np.zeros((0, glyph_width * glyph_height), dtype=np.float32)  # Unit vectors
+        self.labels = []  # The character of each glyph
+
+    def binarize(self, image):
+        """ Returns the text as 1 and the background as 0. Dark text on a light background, i.e. a
+        highlighted row, is inverted. """
+        gray = image
+        if image.ndim == 3:
+            gray = cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY if image.shape[2] == 4 else cv2.COLOR_BGR2GRAY)
+        ret, binary = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+        # The background is the larger part of the image
+        if binary.mean() > 0.5:
+            binary = 1 - binary
+        return binary
+
+    def segment(self, binary):
+        """ Split a binarized line into characters by the columns with no text.
+        @return: (list of (x_left, x_right) of each character or None for a space, (y_top, y_bottom) of the
+        capital letters). The capital height is the median top and bottom of the characters, so the line
+        is measured the same whether or not it has descenders, i.e. 'Q'.
+        """
+        cols = binary.any(axis=0)
+        if not cols.any():
+            return [], (0, 0)
+
+        # Starts and ends of the runs of text columns
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], cols.astype(np.int8), [0]))))
+        starts, ends = edges[0::2], edges[1::2]
+
+        tops = []
+        bottoms = []
+        for x0, x1 in zip(starts, ends):
+            rows = np.flatnonzero(binary[:, x0:x1].any(axis=1))
+            tops.append(rows[0])
+            bottoms.append(rows[-1] + 1)
+        top, bottom = int(np.median(tops)), int(np.median(bottoms))
+        bottom = max(bottom, top + 1)
+
+        chars = []
+        space = self.space_ratio * (bottom - top)
+        for i in range(len(starts)):
+            if i > 0 and starts[i] - ends[i - 1] > space:
+                chars.append(None)
+            chars.append((int(starts[i]), int(ends[i])))
+        return chars, (top, bottom)
+
+    def normalize(self, binary, x_left, x_right, top, bottom):
+        """ Returns a character as a unit vector. The glyph covers the capital height with a margin above
+        and below for accents and descenders. It is scaled by the capital height, so the position of i.e.
+        '.' and '-' is kept, and centered in the glyph width. """
+        margin = (bottom - top) // 4
+        char = binary[max(0, top - margin):bottom + margin, x_left:x_right].astype(np.float32)
+        # Pad where the margin is outside the image
+        char = cv2.copyMakeBorder(char, max(0, margin - top), max(0, bottom + margin - binary.shape[0]), 0, 0,
+                                  cv2.BORDER_CONSTANT, value=0)
+        scale = self.glyph_height / char.shape[0]
+        w = int(min(self.glyph_width, max(1, round((x_right - x_left) * scale))))
+        char = cv2.resize(char, (w, self.glyph_height), interpolation=cv2.INTER_AREA)
+
+        glyph = np.zeros((self.glyph_height, self.glyph_width), dtype=np.float32)
+        x = (self.glyph_width - w) // 2
+        glyph[:, x:x + w] = char
+        # Blur, so a stroke a pixel off still overlaps
+        glyph = cv2.GaussianBlur(glyph, (0, 0), 1.0)
+        vec = glyph.ravel()
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm > 0 else vec
+
+    def extract(self, image):
+        """ Returns the characters of a line image as a matrix of unit vectors (one row per character), and
+        the positions of the spaces in the text. """
+        binary = self.binarize(image)
+        chars, (top, bottom) = self.segment(binary)
+        vectors = []
+        spaces = []
+        for c in chars:
+            if c is None:
+                spaces.append(len(vectors) + len(spaces))
+            else:
+                vectors.append(self.normalize(binary, c[0], c[1], top, bottom))
+        if len(vectors) == 0:
+            return np.zeros((0, self.glyphs.shape[1]), dtype=np.float32), spaces
+        return np.stack(vectors), spaces
+
+    def learn(self, image, text: str) -> bool:
+        """ Learn the glyphs of a line image from its known text.
+        @param image: An image of a single line of text.
+        @param text: The text in the image, i.e. as read by PaddleOCR.
+        @return: True if learned, False if the characters found do not agree with the text.
+        """
+        vectors, spaces = self.extract(image)
+        chars = text.replace(' ', '')
+        if len(chars) == 0 or len(vectors) != len(chars):
+            return False
+
+        new = []
+        new_labels = []
+        for vec, ch in zip(vectors, chars):
+            count = self.labels.count(ch) + new_labels.count(ch)
+            if count >= self.max_per_char:
+                continue
+            # Only keep glyphs that differ from those already known for the character
+            if count > 0:
+                known = [self.glyphs[i] for i, label in enumerate(self.labels) if label == ch]
+                known = known + [v for v, label in zip(new, new_labels) if label == ch]
+                if max(float(np.dot(k, vec)) for k in known) > 0.98:
+                    continue
+            new.append(vec)
+            new_labels.append(ch)
+
+        if len(new) > 0:
+            self.glyphs = np.concatenate((self.glyphs, np.stack(new)))
+            self.labels = self.labels + new_labels
+        return True
+
+    def recognize(self, image) -> (str, float):
+        """ Recognize a single line of text.
+        @return: (text, confidence). The confidence is the lowest similarity (0.0-1.0) of any character to
+        its glyph, or 0.0 if there are no glyphs or no text.
+        """
+        vectors, spaces = self.extract(image)
+        if len(vectors) == 0 or len(self.labels) == 0:
+            return '', 0.0
+
+        # Cosine similarity of every character to every glyph
+        similarity = vectors @ self.glyphs.T
+        best = similarity.argmax(axis=1)
+        confidence = float(similarity[np.arange(len(best)), best].min())
+
+        chars = [self.labels[i] for i in best]
+        for pos in spaces:
+            chars.insert(pos, ' ')
+        return ''.join(chars), confidence
+
+    def save(self, file_name) -> bool:
+        """ Save the learned glyphs. Returns False if they could not be saved. """
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(file_name)), exist_ok=True)
+            np.savez(file_name, glyphs=self.glyphs, labels=np.array(self.labels),
+                     size=np.array([self.glyph_width, self.glyph_height]))
+            return True
+        except Exception as e:
+            logger.warning(f"Glyph_OCR: unable to save glyphs to {file_name}: {e}")
+            return False
+
+    def load(self, file_name) -> bool:
+        """ Load learned glyphs. Returns False if the file does not exist or is not usable. """
+        if not os.path.isfile(file_name):
+            return False
+        try:
+            with np.load(file_name) as data:
+                width, height = (int(v) for v in data['size'])
+                if (width, height) != (self.glyph_width, self.glyph_height):
+                    logger.warning(f"Glyph_OCR: glyphs in {file_name} are {width}x{height}, "
+                                   f"expected {self.glyph_width}x{self.glyph_height}.")
+                    return False
+                self.glyphs = data['glyphs'].astype(np.float32)
+                self.labels = [str(label) for label in data['labels']]
+            return True
+        except Exception as e:
+            logger.warning(f"Glyph_OCR: unable to load glyphs from {file_name}: {e}")
+            return False
@@ -1,7 +1,14 @@
+from __future__ import annotations
+
+import hashlib
+import os
 import sys
+import threading
+from collections import OrderedDict
 from os.path import abspath, getmtime, isfile, join, dirname
 
 import cv2
+import numpy as np
 from EDlogger import logger
 
 """
@@ -13,22 +20,86 @@ Description:
 Author: sumzer0@yahoo.com
 """
 
+def user_cache_dir() -> str:
+    """ Returns the folder for data EDAP creates, i.e. the template cache and learned glyphs. It is in the
+    user's local app data, not the install folder (or the PyInstaller temporary folder), so it is writable and
+    kept between runs. """
+    base_path = os.environ.get('LOCALAPPDATA')
+    if base_path is None:
+        base_path = os.environ.get('XDG_CACHE_HOME', join(os.path.expanduser('~'), '.cache'))
+    return join(base_path, 'EDAPGui')
+
+
+class _TemplateDict(dict):
+    """ The loaded templates by name. A template that is not loaded is loaded with its set on first access,
+    so template['name'] works whether or not the set was loaded. """
+
+    def __init__(self, owner):
+        super().__init__()
+        self.owner = owner
+
+    def __missing__(self, name):
+        with self.owner.lock:
+            # Another thread may have loaded the set while this one waited for the lock
+            if not dict.__contains__(self, name):
+                self.owner.load_set(self.owner.set_of(name))
+            return dict.__getitem__(self, name)
+
+
 class Image_Templates:
-    def __init__(self, scaleX, scaleY, compass_scale: float):
-   
-        self.template = { 'elw'       : {'image': None, 'width': 1, 'height': 1},
-                          'elw_sig'   : {'image': None, 'width': 1, 'height': 1}, 
-                          'navpoint'  : {'image': None, 'width': 1, 'height': 1}, 
-                          'navpoint-behind': {'image': None, 'width': 1, 'height': 1},
-                          'compass'   : {'image': None, 'width': 1, 'height': 1},
-                          'target'    : {'image': None, 'width': 1, 'height': 1},
-                          'target_occluded' : {'image': None, 'width': 1, 'height': 1},
-                          'disengage' : {'image': None, 'width': 1, 'height': 1},
-                          'missions'  : {'image': None, 'width': 1, 'height': 1},
-                          'dest_sirius' : {'image': None, 'width': 1, 'height': 1},
-                          'sirius_atmos' : {'image': None, 'width': 1, 'height': 1}                                            
-                        }
+    def __init__(self, scaleX, scaleY, compass_scale: float, use_cache: bool = True, cache_dir: str | None = None):
+        """
+        @param use_cache: Cache the scaled templates on disk.
+        @param cache_dir: The folder of the template cache, defaults to template_cache in user_cache_dir().
+        """
+
+        # Loaded templates. Templates are loaded by set on first use, see load_set().
+        self.template = _TemplateDict(self)
+        # Held while loading, unloading or evicting, as templates are loaded on first use by the matching threads
+        self.lock = threading.RLock()
  
+        # Template files and whether they are scaled with the compass scale instead of screen scale
+        self.template_files = {'elw':             ("templates/elw-template.png", False),
+                               'elw_sig':         ("templates/elw-sig-template.png", False),
+                               'navpoint':        ("templates/navpoint.png", True),
+                               'navpoint-behind': ("templates/navpoint-behind.png", True),
+                               'compass':         ("templates/compass.png", True),
+                               'target':          ("templates/destination.png", False),
+                               'target_occluded': ("templates/target_occluded.png", False),
+                               'disengage':       ("templates/sc-disengage.png", False),
+                               'missions':        ("templates/completed-missions.png", False),
+                               'dest_sirius':     ("templates/dest-sirius-atmos-HL.png", False),
+                               'robigo_mines':    ("templates/robigo-mines-selected.png", False),
+                               'sirius_atmos':    ("templates/sirius-atmos-selected.png", False),
+                               }
+
+        # Templates are loaded and unloaded in sets, so an assist only holds the templates it uses
+        self.template_sets = {'navigation':  ['navpoint', 'navpoint-behind', 'compass', 'target', 'target_occluded',
+                                              'disengage'],
+                              'robigo':      ['robigo_mines', 'sirius_atmos', 'dest_sirius'],
+                              'exploration': ['elw', 'elw_sig'],
+                              'missions':    ['missions'],
+                              }
+        self.active_sets = {'navigation'}  # Sets in use, loaded by reload_templates and never evicted
+        self.loaded_sets = OrderedDict()  # Set name: bytes, least recently used first
+        # Bytes of loaded templates before inactive sets are evicted, at the 3440x1440 template scale, see budget().
+        # About the navigation set with its scale spaces and a small set, so a released set is evicted when the
+        # next one is loaded.
+        self.memory_budget = 192 * 1024
+
+        # Scale spaces of the templates scaled with the compass scale, which is calibrated separately and the
+        # most likely to be off. See set_scale_space() and build_scale_space().
+        self.scale_factors = (0.8, 0.9, 1.0, 1.1, 1.25)
+        self.scale_space_names = {name for name, (file_name, use_compass_scale) in self.template_files.items()
+                                  if use_compass_scale}
+        self.scale_space = {}
+        self.scale_locked = {}  # Template name: locked scale factor
+
+        # Scaled templates are cached on disk, keyed by the template file path, modification time and size and
+        # the scale factors, so startup and recalibration only load the cache.
+        self.cache_dir = join(user_cache_dir(), 'template_cache') if cache_dir is None else cache_dir
+        self.use_cache = use_cache
+
         # load the templates and scale them.  Default templates assumed 3440x1440 screen resolution
         self.reload_templates(scaleX, scaleY, compass_scale)
        
@@ -36,27 +107,234 @@ class Image_Templates:
         """ Load the template image in color. If we need grey scale for matching, we can apply that later as needed.
         Resize the image, as the templates are based on 3440x1440 resolution, so scale to current screen resolution
          return image and size info. """
+        if self.use_cache:
+            cached = self.load_cached_template(file_name, scaleX, scaleY)
+            if cached is not None:
+                return cached
+
         template = cv2.imread(self.resource_path(file_name), cv2.IMREAD_GRAYSCALE)
         #logger.debug("File:"+self.resource_path(file_name)+" template:"+str(template))
         template = cv2.resize(template, (0, 0), fx=scaleX, fy=scaleY)
         width, height = template.shape[::-1]
-        return {'image': template, 'width': width, 'height': height}
+        templ = {'image': template, 'width': width, 'height': height}
+        templ.update(self.template_stats(template))
+
+        if self.use_cache:
+            self.save_cached_template(file_name, scaleX, scaleY, templ)
+        return templ
+
+    @staticmethod
+    def template_stats(template) -> dict:
+        """ Precompute the data derived from a template: the mean and the zero mean norm used by
+        TM_CCOEFF_NORMED, the norm used by TM_CCORR_NORMED and a binary (Otsu thresholded) version for
+        matching against the colour filtered (binary) regions. """
+        t = template.astype(np.float64)
+        mean = t.mean()
+        ret, binary = cv2.threshold(template, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+        return {'mean': float(mean),
+                'norm': float(np.sqrt(np.sum(np.square(t - mean)))),
+                'ccorr_norm': float(np.sqrt(np.sum(np.square(t)))),
+                'binary': binary}
+
+    def cache_file_name(self, file_name, scaleX, scaleY) -> str:
+        """ Returns the cache file for the template at the scale. The name includes a hash of the path,
+        modification time and size of the template file, so a changed template is not loaded from an old cache,
+        without reading the file. """
+        path = self.resource_path(file_name)
+        st = os.stat(path)
+        file_key = hashlib.sha1(f"{path}|{st.st_mtime_ns}|{st.st_size}".encode()).hexdigest()[:16]
+        stem = os.path.splitext(os.path.basename(file_name))[0]
+        return join(self.cache_dir, f"{stem}_{file_key}_{scaleX:.4f}_{scaleY:.4f}.npz")
+
+    def load_cached_template(self, file_name, scaleX, scaleY):
+        """ Load a scaled template from the cache. Returns None if it is not in the cache. """
+        try:
+            cache_file = self.cache_file_name(file_name, scaleX, scaleY)
+            if not isfile(cache_file):
+                return None
+            with np.load(cache_file) as data:
+                template = data['image']
+                height, width = template.shape
+                return {'image': template, 'width': width, 'height': height,
+                        'mean': float(data['mean']), 'norm': float(data['norm']),
+                        'ccorr_norm': float(data['ccorr_norm']), 'binary': data['binary']}
+        except Exception as e:
+            logger.warning(f"Image_Templates: unable to load cached template {file_name}: {e}")
+            return None
+
+    def save_cached_template(self, file_name, scaleX, scaleY, templ):
+        """ Save a scaled template to the cache. """
+        try:
+            cache_file = self.cache_file_name(file_name, scaleX, scaleY)
+            os.makedirs(dirname(cache_file), exist_ok=True)
+            np.savez(cache_file, image=templ['image'], mean=templ['mean'], norm=templ['norm'],
+                     ccorr_norm=templ['ccorr_norm'], binary=templ['binary'])
+        except Exception as e:
+            logger.warning(f"Image_Templates: unable to cache template {file_name}: {e}")
+
+    def clear_cache(self):
+        """ Delete all cached templates. """
+        if os.path.isdir(self.cache_dir):
+            for f in os.listdir(self.cache_dir):
+                if f.endswith('.npz'):
+                    os.remove(join(self.cache_dir, f))
 
     def reload_templates(self, scaleX, scaleY, compass_scale: float):
-        """ Load the full set of image templates. """
-        self.template['elw']       = self.load_template("templates/elw-template.png", scaleX, scaleY) 
-        self.template['elw_sig']   = self.load_template("templates/elw-sig-template.png", scaleX, scaleY) 
-        self.template['navpoint']  = self.load_template("templates/navpoint.png", compass_scale, compass_scale)
-        self.template['navpoint-behind']  = self.load_template("templates/navpoint-behind.png", compass_scale, compass_scale)
-        self.template['compass']   = self.load_template("templates/compass.png", compass_scale,compass_scale)
-        self.template['target']    = self.load_template("templates/destination.png", scaleX, scaleY) 
-        self.template['target_occluded']    = self.load_template("templates/target_occluded.png", scaleX, scaleY) 
-        self.template['disengage'] = self.load_template("templates/sc-disengage.png", scaleX, scaleY) 
-        self.template['missions']  = self.load_template("templates/completed-missions.png", scaleX, scaleY) 
-        self.template['dest_sirius'] = self.load_template("templates/dest-sirius-atmos-HL.png", scaleX, scaleY)
-        self.template['robigo_mines']  = self.load_template("templates/robigo-mines-selected.png", scaleX, scaleY) 
-        self.template['sirius_atmos']  = self.load_template("templates/sirius-atmos-selected.png", scaleX, scaleY)        
-        
+        """ Set the scales and reload the image templates. The active sets are loaded now, the others are
+        loaded when first used. """
+        with self.lock:
+            self.scaleX = scaleX
+            self.scaleY = scaleY
+            self.compass_scale = compass_scale
+
+            # Scales found by the scale space are no longer valid
+            self.scale_locked = {}
+            for set_name in list(self.loaded_sets):
+                self.unload_set(set_name)
+            for set_name in sorted(self.active_sets):
+                self.load_set(set_name)
+
+    def set_of(self, name) -> str:
+        """ Returns the name of the set containing the template. """
+        for set_name, names in self.template_sets.items():
+            if name in names:
+                return set_name
+        raise KeyError(name)
+
+    def load_set(self, set_name):
+        """ Load and scale the templates of a set, if not already loaded, and mark it as the most recently
+        used. Inactive sets are then evicted, least recently used first, while over the memory budget. """
+        with self.lock:
+            if set_name in self.loaded_sets:
+                self.loaded_sets.move_to_end(set_name)
+                return
+
+            size = 0
+            for name in self.template_sets[set_name]:
+                file_name, use_compass_scale = self.template_files[name]
+                fx, fy = self.template_scale(name)
+                templ = self.load_template(file_name, fx, fy)
+                self.template[name] = templ
+                size = size + templ['image'].nbytes + templ['binary'].nbytes
+                if self.scale_factors is not None and name in self.scale_space_names:
+                    self.scale_space[name] = self.build_scale_space(templ)
+                    size = size + sum(t['image'].nbytes + t['binary'].nbytes for f, t in self.scale_space[name]
+                                      if t is not templ)
+            self.loaded_sets[set_name] = size
+            logger.debug(f"Image_Templates: loaded template set '{set_name}' ({size} bytes).")
+
+            self.evict_sets(keep=set_name)
+
+    def unload_set(self, set_name):
+        """ Unload the templates of a set. They are loaded again when next used. """
+        with self.lock:
+            for name in self.template_sets[set_name]:
+                self.template.pop(name, None)
+                self.scale_space.pop(name, None)
+                self.scale_locked.pop(name, None)
+            self.loaded_sets.pop(set_name, None)
+
+    def evict_sets(self, keep=None):
+        """ Unload inactive sets, least recently used first, until the loaded templates fit the memory budget.
+        @param keep: A set not to evict, i.e. the set just loaded.
+        """
+        with self.lock:
+            for set_name in list(self.loaded_sets):
+                if self.memory_used() <= self.budget():
+                    break
+                if set_name == keep or set_name in self.active_sets:
+                    continue
+                self.unload_set(set_name)
+                logger.debug(f"Image_Templates: evicted template set '{set_name}'.")
+
+    def memory_used(self) -> int:
+        """ Returns the bytes of the loaded templates, including their scale spaces. """
+        return sum(self.loaded_sets.values())
+
+    def budget(self) -> int:
+        """ Returns the memory budget in bytes at the current scale. The templates, and so the memory_budget,
+        are for 3440x1440, the scaled templates take proportionally more or less. """
+        return int(self.memory_budget * self.scaleX * self.scaleY)
+
+    def use_set(self, set_name):
+        """ Mark a set as in use by an assist, i.e. use_set('robigo') when the Robigo assist starts.
+        The set is loaded now and is not evicted until release_set() is called. """
+        with self.lock:
+            self.active_sets.add(set_name)
+            self.load_set(set_name)
+
+    def release_set(self, set_name):
+        """ The assist no longer uses the set. It stays loaded, but may be evicted when over the memory
+        budget. """
+        with self.lock:
+            self.active_sets.discard(set_name)
+            self.evict_sets()
+
+    def template_scale(self, name) -> (float, float):
+        """ Returns the calibrated (scaleX, scaleY) for the template. """
+        if self.template_files[name][1]:
+            return self.compass_scale, self.compass_scale
+        return self.scaleX, self.scaleY
+
+    def build_scale_space(self, templ) -> list:
+        """ Returns the scale space of a loaded template, the list of (factor, template) of the template
+        resized by each of the scale_factors. The template itself is used at factor 1.0.
+        """
+        space = []
+        for f in self.scale_factors:
+            if f == 1.0:
+                space.append((f, templ))
+                continue
+            interpolation = cv2.INTER_AREA if f < 1.0 else cv2.INTER_LINEAR
+            image = cv2.resize(templ['image'], (0, 0), fx=f, fy=f, interpolation=interpolation)
+            height, width = image.shape
+            scaled = {'image': image, 'width': width, 'height': height}
+            scaled.update(self.template_stats(image))
+            space.append((f, scaled))
+        return space
+
+    def set_scale_space(self, factors=(0.8, 0.9, 1.0, 1.1, 1.25), names=None):
+        """ Set the scales of the scale spaces, so the matcher can find the scale that matches best instead of
+        relying on the resolution.json calibration.
+        @param factors: The scale factors relative to the calibrated scale, or None for no scale spaces.
+        @param names: The templates to build scale spaces for, defaults to those scaled with the compass scale.
+        """
+        with self.lock:
+            self.scale_factors = None if factors is None else tuple(factors)
+            if names is not None:
+                self.scale_space_names = set(names)
+            self.scale_space = {}
+            self.scale_locked = {}
+            # Reload the loaded sets with their scale spaces. Other sets get theirs when loaded.
+            for set_name in list(self.loaded_sets):
+                self.unload_set(set_name)
+                self.load_set(set_name)
+
+    def needs_scale_search(self, name) -> bool:
+        """ Returns True if the template has a scale space and its scale has not been locked yet. """
+        return self.scale_factors is not None and name in self.scale_space and name not in self.scale_locked
+
+    def get_scale_space(self, name):
+        """ Returns the list of (factor, template) for the template. """
+        return self.scale_space.get(name, [])
+
+    def lock_scale(self, name, factor: float):
+        """ Use the template at the given factor of the scale space from now on. """
+        with self.lock:
+            for f, templ in self.scale_space.get(name, []):
+                if f == factor:
+                    self.template[name] = templ
+                    self.scale_locked[name] = factor
+                    logger.debug(f"Image_Templates: locked template '{name}' at scale factor {factor}.")
+                    return
+
+    def unlock_scale(self, name=None):
+        """ Search the scale space again for the template, or for all templates if no name is given. """
+        with self.lock:
+            if name is None:
+                self.scale_locked = {}
+            else:
+                self.scale_locked.pop(name, None)
 
     def resource_path(self,relative_path):
         """ Get absolute path to resource, works for dev and for PyInstaller """
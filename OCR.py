@@ -1,6 +1,10 @@
 from __future__ import annotations
 
+import os
+import threading
 import time
+from concurrent.futures import CancelledError, Future
+
 import cv2
 import numpy as np
 from paddleocr import PaddleOCR
@@ -8,6 +12,9 @@ from strsimpy import SorensenDice
 from strsimpy.jaro_winkler import JaroWinkler
 
 from EDlogger import logger
+from Glyph_OCR import GlyphOCR
+from Image_Templates import user_cache_dir
+from Result_Cache import cached, ocr_cache
 
 """
 File:OCR.py    
@@ -19,15 +26,178 @@ Author: Stumpii
 """
 
 
+# OCR engines for single lines of text, see OCR.image_line_ocr
+OCR_ENGINE_PADDLE = 'paddle'
+OCR_ENGINE_GLYPH = 'glyph'  # Glyph_OCR.py, falls back to PaddleOCR
+
+
+def create_paddleocr(language: str = 'en', cpu_threads: int | None = None) -> PaddleOCR:
+    """ Create the PaddleOCR engine. Also used by the OCR worker processes, see OCR_Service.py.
+    @param language: The OCR language.
+    @param cpu_threads: The inference threads, or None for the PaddleOCR default.
+    """
+    options = {} if cpu_threads is None else {'cpu_threads': cpu_threads}
+    return PaddleOCR(use_angle_cls=True, lang=language, use_gpu=False, show_log=False, use_dilation=True,
+                     use_space_char=True, **options)
+
+
+def warm_up(paddleocr) -> float:
+    """ Run the engine once on a synthetic line of text, so the first real OCR does not pay for the
+    inference setup. Returns the time taken in seconds.
+    """
+    image = np.zeros((48, 320, 3), dtype=np.uint8)
+    cv2.putText(image, "STATION SERVICES", (8, 34), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 140, 255), 2)
+    start = time.perf_counter()
+    run_ocr(paddleocr, image, 'full')
+    run_ocr(paddleocr, image, 'line')
+    return time.perf_counter() - start
+
+
+def load_engine(language: str = 'en', cpu_threads: int | None = None):
+    """ Create and warm up the PaddleOCR engine.
+    @return: (engine, report) where the report is a dict of the 'load_s' and 'warm_up_s' times.
+    """
+    start = time.perf_counter()
+    paddleocr = create_paddleocr(language, cpu_threads)
+    report = {'load_s': time.perf_counter() - start}
+    report['warm_up_s'] = warm_up(paddleocr)
+    logger.info(f"OCR engine loaded in {report['load_s']:.2f} s, warmed up in {report['warm_up_s']:.2f} s.")
+    return paddleocr, report
+
+
+def to_bgr(image):
+    """ Returns the image as 3 channel BGR, as expected by the recognition model. """
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    if image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+    return image
+
+
+def run_ocr(paddleocr, image, mode: str):
+    """ Run the OCR engine on an image.
+    @param paddleocr: The PaddleOCR engine.
+    @param image: The image.
+    @param mode: 'full' for detection and recognition, returns (ocr_data, ocr_textlist) or (None, None).
+    'line' for recognition only of a single line, returns (text, confidence).
+    'lines' for recognition only of a list of single line images in one batch, returns a list of
+    (text, confidence).
+    """
+    if mode == 'full':
+        ocr_data = paddleocr.ocr(image)
+        if ocr_data is None:
+            return None, None
+        ocr_textlist = []
+        for res in ocr_data:
+            if res is None:
+                return None, None
+            for line in res:
+                ocr_textlist.append(line[1][0])
+        return ocr_data, ocr_textlist
+
+    elif mode == 'line':
+        ocr_data = paddleocr.ocr(to_bgr(image), det=False, cls=False)
+        if ocr_data is None or ocr_data[0] is None or len(ocr_data[0]) == 0:
+            return '', 0.0
+        text, score = ocr_data[0][0]
+        return text, score
+
+    elif mode == 'lines':
+        if len(image) == 0:
+            return []
+        # A list of images inside a list is recognized as one batch. The images are not converted by
+        # PaddleOCR in this case, so they must be BGR.
+        ocr_data = paddleocr.ocr([[to_bgr(img) for img in image]], det=False, cls=False)
+        if ocr_data is None or ocr_data[0] is None:
+            return [('', 0.0)] * len(image)
+        return [(text, score) for text, score in ocr_data[0]]
+
+    raise ValueError(f"Unknown OCR mode '{mode}'.")
+
+
 class OCR:
-    def __init__(self, screen, language: str = 'en'):
+    def __init__(self, screen, language: str = 'en', service=None, background: bool = False):
+        """
+        @param screen: The Screen to capture from.
+        @param language: The OCR language.
+        @param service: An optional OCRService. OCR then runs in its worker processes instead of this thread
+        and no engine is created here.
+        @param background: Load and warm up the engine on a background thread, so the caller does not wait
+        for the models to load. The first OCR call waits until the engine is ready. See ready.
+        """
         self.screen = screen
-        self.paddleocr = PaddleOCR(use_angle_cls=True, lang=language, use_gpu=False, show_log=False, use_dilation=True,
-                                   use_space_char=True)
+        self.language = language
+        self.service = service
+        self._paddleocr = None
+        self._loader = None  # The background load thread
+        self._closed = False
+        self.load_report = {}
+
+        # Completes with the load report when the engine is loaded and warmed up
+        self.ready = Future()
+        if service is not None:
+            self.ready = service.ready
+        elif background:
+            self._loader = threading.Thread(target=self._load_engine, name="OCR engine loader", daemon=True)
+            self._loader.start()
+        else:
+            self._load_engine()
+
+        # Fast OCR of HUD text, learned from PaddleOCR results. See image_line_ocr.
+        self.glyph_ocr = GlyphOCR()
+        # Glyphs are learned into the user's cache folder. Until some are, the glyphs shipped in configs are used.
+        self.glyph_file = os.path.join(user_cache_dir(), f"glyphs_{language}.npz")
+        self.glyph_seed_file = f"configs/glyphs_{language}.npz"
+        self.glyph_min_confidence = 0.9  # Below this, PaddleOCR is used instead
+        self.glyph_learn = True  # Learn glyphs from confident PaddleOCR results
+        if not self.glyph_ocr.load(self.glyph_file):
+            self.glyph_ocr.load(self.glyph_seed_file)
+
         # Class for text similarity metrics
         self.jarowinkler = JaroWinkler()
         self.sorensendice = SorensenDice()
 
+    def _load_engine(self):
+        # Not started if closed before the load thread ran
+        if not self.ready.set_running_or_notify_cancel():
+            return
+        try:
+            paddleocr, report = load_engine(self.language)
+        except Exception as e:
+            logger.error(f"Unable to load the OCR engine: {e}")
+            self.ready.set_exception(e)
+            return
+
+        if self._closed:
+            # Closed while loading, so drop the engine
+            self.ready.set_exception(CancelledError())
+            return
+        self._paddleocr, self.load_report = paddleocr, report
+        self.ready.set_result(self.load_report)
+
+    def close(self, wait: bool = True):
+        """ Stop using this OCR. A background load that has not started is cancelled, one in progress
+        drops its engine when done.
+        @param wait: Wait for a background load in progress to finish.
+        """
+        self._closed = True
+        if self.service is None:
+            self.ready.cancel()
+        if wait and self._loader is not None:
+            self._loader.join()
+        self._paddleocr = None
+
+    @property
+    def paddleocr(self):
+        """ The PaddleOCR engine. Waits for it to load if loading in the background. """
+        if self._paddleocr is None and self.service is None:
+            self.ready.result()
+        return self._paddleocr
+
+    def is_ready(self) -> bool:
+        """ Returns True if the engine is loaded and an OCR call will not wait for it. """
+        return self.ready.done() and self.ready.exception() is None
+
     def string_similarity(self, s1, s2) -> float:
         """ Performs a string similarity check and returns the result.
         @param s1: The first string to compare.
@@ -37,6 +207,13 @@ class OCR:
         #return self.jarowinkler.similarity(s1, s2)
         return self.sorensendice.similarity(s1, s2)
 
+    def _ocr(self, image, mode: str):
+        """ Run OCR in this thread, or in the service if there is one. See run_ocr(). """
+        if self.service is not None:
+            return self.service.ocr(image, mode)
+        return run_ocr(self.paddleocr, image, mode)
+
+    @cached(ocr_cache, state=lambda self: (self.language,))
     def image_ocr(self, image):
         """ Perform OCR with no filtering. Returns the full OCR data and a simplified list of strings.
         This routine is the slower than the simplified OCR.
@@ -44,23 +221,9 @@ class OCR:
         OCR Data is returned in the following format, or (None, None):
         [[[[[86.0, 8.0], [208.0, 8.0], [208.0, 34.0], [86.0, 34.0]], ('ROBIGO 1 A', 0.9815958738327026)]]]
         """
-        ocr_data = self.paddleocr.ocr(image)
-
-        # print(ocr_data)
-
-        if ocr_data is None:
-            return None, None
-        else:
-            ocr_textlist = []
-            for res in ocr_data:
-                if res is None:
-                    return None, None
-                for line in res:
-                    ocr_textlist.append(line[1][0])
-
-            #print(ocr_textlist)
-            return ocr_data, ocr_textlist
+        return self._ocr(image, 'full')
 
+    @cached(ocr_cache, state=lambda self: (self.language,))
     def image_simple_ocr(self, image) -> list[str] | None:
         """ Perform OCR with no filtering. Returns a simplified list of strings with no positional data.
         This routine is faster than the function that returns the full data. Generally good when you
@@ -69,39 +232,78 @@ class OCR:
         OCR Data is returned in the following format, or None:
         [[[[[86.0, 8.0], [208.0, 8.0], [208.0, 34.0], [86.0, 34.0]], ('ROBIGO 1 A', 0.9815958738327026)]]]
         """
-        ocr_data = self.paddleocr.ocr(image)
-
-        # print(f"image_simple_ocr: {ocr_data}")
-
-        if ocr_data is None:
-            return None
-        else:
-            ocr_textlist = []
-            for res in ocr_data:
-                if res is None:
-                    return None
-
-                for line in res:
-                    ocr_textlist.append(line[1][0])
-
-            # print(f"image_simple_ocr: {ocr_textlist}")
-            # logger.info(f"image_simple_ocr: {ocr_textlist}")
-            return ocr_textlist
+        ocr_data, ocr_textlist = self._ocr(image, 'full')
+        return ocr_textlist
+
+    def image_line_ocr(self, image, engine: str = OCR_ENGINE_PADDLE):
+        """ Perform recognition only OCR of an image known to hold a single line of text, i.e. a highlighted
+        row or a tab header. Text detection and angle classification are skipped, which makes this much
+        faster than image_simple_ocr. Returns the same simplified list of strings, or None.
+        @param image: The image of the line of text.
+        @param engine: OCR_ENGINE_PADDLE, or OCR_ENGINE_GLYPH for the glyph engine, which takes about a
+        millisecond for HUD text in the game font. If the glyph engine is not confident, PaddleOCR is used
+        and its result is learned by the glyph engine.
+        """
+        text, score = self.image_line_ocr_data(image, engine)
+        return [text] if text != '' else None
+
+    @cached(ocr_cache, state=lambda self: (self.language,))
+    def image_line_ocr_data(self, image, engine: str = OCR_ENGINE_PADDLE) -> (str, float):
+        """ Same as image_line_ocr, but returns the (text, confidence) of the line. The text is '' if none
+        was read. """
+        if engine == OCR_ENGINE_GLYPH:
+            text, score = self.glyph_ocr.recognize(image)
+            if score >= self.glyph_min_confidence:
+                return text, score
+
+        text, score = self._ocr(image, 'line')
+        if engine == OCR_ENGINE_GLYPH and self.glyph_learn and text != '' and score >= self.glyph_min_confidence:
+            self.learn_glyphs(image, text)
+        return text, score
+
+    def learn_glyphs(self, image, text: str):
+        """ Learn the glyphs of a line of text for the glyph engine and save them if any are new.
+        @param image: The image of the line of text.
+        @param text: The text, i.e. as read by PaddleOCR.
+        """
+        known = len(self.glyph_ocr.labels)
+        if self.glyph_ocr.learn(image, text) and len(self.glyph_ocr.labels) > known:
+            logger.debug(f"Learned {len(self.glyph_ocr.labels) - known} glyphs from '{text}'.")
+            self.glyph_ocr.save(self.glyph_file)
+
+    def image_lines_ocr(self, images) -> list[tuple[str, float]]:
+        """ Perform recognition only OCR of several single line images, i.e. the rows of a list cut from one
+        capture, in one batched inference. Returns a (text, confidence) for each image, in order.
+        @param images: List of images, each holding a single line of text.
+        """
+        return self._ocr(list(images), 'lines')
 
-    def get_highlighted_item_data(self, image, min_w, min_h):
+    def get_highlighted_item_data(self, image, min_w, min_h, single_line: bool = False,
+                                  engine: str = OCR_ENGINE_PADDLE):
         """ Attempts to find a selected item in an image. The selected item is identified by being solid orange or blue
             rectangle with dark text, instead of orange/blue text on a dark background.
             The OCR daya of the first item matching the criteria is returned, otherwise None.
             @param image: The image to check.
             @param min_w: The minimum width of the text block.
             @param min_h: The minimum height of the text block.
+            @param single_line: The item is one line of text, i.e. a tab header. Uses the faster recognition
+            only OCR and returns the whole item as the box of the OCR data.
+            @param engine: The OCR engine for a single line, see image_line_ocr.
         """
         # Find the selected item/menu (solid orange)
         img_selected, x, y = self.get_highlighted_item_in_image(image, min_w, min_h)
         if img_selected is not None:
             # cv2.imshow("img", img_selected)
 
-            ocr_data, ocr_textlist = self.image_ocr(img_selected)
+            if single_line:
+                ocr_data, ocr_textlist = None, None
+                text, score = self.image_line_ocr_data(img_selected, engine)
+                if text != '':
+                    h, w = img_selected.shape[:2]
+                    box = [[0.0, 0.0], [float(w), 0.0], [float(w), float(h)], [0.0, float(h)]]
+                    ocr_data, ocr_textlist = [[[box, (text, score)]]], [text]
+            else:
+                ocr_data, ocr_textlist = self.image_ocr(img_selected)
 
             if ocr_data is not None:
                 return img_selected, ocr_data, ocr_textlist
@@ -126,15 +328,12 @@ class OCR:
         upper_range = np.array([255, 255, 255])
         mask = cv2.inRange(hsv, lower_range, upper_range)
         masked_image = cv2.bitwise_and(image, image, mask=mask)
-        cv2.imwrite('test/nav-panel/out/masked.png', masked_image)
 
         # Convert to gray scale and invert
         gray = cv2.cvtColor(masked_image, cv2.COLOR_BGR2GRAY)
-        cv2.imwrite('test/nav-panel/out/gray.png', gray)
 
         # Convert to B&W to allow FindContours to find rectangles.
         ret, thresh1 = cv2.threshold(gray, 0, 255, cv2.THRESH_OTSU)  # | cv2.THRESH_BINARY_INV)
-        cv2.imwrite('test/nav-panel/out/thresh1.png', thresh1)
 
         # Finding contours in B&W image. White are the areas detected
         contours, hierarchy = cv2.findContours(thresh1, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
@@ -164,9 +363,12 @@ class OCR:
         """
         rect = region['rect']
         image = self.screen.get_screen_rect_pct(rect)
+        if image is not None:
+            self.screen.record_region('ocr', self.screen.screen_rect_to_abs(rect), image)
         return image
 
-    def is_text_in_selected_item_in_image(self, img, text, min_w, min_h):
+    def is_text_in_selected_item_in_image(self, img, text, min_w, min_h, single_line: bool = False,
+                                          engine: str = OCR_ENGINE_PADDLE):
         """ Does the selected item in the region include the text being checked for.
         Checks if text exists in a region using OCR.
         Return True if found, False if not and None if no item was selected.
@@ -174,13 +376,18 @@ class OCR:
         @param min_w: Minimum width in pixels.
         @param img: The image to check.
         @param text: The text to find.
+        @param single_line: The items are one line of text, so use the faster recognition only OCR.
+        @param engine: The OCR engine for a single line, see image_line_ocr.
         """
         img_selected, x, y = self.get_highlighted_item_in_image(img, min_w, min_h)
         if img_selected is None:
             logger.debug(f"Did not find a selected item in the region.")
             return None
 
-        ocr_textlist = self.image_simple_ocr(img_selected)
+        if single_line:
+            ocr_textlist = self.image_line_ocr(img_selected, engine=engine)
+        else:
+            ocr_textlist = self.image_simple_ocr(img_selected)
         # print(str(ocr_textlist))
 
         if text.upper() in str(ocr_textlist):
@@ -190,18 +397,21 @@ class OCR:
             logger.debug(f"Did not find '{text}' text in item text '{str(ocr_textlist)}'.")
             return False
 
-    def is_text_in_region(self, text, region) -> (bool, str):
+    def is_text_in_region(self, text, region, single_line: bool = False,
+                          engine: str = OCR_ENGINE_PADDLE) -> (bool, str):
         """ Does the region include the text being checked for. The region does not need
         to include highlighted areas.
         Checks if text exists in a region using OCR.
         Return True if found, False if not and None if no item was selected.
         @param text: The text to check for.
         @param region: The region to check in % (0.0 - 1.0).
+        @param single_line: The region holds one line of text, so use the faster recognition only OCR.
+        @param engine: The OCR engine for a single line, see image_line_ocr.
         """
 
         img = self.capture_region_pct(region)
 
-        ocr_textlist = self.image_simple_ocr(img)
+        ocr_textlist = self.image_line_ocr(img, engine=engine) if single_line else self.image_simple_ocr(img)
         # print(str(ocr_textlist))
 
         if text.upper() in str(ocr_textlist):
@@ -211,7 +421,205 @@ class OCR:
             logger.debug(f"Did not find '{text}' text in item text '{str(ocr_textlist)}'.")
             return False, str(ocr_textlist)
 
-    def select_item_in_list(self, text, region, keys, min_w, min_h) -> bool:
+    def get_list_rows(self, image, selected_y: int, selected_h: int, row_h: int,
+                      selected_text: str = '') -> (list[str], int):
+        """ OCR a whole list and split it into rows.
+        @param image: The image of the list.
+        @param selected_y: The top of the selected (highlighted) item in the image.
+        @param selected_h: The height of the selected item.
+        @param row_h: The approximate row height, text lines closer than half of this are one row.
+        @param selected_text: The text of the selected item, used if the whole list OCR does not read it.
+        @return: (The text of each row from the top, the index of the selected row).
+        """
+        ocr_data, ocr_textlist = self.image_ocr(image)
+
+        # (y center, x, text) of each line of text found
+        lines = []
+        if ocr_data is not None:
+            for res in ocr_data:
+                for box, (line_text, score) in res:
+                    ys = [p[1] for p in box]
+                    lines.append(((min(ys) + max(ys)) / 2, box[0][0], line_text))
+
+        # The selected row may not be read, as its text is dark on a light background
+        sel_center = selected_y + selected_h / 2
+        if not any(abs(y - sel_center) < selected_h / 2 for y, x, line_text in lines):
+            lines.append((sel_center, 0, selected_text))
+        lines.sort()
+
+        # Group the lines into rows, i.e. a name and a distance in two columns
+        rows = []  # [y center, [(x, text)]]
+        for y, x, line_text in lines:
+            if len(rows) > 0 and y - rows[-1][0] < row_h / 2:
+                rows[-1][1].append((x, line_text))
+            else:
+                rows.append([y, [(x, line_text)]])
+
+        texts = [' '.join(t for x, t in sorted(parts) if t != '') for y, parts in rows]
+        selected = int(np.argmin([abs(y - sel_center) for y, parts in rows]))
+        return texts, selected
+
+    def find_in_rows(self, text, rows: list[str], min_similarity: float) -> int | None:
+        """ Returns the index of the row that best matches the text, or None if none match well enough.
+        A row equal to the text is the best match, then a row containing the text, then the most similar. """
+        best = None
+        best_similarity = 0.0
+        for i, row in enumerate(rows):
+            if row.upper() == text.upper():
+                similarity = 3.0
+            elif text.upper() in row.upper():
+                similarity = 2.0
+            else:
+                similarity = self.string_similarity(text.upper(), row.upper())
+            if similarity >= min_similarity and similarity > best_similarity:
+                best = i
+                best_similarity = similarity
+        return best
+
+    def is_same_text(self, s1: str, s2: str, min_similarity: float = 0.9) -> bool:
+        """ Returns True if two OCR reads are of the same text, allowing for OCR noise between the reads,
+        i.e. of the same page of a list before and after a key press. """
+        if s1.upper() == s2.upper():
+            return True
+        return self.string_similarity(s1.upper(), s2.upper()) >= min_similarity
+
+    def select_item_in_whole_list(self, text, region, keys, min_w, min_h, single_line: bool = False,
+                                  engine: str = OCR_ENGINE_PADDLE, min_similarity: float = 0.8,
+                                  max_pages: int = 20, page_similarity: float = 0.9) -> bool:
+        """ Attempt to find the item by text in a list defined by the region, by reading the whole visible
+        list at once. The number of rows from the selected item to the item is counted and the keys sent in
+        one go, then the selection is checked once. If the item is not visible, the selection is moved a
+        page past the last visible row to scroll the list, down to the end of the list and then up to the
+        top. The end of the list is a page that reads the same as one already seen. Falls back to
+        select_item_row_by_row if the check fails.
+        If found, leaves it selected for further actions.
+        @param text: Text to find.
+        @param region: The region to check in % (0.0 - 1.0).
+        @param keys: EDKeys instance.
+        @param min_h: Minimum height in pixels of a row.
+        @param min_w: Minimum width in pixels of a row.
+        @param single_line: The items are one line of text, so read the selected item with the faster
+        recognition only OCR.
+        @param engine: The OCR engine for a single line, see image_line_ocr.
+        @param min_similarity: The minimum string similarity of the row text to the text.
+        @param max_pages: The maximum number of pages to scroll.
+        @param page_similarity: The minimum string similarity of two reads of a page for them to be the same
+        page.
+        """
+        seen_pages = []
+        direction = "UI_Down"
+        pressed_down = False
+        for page in range(max_pages):
+            img = self.capture_region_pct(region)
+            if img is None:
+                return False
+
+            img_selected, x, y = self.get_highlighted_item_in_image(img, min_w, min_h)
+            if img_selected is None:
+                # Nothing selected yet, select the first item
+                if pressed_down:
+                    logger.debug(f"No item selected in {region} list.")
+                    return False
+                keys.send("UI_Down")
+                pressed_down = True
+                continue
+
+            # The selected item is dark text on a light background, which is read better on its own
+            if single_line:
+                selected_text = self.image_line_ocr(img_selected, engine=engine)
+            else:
+                selected_text = self.image_simple_ocr(img_selected)
+            selected_text = ' '.join(selected_text) if selected_text is not None else ''
+            rows, selected = self.get_list_rows(img, y, img_selected.shape[0], min_h, selected_text)
+            logger.debug(f"List rows: {rows}, selected row {selected}.")
+
+            index = self.find_in_rows(text, rows, min_similarity)
+            if index is not None:
+                delta = index - selected
+                if delta > 0:
+                    keys.send("UI_Down", repeat=delta)
+                elif delta < 0:
+                    keys.send("UI_Up", repeat=-delta)
+
+                # Check the selection once
+                img = self.capture_region_pct(region)
+                if img is not None and self.is_text_in_selected_item_in_image(img, text, min_w, min_h,
+                                                                              single_line, engine):
+                    logger.debug(f"Found '{text}' in {region} list.")
+                    return True
+                logger.debug(f"Selected row is not '{text}', searching row by row.")
+                return self.select_item_row_by_row(text, region, keys, min_w, min_h, single_line, engine,
+                                                   similarity=page_similarity)
+
+            # The list did not scroll or wrapped to a page already seen, so this is the end of the list.
+            # Search up from here, unless already searching up. OCR of the same page can differ a little
+            # between reads, so the pages are compared by similarity.
+            page_text = ' '.join(rows)
+            if any(self.is_same_text(page_text, seen, page_similarity) for seen in seen_pages):
+                if direction == "UI_Up":
+                    break
+                direction = "UI_Up"
+                seen_pages = []
+            seen_pages.append(page_text)
+
+            # Next page. Move to the last (or first) visible row, then a page further to scroll.
+            if direction == "UI_Down":
+                keys.send(direction, repeat=(len(rows) - 1 - selected) + max(1, len(rows) - 1))
+            else:
+                keys.send(direction, repeat=selected + max(1, len(rows) - 1))
+
+        logger.debug(f"Did not find '{text}' in {region} list.")
+        return False
+
+    def select_item_row_by_row(self, text, region, keys, min_w, min_h, single_line: bool = False,
+                               engine: str = OCR_ENGINE_PADDLE, max_rows: int = 200,
+                               similarity: float = 0.9) -> bool:
+        """ Attempt to find the item by text in a list defined by the region, checking the selected item
+        one row at a time, down to the end of the list and then up to the top. The end of the list is when
+        a key press leaves the same item selected in the same place.
+        If found, leaves it selected for further actions.
+        @param text: Text to find.
+        @param region: The region to check in % (0.0 - 1.0).
+        @param keys: EDKeys instance.
+        @param min_h: Minimum height in pixels.
+        @param min_w: Minimum width in pixels.
+        @param single_line: The items are one line of text, so use the faster recognition only OCR.
+        @param engine: The OCR engine for a single line, see image_line_ocr.
+        @param max_rows: The maximum number of rows to check in each direction.
+        @param similarity: The minimum string similarity of two reads of an item for them to be the same.
+        """
+        for direction in ["UI_Down", "UI_Up"]:
+            last = None  # (y, text) of the last selected item
+            for row in range(max_rows):
+                img = self.capture_region_pct(region)
+                if img is None:
+                    return False
+
+                img_selected, x, y = self.get_highlighted_item_in_image(img, min_w, min_h)
+                if img_selected is None:
+                    logger.debug(f"No item selected in {region} list.")
+                    return False
+
+                if single_line:
+                    ocr_textlist = self.image_line_ocr(img_selected, engine=engine)
+                else:
+                    ocr_textlist = self.image_simple_ocr(img_selected)
+                item_text = ' '.join(ocr_textlist) if ocr_textlist is not None else ''
+                if text.upper() in item_text.upper():
+                    logger.debug(f"Found '{text}' in {region} list.")
+                    return True
+
+                # The selection did not move, so this is the end of the list in this direction
+                if last is not None and last[0] == y and self.is_same_text(item_text, last[1], similarity):
+                    break
+                last = (y, item_text)
+                keys.send(direction)
+
+        logger.debug(f"Did not find '{text}' in {region} list.")
+        return False
+
+    def select_item_in_list(self, text, region, keys, min_w, min_h, single_line: bool = False,
+                            engine: str = OCR_ENGINE_PADDLE, whole_list: bool = False) -> bool:
         """ Attempt to find the item by text in a list defined by the region.
         If found, leaves it selected for further actions.
         @param keys:
@@ -219,7 +627,13 @@ class OCR:
         @param region: The region to check in % (0.0 - 1.0).
         @param min_h: Minimum height in pixels.
         @param min_w: Minimum width in pixels.
+        @param single_line: The items are one line of text, so use the faster recognition only OCR.
+        @param engine: The OCR engine for a single line, see image_line_ocr.
+        @param whole_list: Read the whole visible list at once instead of checking one item at a time,
+        see select_item_in_whole_list. Much faster for long lists.
         """
+        if whole_list:
+            return self.select_item_in_whole_list(text, region, keys, min_w, min_h, single_line, engine)
 
         in_list = False  # Have we seen one item yet? Prevents quiting if we have not selected the first item.
         while 1:
@@ -227,7 +641,7 @@ class OCR:
             if img is None:
                 return False
 
-            found = self.is_text_in_selected_item_in_image(img, text, min_w, min_h)
+            found = self.is_text_in_selected_item_in_image(img, text, min_w, min_h, single_line, engine)
 
             # Check if end of list.
             if found is None and in_list:
@@ -242,12 +656,15 @@ class OCR:
                 in_list = True
                 keys.send("UI_Down")
 
-    def wait_for_text(self, ap, texts: list[str], region, timeout=30) -> bool:
+    def wait_for_text(self, ap, texts: list[str], region, timeout=30, single_line: bool = False,
+                      engine: str = OCR_ENGINE_PADDLE) -> bool:
         """ Wait for a screen to appear by checking for text to appear in the region.
         @param ap: ED_AP instance.
         @param texts: List of text to check for. Success occurs if any in the list is found.
         @param region: The region to check in % (0.0 - 1.0).
         @param timeout: Time to wait for screen in seconds
+        @param single_line: The region holds one line of text, so use the faster recognition only OCR.
+        @param engine: The OCR engine for a single line, see image_line_ocr.
         """
         abs_rect = self.screen.screen_rect_to_abs(region['rect'])
 
@@ -258,11 +675,16 @@ class OCR:
             if time.time() > (start_time + timeout):
                 break
 
-            # Check if screen has appeared.
+            # Check if screen has appeared. OCR the region once and check for each text.
+            img = self.capture_region_pct(region)
+            ocr_textlist = None
+            if img is not None:
+                ocr_textlist = self.image_line_ocr(img, engine=engine) if single_line else self.image_simple_ocr(img)
             for text in texts:
-                text_found, ocr_text = self.is_text_in_region(text, region)
+                text_found = text.upper() in str(ocr_textlist)
 
                 if text_found:
+                    logger.debug(f"Found '{text}' text in item text '{str(ocr_textlist)}'.")
                     break
 
             if text_found:
@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import os
+import queue
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import numpy as np
+
+from OCR import load_engine, run_ocr, to_bgr
+from Region_Evaluator import SharedFrame
+
+"""
+File:OCR_Service.py
+
+Description:
+  Runs PaddleOCR in worker processes, so OCR does not block the autopilot thread and uses more than one
+  CPU core. Images are passed to the workers through shared memory slots, only the mode and the results
+  are pickled. Each worker loads its own engine once, when it starts.
+
+  submit() returns a Future, so a panel can start the OCR of a region and send keys while it runs, i.e.:
+    future = service.submit(image, 'full')
+    keys.send('UI_Down')
+    ocr_data, ocr_textlist = future.result()
+
+  Pass the service to OCR, i.e. OCR(screen, service=OCRService(w, h)), to run the existing OCR methods
+  in the workers. See run_ocr() in OCR.py for the modes and results.
+
+  The workers start and warm up their engines in the background as soon as the service is created.
+  The ready Future completes when they have all loaded.
+"""
+
+# Worker process state, set by _init_ocr_worker
+_ocr_worker = {}
+
+
+def _init_ocr_worker(frame_names, shape, language, cpu_threads):
+    _ocr_worker['frames'] = [SharedFrame(shape, name=name) for name in frame_names]
+    _ocr_worker['paddleocr'], _ocr_worker['report'] = load_engine(language, cpu_threads)
+
+
+def _worker_report():
+    """ Runs in the worker. Returns the engine load report of the worker. """
+    return dict(_ocr_worker['report'], pid=os.getpid())
+
+
+def _ocr_job(slot, size, mode, image=None):
+    """ Runs in the worker. OCR the image in the slot, or the image passed if it did not fit a slot. """
+    if image is None:
+        # Copy, the slot is reused once this job completes
+        image = _ocr_worker['frames'][slot].view(*size).copy()
+    return run_ocr(_ocr_worker['paddleocr'], image, mode)
+
+
+def _gather(futures) -> Future:
+    """ Returns a Future of the list of results of the futures, in order. """
+    result = Future()
+    remaining = [len(futures)]
+
+    def done(f):
+        remaining[0] = remaining[0] - 1
+        if remaining[0] == 0 and not result.done():
+            try:
+                result.set_result([f.result() for f in futures])
+            except Exception as e:
+                result.set_exception(e)
+
+    if len(futures) == 0:
+        result.set_result([])
+    for f in futures:
+        f.add_done_callback(done)
+    return result
+
+
+class OCRService:
+    """ A pool of OCR worker processes fed through shared memory slots. Thread safe. """
+
+    def __init__(self, width: int, height: int, workers: int = 1, slots: int | None = None,
+                 language: str = 'en'):
+        """
+        @param width: The maximum image width, i.e. the screen width.
+        @param height: The maximum image height.
+        @param workers: The number of worker processes, each with its own engine.
+        @param slots: The number of shared memory slots, defaults to two per worker. Submit waits for a
+        free slot.
+        @param language: The OCR language.
+        """
+        if slots is None:
+            slots = 2 * workers
+        # Share the cores between the workers instead of each engine using them all
+        cpu_threads = max(1, (os.cpu_count() or 2) // workers)
+
+        shape = (height, width, 3)
+        self._frames = [SharedFrame(shape) for i in range(slots)]
+        self._free_slots = queue.Queue()
+        for i in range(slots):
+            self._free_slots.put(i)
+        self._pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_ocr_worker,
+                                         initargs=([f.name for f in self._frames], shape, language, cpu_threads))
+
+        # Start the workers now, rather than on the first OCR. Completes with the list of load reports.
+        self.ready = _gather([self._pool.submit(_worker_report) for i in range(workers)])
+
+    def submit(self, image, mode: str = 'full') -> Future:
+        """ Start the OCR of an image.
+        @param image: The image, or for mode 'lines' a list of single line images, which are recognized in
+        parallel by the workers.
+        @param mode: See run_ocr() in OCR.py.
+        @return: A Future of the result of run_ocr().
+        """
+        if mode == 'lines':
+            return _gather([self.submit(img, 'line') for img in image])
+
+        image = to_bgr(image)
+        h, w = image.shape[:2]
+        if h > self._frames[0].shape[0] or w > self._frames[0].shape[1]:
+            # Too large for a slot, so pickle it
+            return self._pool.submit(_ocr_job, None, None, mode, np.ascontiguousarray(image))
+
+        slot = self._free_slots.get()
+        try:
+            size = self._frames[slot].write(image)
+            future = self._pool.submit(_ocr_job, slot, size, mode)
+        except Exception:
+            self._free_slots.put(slot)
+            raise
+        future.add_done_callback(lambda f: self._free_slots.put(slot))
+        return future
+
+    def ocr(self, image, mode: str = 'full'):
+        """ Same as submit, but waits for and returns the result. """
+        return self.submit(image, mode).result()
+
+    def shutdown(self):
+        """ Stop the workers and release the shared memory. """
+        self._pool.shutdown(wait=True)
+        for frame in self._frames:
+            frame.close()
+        self._frames = []
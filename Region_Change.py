@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import time
+
+import cv2
+
+"""
+File:Region_Change.py
+
+Description:
+  Change detection for screen regions. Regions like the compass and target change very little
+  between iterations in long supercruise legs, so re-filtering and re-matching them gives the same
+  result. The detector keeps a small downsampled copy (signature) of the region for each cached result
+  and reports the region as unchanged while the mean absolute difference to it is within a tolerance.
+"""
+
+
+class RegionChangeDetector:
+    """ Caches results per key (i.e. region and template) and returns them while the region is unchanged. """
+
+    def __init__(self, tolerance: float = 1.5, refresh_interval: float = 1.0, sig_size: int = 32):
+        """
+        @param tolerance: The mean absolute difference (0-255) of the signatures below which the region
+        is unchanged.
+        @param refresh_interval: The maximum age of a cached result in seconds, after which it is
+        recalculated even if the region has not changed. 0 to always recalculate.
+        @param sig_size: The width of the signature in pixels. The height keeps the region aspect ratio.
+        """
+        self.tolerance = tolerance
+        self.refresh_interval = refresh_interval
+        self.sig_size = sig_size
+        self._cache = {}  # key: (signature, time, result)
+        self.stats = {}  # key: {'hits': n, 'misses': n}
+
+    def signature(self, image):
+        """ Returns the signature of an image, a small area averaged copy. """
+        h, w = image.shape[:2]
+        sw = min(self.sig_size, w)
+        sh = max(1, int(h * sw / w))
+        return cv2.resize(image, (sw, sh), interpolation=cv2.INTER_AREA)
+
+    def get(self, key, image):
+        """ Returns the cached result for the key if the image is unchanged from when the result was stored.
+        @param key: The cache key, i.e. (region name, template name).
+        @param image: The newly captured (unfiltered) region.
+        @return: (result or None, signature). Pass the signature to put() to store a new result.
+        """
+        sig = self.signature(image)
+        stat = self.stats.setdefault(key, {'hits': 0, 'misses': 0})
+
+        cached = self._cache.get(key)
+        if cached is not None:
+            cached_sig, cached_time, result = cached
+            if (cached_sig.shape == sig.shape and time.time() - cached_time < self.refresh_interval and
+                    max(cv2.mean(cv2.absdiff(sig, cached_sig))) <= self.tolerance):
+                stat['hits'] = stat['hits'] + 1
+                return result, sig
+
+        stat['misses'] = stat['misses'] + 1
+        return None, sig
+
+    def put(self, key, sig, result):
+        """ Store a result for the key with the signature returned by get(). """
+        self._cache[key] = (sig, time.time(), result)
+
+    def invalidate(self, key=None):
+        """ Clear the cached result for the key, or all cached results if no key is given. """
+        if key is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(key, None)
+
+    def get_stats(self) -> dict:
+        """ Returns the hits, misses and hit rate per key, and the totals under 'total'. """
+        out = {}
+        total_hits = 0
+        total_misses = 0
+        for key, stat in self.stats.items():
+            calls = stat['hits'] + stat['misses']
+            out[key] = {'hits': stat['hits'], 'misses': stat['misses'],
+                        'hit_rate': stat['hits'] / calls if calls > 0 else 0.0}
+            total_hits = total_hits + stat['hits']
+            total_misses = total_misses + stat['misses']
+        calls = total_hits + total_misses
+        out['total'] = {'hits': total_hits, 'misses': total_misses,
+                        'hit_rate': total_hits / calls if calls > 0 else 0.0}
+        return out
+
+    def reset_stats(self):
+        self.stats = {}
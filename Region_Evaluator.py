@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import atexit
+import os
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from Region_Filters import ColorFilter, EqualizeFilter, SunFilter
+from Template_Matching import METHOD_CCOEFF, match_with_method
+
+"""
+File:Region_Evaluator.py
+
+Description:
+  Evaluates independent region checks (i.e. target, disengage, occlusion and sun) of one captured frame
+  in parallel on a pool of worker processes. The frame is written once to shared memory, which the
+  workers map, so no image is pickled. Only the small job descriptions and results cross the process
+  boundary, and the templates are sent once when the workers start.
+
+  A job is a dict:
+    'name': The job name, i.e. the region name. Results are returned by this name.
+    'rect': The [L, T, R, B] of the region in frame pixels.
+    'filter': (kind, param) with kind 'equalize', 'color' (param is the HSV color range), 'sun' (param
+        is the threshold) or None for no filter.
+    'template': The template name to match, or None to return the percentage of lit pixels instead.
+    'method': The matching method, one of the METHOD_ constants in Template_Matching.py. Defaults to
+        METHOD_CCOEFF.
+
+  The evaluator is opt-in, nothing creates one by default. Create one with
+  Screen_Regions.create_region_evaluator() and pass it to Screen_Regions.evaluate_regions(). The workers
+  and shared memory are released by shutdown(), or when the application exits. A frozen (PyInstaller)
+  entry point must call multiprocessing.freeze_support() for the workers to start.
+"""
+
+
+class SharedFrame:
+    """ An image buffer in shared memory. The creating process writes images, other processes attach by
+    name and read them as a numpy array without copying. """
+
+    def __init__(self, shape, dtype=np.uint8, name: str | None = None):
+        """
+        @param shape: The maximum image shape, i.e. (height, width, 4).
+        @param dtype: The image data type.
+        @param name: The name of an existing block to attach to, or None to create a new block.
+        """
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        size = int(np.prod(self.shape)) * self.dtype.itemsize
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def write(self, image):
+        """ Copy an image into the top left of the buffer.
+        @return: The (height, width) of the image.
+        """
+        h, w = image.shape[:2]
+        if h > self.shape[0] or w > self.shape[1] or image.shape[2:] != self.shape[2:]:
+            raise ValueError(f"Image of shape {image.shape} does not fit shared frame of shape {self.shape}.")
+        np.copyto(self.array[:h, :w], image)
+        return h, w
+
+    def view(self, h: int, w: int):
+        """ Returns a view of the top left (h, w) of the buffer. """
+        return self.array[:h, :w]
+
+    def close(self):
+        """ Close the block, and remove it if this process created it. """
+        self.array = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+# Worker process state, set by _init_worker
+_worker = {}
+
+
+def _init_worker(frame_names, shape, templates):
+    _worker['frames'] = [SharedFrame(shape, name=name) for name in frame_names]
+    _worker['templates'] = templates
+    _worker['pipelines'] = {}
+
+
+def _make_pipeline(kind, param, w: int, h: int):
+    if kind == 'equalize':
+        return EqualizeFilter(w, h)
+    elif kind == 'color':
+        return ColorFilter(w, h, param)
+    elif kind == 'sun':
+        return SunFilter(w, h, lambda: param)
+    return None
+
+
+def _evaluate_job(slot: int, size, job: dict):
+    """ Runs in the worker. Filter the job's region of the frame in the slot and match its template.
+    @return: (minVal, maxVal, minLoc, maxLoc) if the job has a template, else the percent of lit pixels.
+    """
+    frame = _worker['frames'][slot].view(*size)
+    rect = job['rect']
+    scr = frame[rect[1]:rect[3], rect[0]:rect[2]]
+
+    filtered = scr
+    if job['filter'] is not None:
+        kind, param = job['filter']
+        key = (job['name'], kind, str(param))
+        pipeline = _worker['pipelines'].get(key)
+        if pipeline is None:
+            pipeline = _make_pipeline(kind, param, scr.shape[1], scr.shape[0])
+            _worker['pipelines'][key] = pipeline
+        filtered = pipeline(scr, 'BGRA')
+
+    if job['template'] is None:
+        return int(cv2.countNonZero(filtered) / filtered.size * 100)
+
+    templ = _worker['templates'][job['template']]
+    (minVal, maxVal, minLoc, maxLoc), match = match_with_method(filtered, templ, job.get('method', METHOD_CCOEFF))
+    return minVal, maxVal, minLoc, maxLoc
+
+
+class RegionEvaluator:
+    """ Fans the region jobs of a frame out to a pool of worker processes. Frames are written to a small
+    ring of shared memory slots, so the next frame can be submitted while the jobs of the previous one
+    are still running. A slot is only overwritten when all the jobs reading it are done. """
+
+    def __init__(self, templates: dict, width: int, height: int, workers: int | None = None, slots: int = 2):
+        """
+        @param templates: The templates by name, dicts with the 'image' and 'binary' of the template as in
+        Image_Templates. Sent to each worker once.
+        @param width: The maximum frame width.
+        @param height: The maximum frame height.
+        @param workers: The number of worker processes, defaults to the CPU count less one.
+        @param slots: The number of shared frame slots.
+        """
+        if workers is None:
+            workers = max(1, (os.cpu_count() or 2) - 1)
+        shape = (height, width, 4)
+        self._frames = [SharedFrame(shape) for i in range(slots)]
+        self._slot_futures = [[] for i in range(slots)]
+        self._next_slot = 0
+        self._pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                         initargs=([f.name for f in self._frames], shape, templates))
+        # Release the workers and shared memory on exit if shutdown() is not called
+        atexit.register(self.shutdown)
+
+    def submit(self, frame, jobs) -> dict:
+        """ Submit the jobs for a BGRA frame.
+        @param frame: The BGRA frame, the job rects are relative to it.
+        @param jobs: A list of job dicts, see the module description.
+        @return: A dict of job name: Future. The future's result is (minVal, maxVal, minLoc, maxLoc) for a
+        template job, or the percent of lit pixels for a job with no template.
+        """
+        slot = self._next_slot
+        self._next_slot = (slot + 1) % len(self._frames)
+
+        # Wait for the jobs still reading this slot before overwriting it
+        wait(self._slot_futures[slot])
+        size = self._frames[slot].write(frame)
+
+        futures = {job['name']: self._pool.submit(_evaluate_job, slot, size, job) for job in jobs}
+        self._slot_futures[slot] = list(futures.values())
+        return futures
+
+    def evaluate(self, frame, jobs) -> dict:
+        """ Same as submit, but waits for and returns the results by job name. """
+        return {name: future.result() for name, future in self.submit(frame, jobs).items()}
+
+    def shutdown(self):
+        """ Stop the workers and release the shared memory. Does nothing if already shut down. """
+        atexit.unregister(self.shutdown)
+        if not self._frames:
+            return
+        self._pool.shutdown(wait=True)
+        for frame in self._frames:
+            frame.close()
+        self._frames = []
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import cv2
+import numpy as np
+
+from Screen import convert_color
+
+"""
+File:Region_Filters.py
+
+Description:
+  Filter pipelines for screen regions. A pipeline is built once per region at the region's pixel size and
+  owns its scratch and output buffers (and CLAHE instance), writing in place with dst= arguments, so
+  filtering a region allocates nothing per frame.
+  The output buffer is reused on the next call, so copy the result if it must outlive the next filtering
+  of the same region.
+"""
+
+
+class RegionFilter:
+    """ Base class of the filter pipelines. """
+
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self._buffers = {}
+
+    def _buffer(self, name: str, shape, dtype=np.uint8):
+        """ Returns the named buffer, (re)allocated only if the shape has changed (i.e. a clipped region). """
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != shape:
+            buf = np.empty(shape, dtype=dtype)
+            self._buffers[name] = buf
+        return buf
+
+    def _convert(self, image, fmt: str, target: str):
+        """ Convert the image to the target colour space in a scratch buffer. """
+        if fmt.lower() == target:
+            return image
+        h, w = image.shape[:2]
+        shape = (h, w, 3) if target == 'hsv' else (h, w)
+        return convert_color(image, fmt, target, dst=self._buffer(target, shape))
+
+    def __call__(self, image, fmt: str = 'BGR'):
+        raise NotImplementedError
+
+
+class EqualizeFilter(RegionFilter):
+    """ Grayscale with CLAHE histogram equalization. Same as Screen_Regions.equalize. """
+
+    def __init__(self, width: int, height: int, clip_limit: float = 2.0, tile_grid_size=(8, 8)):
+        super().__init__(width, height)
+        self.clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=tile_grid_size)
+
+    def __call__(self, image, fmt: str = 'BGR'):
+        gray = self._convert(image, fmt, 'gray')
+        out = self._buffer('out', gray.shape)
+        return self.clahe.apply(gray, dst=out)
+
+
+class ColorFilter(RegionFilter):
+    """ HSV colour range mask. Same as Screen_Regions.filter_by_color. """
+
+    def __init__(self, width: int, height: int, color_range):
+        super().__init__(width, height)
+        self.lower = np.asarray(color_range[0])
+        self.upper = np.asarray(color_range[1])
+
+    def __call__(self, image, fmt: str = 'BGR'):
+        hsv = self._convert(image, fmt, 'hsv')
+        out = self._buffer('out', hsv.shape[:2])
+        return cv2.inRange(hsv, self.lower, self.upper, dst=out)
+
+
+class SunFilter(RegionFilter):
+    """ Grayscale brightness threshold. Same as Screen_Regions.filter_sun. The threshold is read from
+    the owner on each call, so Screen_Regions.set_sun_threshold still applies. """
+
+    def __init__(self, width: int, height: int, get_threshold):
+        """
+        @param get_threshold: Function returning the current threshold (0-255).
+        """
+        super().__init__(width, height)
+        self.get_threshold = get_threshold
+
+    def __call__(self, image, fmt: str = 'BGR'):
+        gray = self._convert(image, fmt, 'gray')
+        out = self._buffer('out', gray.shape)
+        cv2.threshold(gray, self.get_threshold(), 255, cv2.THRESH_BINARY, dst=out)
+        return out
@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+import copy
+import functools
+import hashlib
+import inspect
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+"""
+File:Result_Cache.py
+
+Description:
+  Memoization of results of image operations (template matching, OCR) keyed by a hash of the image
+  content. Retries on a screen that has not changed, i.e. while waiting on a menu, pass pixel identical
+  images, so the result is returned for the cost of hashing the image instead of a match or OCR inference.
+  The cache holds a fixed number of results, evicting the least recently used, and optionally for a
+  limited time.
+  Lists and dicts in cached results are copied for each caller, arrays are shared, so do not modify them.
+
+  A cache can also key images by a perceptual signature instead of the exact content, so a screen with
+  a little flicker or noise, but the same content, still hits. This suits OCR, where a new result
+  is only needed when the text changes. Use a time limit with perceptual keys, to bound how long a
+  missed change can return an old result.
+"""
+
+
+def content_hash(image) -> bytes:
+    """ Returns a hash of the image content, shape and type. """
+    image = np.ascontiguousarray(image)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str((image.shape, image.dtype.str)).encode())
+    h.update(image.data)
+    return h.digest()
+
+
+def signature(image, cell: int = 4):
+    """ Returns the perceptual signature of an image, a gray copy area averaged over cells of cell x cell
+    pixels. Averaging removes pixel noise, and the cells are small enough that a changed character of
+    text changes some cell by far more than the noise or flicker does.
+    @param image: A gray, BGR or BGRA image.
+    @param cell: The cell size in pixels.
+    """
+    gray = image
+    if image.ndim == 3:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY if image.shape[2] == 4 else cv2.COLOR_BGR2GRAY)
+    h, w = gray.shape[:2]
+    return cv2.resize(gray, (max(1, w // cell), max(1, h // cell)), interpolation=cv2.INTER_AREA)
+
+
+def _key_value(value):
+    if isinstance(value, np.ndarray):
+        return content_hash(value)
+    if isinstance(value, (list, dict, set)):
+        return repr(value)
+    return value
+
+
+def make_key(*values) -> tuple:
+    """ Returns a cache key of the values. Arrays are replaced by their content hash and lists and dicts
+    by their repr. """
+    return tuple(_key_value(v) for v in values)
+
+
+def copy_result(result):
+    """ Returns a copy of the lists and dicts in a result, so a caller can not change the cached result.
+    Arrays and other values are not copied. """
+    if isinstance(result, (list, dict)):
+        return copy.deepcopy(result, {id(v): v for v in _arrays(result)})
+    if isinstance(result, tuple):
+        return tuple(copy_result(v) for v in result)
+    return result
+
+
+def _arrays(value):
+    """ Yields the arrays nested in lists, tuples and dicts. """
+    if isinstance(value, np.ndarray):
+        yield value
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            yield from _arrays(v)
+    elif isinstance(value, dict):
+        for v in value.values():
+            yield from _arrays(v)
+
+
+def make_perceptual_key(*values) -> (tuple, tuple):
+    """ Returns a cache key of the values with the arrays replaced by their shape, and the signatures of
+    the arrays. A result is found for another image if the key is equal and the signatures are close.
+    See ResultCache.get(). """
+    key = tuple(('array', v.shape) if isinstance(v, np.ndarray) else _key_value(v) for v in values)
+    sigs = tuple(signature(v) for v in values if isinstance(v, np.ndarray))
+    return key, sigs
+
+
+class ResultCache:
+    """ A size bounded LRU cache of results with hit/miss statistics. Thread safe. """
+
+    def __init__(self, max_entries: int = 256, ttl: float | None = None, perceptual: bool = False,
+                 tolerance: int = 24):
+        """
+        @param max_entries: The maximum number of results held.
+        @param ttl: The time in seconds a result is valid for, or None for no limit.
+        @param perceptual: Key images by their signature instead of their exact content, see signature().
+        @param tolerance: For a perceptual cache, the largest difference (0-255) of any signature cell for
+        which two images are the same.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.perceptual = perceptual
+        self.tolerance = tolerance
+        self.enabled = True
+        self._entries = OrderedDict()  # (key, signatures hash): (time stored, result, signatures)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def _is_similar(self, sigs, cached_sigs) -> bool:
+        for sig, cached_sig in zip(sigs, cached_sigs):
+            if sig.shape != cached_sig.shape or cv2.absdiff(sig, cached_sig).max() > self.tolerance:
+                return False
+        return True
+
+    def _find(self, key, sigs):
+        """ Returns the entry key of the cached result, or None. Expired results are removed. """
+        entry_key = (key, make_key(*sigs))
+        if entry_key in self._entries or not sigs:
+            candidates = [entry_key]
+        else:
+            # Most recently used first
+            candidates = [k for k in reversed(self._entries) if k[0] == key]
+
+        now = time.monotonic()
+        for k in candidates:
+            if k not in self._entries:
+                continue
+            stored, result, cached_sigs = self._entries[k]
+            if self.ttl is not None and now - stored > self.ttl:
+                del self._entries[k]
+                self.expired = self.expired + 1
+            elif k == entry_key or self._is_similar(sigs, cached_sigs):
+                return k
+        return None
+
+    def get(self, key, sigs=()):
+        """ Returns (True, result) if the key is cached and not expired, else (False, None).
+        @param key: The key, see make_key() and make_perceptual_key().
+        @param sigs: The image signatures for a perceptual key.
+        """
+        with self._lock:
+            k = self._find(key, sigs)
+            if k is None:
+                self.misses = self.misses + 1
+                return False, None
+            self._entries.move_to_end(k)
+            self.hits = self.hits + 1
+            return True, self._entries[k][1]
+
+    def put(self, key, result, sigs=()):
+        with self._lock:
+            k = (key, make_key(*sigs))
+            self._entries[k] = (time.monotonic(), result, sigs)
+            self._entries.move_to_end(k)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions = self.evictions + 1
+
+    def clear(self):
+        """ Clear all cached results, i.e. after the templates are reloaded. """
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> dict:
+        """ Returns the entries, hits, misses, hit rate, evictions and expired results. """
+        with self._lock:
+            calls = self.hits + self.misses
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': self.hits / calls if calls > 0 else 0.0, 'evictions': self.evictions,
+                    'expired': self.expired}
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self.expired = 0
+
+
+# The cache shared by the decorated methods
+shared_cache = ResultCache(64)
+
+# The cache of OCR results. OCR is the slowest call by far, and menus are re-read while waiting on them,
+# so results are keyed on what the text looks like and kept for a few seconds.
+ocr_cache = ResultCache(128, ttl=5.0, perceptual=True)
+
+
+def cached(cache: ResultCache = shared_cache, key=None, state=None):
+    """ Decorator to memoize a method in the cache. The key is the method name and its arguments, with
+    image arrays hashed by content, i.e.:
+        @cached()
+        def image_simple_ocr(self, image):
+    The arguments are keyed by parameter, whether passed by position or keyword or left to their default.
+    The result must only depend on the arguments. If it depends on other state, pass a key function taking
+    the same arguments as the method and returning the values to key on, i.e. the template image for a
+    template name. Images are keyed by their signature if the cache is perceptual.
+    If the result depends on the state of the instance, i.e. the OCR language, pass a state function
+    returning it, so instances in different states do not share results.
+    @param cache: The cache to use.
+    @param key: Optional function (self, *args, **kwargs) -> tuple of values to key on.
+    @param state: Optional function (self) -> tuple of the instance state to key on.
+    """
+    def decorator(func):
+        func_signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if not cache.enabled:
+                return func(self, *args, **kwargs)
+            if key is None:
+                # Bind to the parameters, so positional, keyword and default arguments give the same key
+                bound = func_signature.bind(self, *args, **kwargs)
+                bound.apply_defaults()
+                values = tuple(bound.arguments.values())[1:]
+            else:
+                values = key(self, *args, **kwargs)
+            if cache.perceptual:
+                k, sigs = make_perceptual_key(*values)
+            else:
+                k, sigs = make_key(*values), ()
+            k = (func.__qualname__,) + k
+            if state is not None:
+                k = k + make_key(*state(self))
+
+            found, result = cache.get(k, sigs)
+            if found:
+                return copy_result(result)
+            result = func(self, *args, **kwargs)
+            cache.put(k, copy_result(result), sigs)
+            return result
+        return wrapper
+    return decorator
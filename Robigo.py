@@ -295,8 +295,18 @@ class Robigo:
         return state
 
 
-    # The Robigo Loop
+    # The Robigo Loop, holds the templates it matches loaded while it runs
     def loop(self, ap):
+        templates = ap.scrReg.templates
+        templates.use_set('robigo')
+        templates.use_set('missions')
+        try:
+            self.run_loop(ap)
+        finally:
+            templates.release_set('robigo')
+            templates.release_set('missions')
+
+    def run_loop(self, ap):
         loop_cnt = 0
         
         starttime = time.time()
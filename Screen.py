@@ -1,12 +1,18 @@
 from __future__ import annotations
+import time
 import typing
+from contextlib import contextmanager
 import cv2
-import win32gui
-from numpy import array
-import mss
+import numpy as np
 import json
 
 from EDlogger import logger
+from Screen_Capture import CaptureBackend, CaptureWorker, MssBackend, StillImageBackend
+
+try:
+    import win32gui
+except ImportError:
+    win32gui = None  # Windows only. Without it, ED cannot be found and a replay backend should be used.
 
 
 """
@@ -26,46 +32,76 @@ Author: sumzer0@yahoo.com
 
 elite_dangerous_window = "Elite - Dangerous (CLIENT)"
 
+# Single (fused) colour conversions from a source channel layout to the layout a filter works in.
+# 'BGRA' is the native capture format. 'BGR' is an image as the region filters have always received
+# it, which for screen captures was the inv_col image with the red and blue channels swapped. The
+# filter thresholds and HSV ranges were tuned on that swapped image, so the BGRA codes keep the swap.
+# 'HSV' and 'GRAY' are images already converted for a filter, so they pass through unchanged.
+_CVT_CODES = {
+    ('BGRA', 'hsv'): cv2.COLOR_RGB2HSV,
+    ('BGRA', 'gray'): cv2.COLOR_RGBA2GRAY,
+    ('BGRA', 'bgr'): cv2.COLOR_BGRA2BGR,
+    ('BGR', 'hsv'): cv2.COLOR_BGR2HSV,
+    ('BGR', 'gray'): cv2.COLOR_BGR2GRAY,
+    ('BGR', 'bgr'): None,
+    ('HSV', 'hsv'): None,  # Already converted, i.e. shared between filters
+    ('GRAY', 'gray'): None,
+}
+
+
+def convert_color(image, fmt: str, target: str, dst=None):
+    """ Convert an image from its channel layout to the target layout in a single pass.
+    @param image: The image to convert.
+    @param fmt: The layout of the image, 'BGRA' (native capture), 'BGR', 'HSV' or 'GRAY'.
+    @param target: The required layout, 'hsv', 'gray' or 'bgr'.
+    @param dst: Optional output array to write into.
+    @return: The converted image.
+    """
+    code = _CVT_CODES[(fmt, target)]
+    if code is None:
+        return image
+    return cv2.cvtColor(image, code, dst=dst)
+
 
 class Screen:
-    def __init__(self, cb):
+    def __init__(self, cb, backend: CaptureBackend | None = None):
+        """
+        @param cb: The callback for log messages.
+        @param backend: The capture backend. None for live screen capture of the ED monitor, otherwise
+        i.e. an ImageDirBackend or VideoBackend to run without the game.
+        """
         self.ap_ckb = cb
-        self.mss = mss.mss()
         self.using_screen = True  # True to use screen, false to use an image. Set screen_image to the image
         self._screen_image = None  # Screen image captured from screen, or loaded by user for testing.
 
-        # Find ED window position to determine which monitor it is on
-        ed_rect = self.get_elite_window_rect()
-        if ed_rect is None:
-            self.ap_ckb('log', f"ERROR: Could not find window {elite_dangerous_window}.")
-            logger.error(f'Could not find window {elite_dangerous_window}.')
-        else:
-            logger.debug(f'Found Elite Dangerous window position: {ed_rect}')
-
-        # Examine all monitors to determine match with ED
-        self.mons = self.mss.monitors
-        mon_num = 0
-        for item in self.mons:
-            if mon_num > 0:  # ignore monitor 0 as it is the complete desktop (dims of all monitors)
-                logger.debug(f'Found monitor {mon_num} with details: {item}')
-                if ed_rect is None:
-                    self.monitor_number = mon_num
-                    self.mon = self.mss.monitors[self.monitor_number]
-                    logger.debug(f'Defaulting to monitor {mon_num}.')
-                    self.screen_width = item['width']
-                    self.screen_height = item['height']
-                    break
-                else:
-                    if item['left'] == ed_rect[0] and item['top'] == ed_rect[1]:
-                        # Get information of monitor 2
-                        self.monitor_number = mon_num
-                        self.mon = self.mss.monitors[self.monitor_number]
-                        logger.debug(f'Elite Dangerous is on monitor {mon_num}.')
-                        self.screen_width = item['width']
-                        self.screen_height = item['height']
-
-            # Next monitor
-            mon_num = mon_num + 1
+        # Frame broker. One grab per tick covering the union of the requested regions, regions are
+        # then handed out as views of this frame instead of each issuing their own grab.
+        self._frame = None  # The raw BGRA frame from the capture backend
+        self._frame_rect = None  # The frame rect [L, T, R, B] in pixels relative to the monitor
+        self.frame_id = 0  # Incremented on each frame grab
+        self.frame_time = 0.0  # Time of the last frame grab
+        self.capture_worker = None  # Optional background capture, see start_capture_worker()
+        self.recorder = None  # Optional Frame_Archive.FrameArchiveWriter to record captured regions
+
+        if backend is None:
+            # Find ED window position to determine which monitor it is on
+            ed_rect = self.get_elite_window_rect()
+            if ed_rect is None:
+                self.ap_ckb('log', f"ERROR: Could not find window {elite_dangerous_window}.")
+                logger.error(f'Could not find window {elite_dangerous_window}.')
+            else:
+                logger.debug(f'Found Elite Dangerous window position: {ed_rect}')
+
+            # Examine all monitors to determine match with ED
+            backend = MssBackend(ed_rect)
+            self.mss = backend.sct
+            self.mons = backend.mons
+            self.monitor_number = backend.monitor_number
+
+        self.backend = backend
+        self.mon = backend.monitor
+        self.screen_width = backend.width
+        self.screen_height = backend.height
 
         # Add new screen resolutions here with tested scale factors
         # this table will be default, overwritten when loading resolution.json file
@@ -119,6 +155,8 @@ class Screen:
         """ Gets the ED window rectangle.
         Returns (left, top, right, bottom) or None.
         """
+        if win32gui is None:
+            return None
         hwnd = win32gui.FindWindow(None, elite_dangerous_window)
         if hwnd:
             rect = win32gui.GetWindowRect(hwnd)
@@ -130,6 +168,8 @@ class Screen:
     def elite_window_exists() -> bool:
         """ Does the ED Client Window exist (i.e. is ED running)
         """
+        if win32gui is None:
+            return False
         hwnd = win32gui.FindWindow(None, elite_dangerous_window)
         if hwnd:
             return True
@@ -160,20 +200,142 @@ class Screen:
         image = self.get_screen(int(reg[0]), int(reg[1]), int(reg[2]), int(reg[3]), inv_col)
         return image
 
+    def grab_frame(self, rects=None) -> int:
+        """ Grab a single frame covering the union of the given rects. Until the frame is released or
+        another frame is grabbed, any get_screen call for an area inside the frame is served as a view of
+        this frame, so all regions checked in one tick come from the same capture.
+        @param rects: A list of rect arrays ([L, T, R, B]) in pixels. None for the full screen.
+        @return: The frame id.
+        """
+        if rects:
+            rect = [min(r[0] for r in rects), min(r[1] for r in rects),
+                    max(r[2] for r in rects), max(r[3] for r in rects)]
+            rect = [max(0, int(rect[0])), max(0, int(rect[1])),
+                    min(self.screen_width, int(rect[2])), min(self.screen_height, int(rect[3]))]
+        else:
+            rect = [0, 0, self.screen_width, self.screen_height]
+
+        self._frame = None  # Do not serve the old frame to the grab below
+        if self.capture_worker is not None and self.capture_worker.is_running():
+            # Take the area from the latest background frame. Copy it, as the ring slot will be reused.
+            frame_id, frame_time, frame = self.capture_worker.latest_frame()
+            if frame is None:
+                frame_id, frame_time, frame = self.capture_worker.wait_for_frame(0)
+            if frame is not None:
+                self._frame = frame[rect[1]:rect[3], rect[0]:rect[2]].copy()
+                self._frame_rect = rect
+                self.frame_id = frame_id
+                self.frame_time = frame_time
+                return self.frame_id
+
+        self._frame = self.get_screen_native(rect[0], rect[1], rect[2], rect[3])
+        self._frame_rect = rect
+        return self.frame_id
+
+    def release_frame(self):
+        """ Release the current frame. Subsequent get_screen calls will grab from the screen again. """
+        self._frame = None
+        self._frame_rect = None
+
+    @contextmanager
+    def frame_tick(self, rects=None):
+        """ Context manager to grab one frame for the duration of a tick, i.e.:
+            with scr.frame_tick([reg['compass']['rect'], reg['target']['rect']]):
+                ...
+        @param rects: A list of rect arrays ([L, T, R, B]) in pixels. None for the full screen.
+        """
+        frame_id = self.grab_frame(rects)
+        try:
+            yield frame_id
+        finally:
+            self.release_frame()
+
+    def current_frame(self):
+        """ Returns the current frame and its [L, T, R, B] rect in screen pixels, or (None, None) if there
+        is no current frame. See grab_frame(). """
+        if self._frame is None:
+            return None, None
+        return self._frame, self._frame_rect
+
+    def frame_age(self) -> float:
+        """ Returns the age of the current frame in seconds, or -1.0 if there is no current frame. """
+        if self._frame is None:
+            return -1.0
+        return time.time() - self.frame_time
+
+    def start_capture_worker(self, rate: float = 30.0, ring_size: int = 3):
+        """ Start capturing the ED monitor continuously on a background thread. While running,
+        grab_frame() takes its frame from the worker instead of grabbing the screen.
+        @param rate: The capture rate in frames per second.
+        @param ring_size: The number of frames in the ring buffer.
+        """
+        if self.capture_worker is not None:
+            self.capture_worker.stop()
+        self.capture_worker = CaptureWorker(self.backend, rate, ring_size)
+        self.capture_worker.start()
+
+    def stop_capture_worker(self):
+        """ Stop the background capture. """
+        if self.capture_worker is not None:
+            self.capture_worker.stop()
+            self.capture_worker = None
+
+    def latest_frame(self):
+        """ Returns the latest full screen BGRA frame from the background capture without waiting.
+        @return: (frame id, time, frame) or (0, 0.0, None) if the worker is not running.
+        """
+        if self.capture_worker is None:
+            return 0, 0.0, None
+        return self.capture_worker.latest_frame()
+
+    def wait_for_frame(self, after_id: int, timeout: float = 1.0):
+        """ Waits for a background frame newer than the given frame id.
+        @return: (frame id, time, frame) or (0, 0.0, None) on timeout or if the worker is not running.
+        """
+        if self.capture_worker is None:
+            return 0, 0.0, None
+        return self.capture_worker.wait_for_frame(after_id, timeout)
+
+    def _get_frame_view(self, x_left, y_top, x_right, y_bot):
+        """ Returns a view of the current frame for the given area, or None if the area is not
+        in the current frame. """
+        if self._frame is None:
+            return None
+
+        fr = self._frame_rect
+        if x_left < fr[0] or y_top < fr[1] or x_right > fr[2] or y_bot > fr[3]:
+            return None
+
+        # Zero-copy slice of the frame
+        return self._frame[y_top - fr[1]:y_bot - fr[1], x_left - fr[0]:x_right - fr[0]]
+
+    def get_screen_native(self, x_left, y_top, x_right, y_bot):
+        """ Grabs the area of the screen in the native BGRA format. The live mss buffer is wrapped
+        without a copy, so no allocation or colour conversion is done here. Callers that need another
+        channel layout should do a single conversion to it, see convert_color().
+        @return: A BGRA image (h, w, 4).
+        """
+        image = self._get_frame_view(x_left, y_top, x_right, y_bot)
+        if image is not None:
+            # From the current frame
+            return image
+
+        image = self.backend.grab(x_left, y_top, x_right, y_bot)
+        self.frame_id = self.frame_id + 1
+        self.frame_time = time.time()
+        return image
+
     def get_screen(self, x_left, y_top, x_right, y_bot, inv_col=True):    # if absolute need to scale??
-        monitor = {
-            "top": self.mon["top"] + y_top,
-            "left": self.mon["left"] + x_left,
-            "width": x_right - x_left,
-            "height": y_bot - y_top,
-            "mon": self.monitor_number,
-        }
-        image = array(self.mss.grab(monitor))
-        # TODO - mss.grab returns the image in BGR format, so no need to convert to RGB2BGR
+        """ Grabs the area of the screen.
+        If inv_col is True, returns a 3 channel image with the red and blue channels swapped (RGB order),
+        which is the format the region filters and templates were tuned with. Otherwise returns the
+        native BGRA image.
+        """
+        image = self.get_screen_native(x_left, y_top, x_right, y_bot)
         if inv_col:
-            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+            image = cv2.cvtColor(image, cv2.COLOR_BGRA2RGB)
         return image
-        
+
     def get_screen_rect_pct(self, rect):
         """ Grabs a screenshot and returns the selected region as an image.
         @param rect: A rect array ([L, T, R, B]) in percent (0.0 - 1.0)
@@ -181,9 +343,8 @@ class Screen:
         """
         if self.using_screen:
             abs_rect = self.screen_rect_to_abs(rect)
-            image = self.get_screen(abs_rect[0], abs_rect[1], abs_rect[2], abs_rect[3])
-            # TODO delete this line when COLOR_RGB2BGR is removed from get_screen()
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            image = self.get_screen_native(abs_rect[0], abs_rect[1], abs_rect[2], abs_rect[3])
+            image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
             return image
         else:
             if self._screen_image is None:
@@ -205,9 +366,8 @@ class Screen:
         """ Grabs a full screenshot and returns the image.
         """
         if self.using_screen:
-            image = self.get_screen(0, 0, self.screen_width, self.screen_height)
-            # TODO delete this line when COLOR_RGB2BGR is removed from get_screen()
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            image = self.get_screen_native(0, 0, self.screen_width, self.screen_height)
+            image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
             return image
         else:
             if self._screen_image is None:
@@ -254,3 +414,34 @@ class Screen:
         self.screen_width = w
         self.screen_height = h
 
+        # Also serve the region captures (Screen_Regions) from the image
+        self.set_backend(StillImageBackend(image))
+
+    def set_recorder(self, recorder):
+        """ Record every captured region to a frame archive. See Frame_Archive.py.
+        @param recorder: A FrameArchiveWriter, or None to stop recording.
+        """
+        self.recorder = recorder
+
+    def record_region(self, name: str, rect, raw=None, filtered=None):
+        """ Record a captured region if a recorder is set. Called by the region capture routines.
+        @param name: The region name.
+        @param rect: The region rect [L, T, R, B] in pixels.
+        @param raw: The captured image.
+        @param filtered: The filtered image.
+        """
+        if self.recorder is not None:
+            self.recorder.record(name, rect, self.frame_id, self.frame_time, raw, filtered)
+
+    def set_backend(self, backend: CaptureBackend):
+        """ Change the capture backend, i.e. to replay screenshots or a recording. Sets the screen width
+        and height to the backend monitor size.
+        @param backend: The new backend.
+        """
+        self.stop_capture_worker()
+        self.release_frame()
+        self.backend = backend
+        self.mon = backend.monitor
+        self.screen_width = backend.width
+        self.screen_height = backend.height
+
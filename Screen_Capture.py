@@ -0,0 +1,412 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from EDlogger import logger
+
+try:
+    import mss
+except ImportError:
+    mss = None  # Only required for live capture (MssBackend)
+
+"""
+File:Screen_Capture.py
+
+Description:
+  Screen capture backends and background capture.
+  A backend provides BGRA images of areas of the screen. MssBackend captures the live screen, the other
+  backends replay screenshots, videos or recorded frame archives so the vision code can be run and
+  benchmarked without the game.
+  A capture worker grabs from a backend continuously at a set rate into a small preallocated ring of
+  frames, so consumers never wait on a screen grab and can tell how old a frame is.
+"""
+
+
+class CaptureBackend:
+    """ Base class for capture backends. A backend has a fixed monitor size and returns native
+    BGRA images (h, w, 4) for areas of that monitor. """
+
+    def __init__(self, width: int, height: int):
+        self.monitor = {'left': 0, 'top': 0, 'width': width, 'height': height}
+
+    @property
+    def width(self) -> int:
+        return self.monitor['width']
+
+    @property
+    def height(self) -> int:
+        return self.monitor['height']
+
+    def grab(self, x_left, y_top, x_right, y_bot):
+        """ Grab an area of the monitor.
+        @return: A BGRA image (h, w, 4). This may be a view of a buffer owned by the backend.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MssBackend(CaptureBackend):
+    """ Live screen capture using mss. mss is not thread safe, so each thread gets its own instance. """
+
+    def __init__(self, ed_rect=None):
+        """
+        @param ed_rect: The ED window rect (left, top, right, bottom) used to pick the monitor, or None
+        to use the first monitor.
+        """
+        if mss is None:
+            raise RuntimeError("mss is not installed, live screen capture is not available.")
+
+        self._local = threading.local()
+
+        # Examine all monitors to determine match with ED
+        self.mons = self.sct.monitors
+        self.monitor_number = 1
+        mon_num = 0
+        for item in self.mons:
+            if mon_num > 0:  # ignore monitor 0 as it is the complete desktop (dims of all monitors)
+                logger.debug(f'Found monitor {mon_num} with details: {item}')
+                if ed_rect is None:
+                    self.monitor_number = mon_num
+                    logger.debug(f'Defaulting to monitor {mon_num}.')
+                    break
+                else:
+                    if item['left'] == ed_rect[0] and item['top'] == ed_rect[1]:
+                        self.monitor_number = mon_num
+                        logger.debug(f'Elite Dangerous is on monitor {mon_num}.')
+
+            # Next monitor
+            mon_num = mon_num + 1
+
+        self.mon = self.mons[self.monitor_number]
+        super().__init__(self.mon['width'], self.mon['height'])
+        self.monitor['left'] = self.mon['left']
+        self.monitor['top'] = self.mon['top']
+
+    @property
+    def sct(self):
+        """ The mss instance for the calling thread. """
+        sct = getattr(self._local, 'sct', None)
+        if sct is None:
+            sct = mss.mss()
+            self._local.sct = sct
+        return sct
+
+    def grab(self, x_left, y_top, x_right, y_bot):
+        monitor = {
+            "top": self.mon["top"] + y_top,
+            "left": self.mon["left"] + x_left,
+            "width": x_right - x_left,
+            "height": y_bot - y_top,
+            "mon": self.monitor_number,
+        }
+        shot = self.sct.grab(monitor)
+        # Wrap the mss buffer without a copy
+        return np.frombuffer(shot.raw, dtype=np.uint8).reshape(shot.height, shot.width, 4)
+
+
+class StillImageBackend(CaptureBackend):
+    """ Returns areas of a single image, i.e. a screenshot loaded for testing. """
+
+    def __init__(self, image):
+        """
+        @param image: A BGR or BGRA image. The monitor size is set to the image size.
+        """
+        self.image = to_bgra(image)
+        h, w = self.image.shape[:2]
+        super().__init__(w, h)
+
+    def grab(self, x_left, y_top, x_right, y_bot):
+        return self.image[y_top:y_bot, x_left:x_right]
+
+
+class ReplayBackend(CaptureBackend):
+    """ Base class for backends that replay a sequence of frames. The frame advances either by wall
+    clock at a set rate ('clock'), or only when advance() or seek() is called ('index'). """
+
+    def __init__(self, frame_count: int, width: int, height: int, mode: str = 'index', fps: float = 30.0,
+                 loop: bool = True):
+        """
+        @param frame_count: The number of frames.
+        @param mode: 'index' to advance with advance()/seek(), 'clock' to advance by wall clock.
+        @param fps: The replay rate in 'clock' mode.
+        @param loop: Restart from the first frame after the last frame.
+        """
+        super().__init__(width, height)
+        self.frame_count = frame_count
+        self.mode = mode
+        self.fps = fps
+        self.loop = loop
+        self.index = 0
+        self._start_time = time.perf_counter()
+        self._cache_index = -1
+        self._cache_frame = None
+
+    def _load_frame(self, index: int):
+        """ Load the frame at the index. Returns a BGR or BGRA image. """
+        raise NotImplementedError
+
+    def _wrap(self, index: int) -> int:
+        if self.loop:
+            return index % self.frame_count
+        return min(index, self.frame_count - 1)
+
+    def seek(self, index: int):
+        """ Go to the frame at the index. In 'clock' mode, the clock restarts from that frame. """
+        self.index = self._wrap(index)
+        self._start_time = time.perf_counter() - self.index / self.fps
+
+    def advance(self, count: int = 1):
+        """ Go to the next frame. """
+        self.seek(self.index + count)
+
+    def is_finished(self) -> bool:
+        """ Returns True if not looping and the last frame has been reached. """
+        return not self.loop and self.current_index() >= self.frame_count - 1
+
+    def current_index(self) -> int:
+        if self.mode == 'clock':
+            self.index = self._wrap(int((time.perf_counter() - self._start_time) * self.fps))
+        return self.index
+
+    def current_frame(self):
+        """ Returns the current frame as a BGRA image. """
+        index = self.current_index()
+        if index != self._cache_index:
+            self._cache_frame = to_bgra(self._load_frame(index))
+            self._cache_index = index
+        return self._cache_frame
+
+    def grab(self, x_left, y_top, x_right, y_bot):
+        return self.current_frame()[y_top:y_bot, x_left:x_right]
+
+
+class ImageDirBackend(ReplayBackend):
+    """ Replays a directory of screenshots (png/bmp/jpg) in file name order. All screenshots must be
+    the same resolution as the first. """
+
+    def __init__(self, directory: str, mode: str = 'index', fps: float = 1.0, loop: bool = True):
+        self.files = sorted(os.path.join(directory, f) for f in os.listdir(directory)
+                            if f.lower().endswith(('.png', '.bmp', '.jpg')))
+        if len(self.files) == 0:
+            raise FileNotFoundError(f"No screenshots found in {directory}.")
+        first = cv2.imread(self.files[0], cv2.IMREAD_UNCHANGED)
+        super().__init__(len(self.files), first.shape[1], first.shape[0], mode, fps, loop)
+
+    def _load_frame(self, index: int):
+        return cv2.imread(self.files[index], cv2.IMREAD_UNCHANGED)
+
+    def current_file(self) -> str:
+        return self.files[self.current_index()]
+
+
+class VideoBackend(ReplayBackend):
+    """ Replays a video file using OpenCV. In 'clock' mode the video rate is used unless fps is given. """
+
+    def __init__(self, file_name: str, mode: str = 'index', fps: float = 0.0, loop: bool = True):
+        self._cap = cv2.VideoCapture(file_name)
+        if not self._cap.isOpened():
+            raise FileNotFoundError(f"Unable to open video {file_name}.")
+        count = int(self._cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        width = int(self._cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(self._cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        if fps <= 0:
+            fps = self._cap.get(cv2.CAP_PROP_FPS) or 30.0
+        self._next_index = 0
+        super().__init__(count, width, height, mode, fps, loop)
+
+    def _load_frame(self, index: int):
+        # Only seek when not reading sequentially, as seeking is slow for most codecs
+        if index != self._next_index:
+            self._cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+        ret, frame = self._cap.read()
+        if not ret:
+            raise IOError(f"Unable to read frame {index} of video.")
+        self._next_index = index + 1
+        return frame
+
+    def close(self):
+        self._cap.release()
+
+
+class ArchiveBackend(ReplayBackend):
+    """ Replays a frame archive recorded with Frame_Archive.FrameArchiveWriter. Each frame id is a frame.
+    The raw images of the regions recorded for that frame are drawn at their rects on a black screen. """
+
+    def __init__(self, path: str, mode: str = 'index', fps: float = 30.0, loop: bool = True):
+        from Frame_Archive import FrameArchiveReader
+        self.reader = FrameArchiveReader(path)
+        self.frame_ids = self.reader.frame_ids()
+        if len(self.frame_ids) == 0:
+            raise FileNotFoundError(f"No frames found in archive {path}.")
+
+        # Group the record indexes by frame id
+        self._frame_records = {}
+        for i, rec in enumerate(self.reader.records):
+            self._frame_records.setdefault(rec['frame_id'], []).append(i)
+
+        self._canvas = np.zeros((self.reader.height, self.reader.width, 4), dtype=np.uint8)
+        super().__init__(len(self.frame_ids), self.reader.width, self.reader.height, mode, fps, loop)
+
+    def _load_frame(self, index: int):
+        self._canvas[:] = 0
+        for i in self._frame_records[self.frame_ids[index]]:
+            rec = self.reader.read(i)
+            raw = rec['raw']
+            if raw is not None:
+                x, y = rec['rect'][0], rec['rect'][1]
+                self._canvas[y:y + raw.shape[0], x:x + raw.shape[1]] = to_bgra(raw)
+        return self._canvas
+
+
+def to_bgra(image):
+    """ Convert a BGR, BGRA or grayscale image to BGRA. BGRA images are returned as is. """
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGRA)
+    if image.shape[2] == 3:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2BGRA)
+    return image
+
+
+class CaptureWorker:
+    """ Captures from a backend on a background thread into a ring buffer of preallocated frames.
+    The writer fills the next slot and then publishes it with a single assignment of the latest
+    (slot, frame id, time) tuple, so readers never take a lock. A frame returned by latest_frame()
+    remains valid until the writer wraps round the ring, so copy it if it is held for longer than
+    (ring_size - 1) capture periods. """
+
+    def __init__(self, backend: CaptureBackend, rate: float = 30.0, ring_size: int = 3):
+        """
+        @param backend: The capture backend to grab the full monitor from.
+        @param rate: The capture rate in frames per second.
+        @param ring_size: The number of frames in the ring buffer (minimum 2).
+        """
+        self.backend = backend
+        self.rate = rate
+        self.ring_size = max(2, ring_size)
+
+        # Preallocated ring of BGRA frames
+        self._ring = [np.zeros((backend.height, backend.width, 4), dtype=np.uint8)
+                      for _ in range(self.ring_size)]
+        self._slot_ids = [0] * self.ring_size  # The frame id currently held in each slot
+        self._latest = (-1, 0, 0.0)  # (slot, frame id, time) of the last published frame
+
+        self._new_frame = threading.Condition()
+        self._running = False
+        self._thread = None
+
+        # Statistics
+        self.frames = 0  # Frames captured
+        self.dropped = 0  # Capture periods missed because a grab overran the period
+        self._intervals = deque(maxlen=100)  # Recent intervals between frames in seconds
+
+    def start(self):
+        """ Start the capture thread. """
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._capture_loop, name="CaptureWorker", daemon=True)
+        self._thread.start()
+        logger.debug(f"CaptureWorker started at {self.rate} fps with {self.ring_size} frames.")
+
+    def stop(self):
+        """ Stop the capture thread and wait for it to finish. """
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+        with self._new_frame:
+            self._new_frame.notify_all()
+        logger.debug(f"CaptureWorker stopped. {self.get_stats()}")
+
+    def is_running(self) -> bool:
+        return self._running
+
+    def _capture_loop(self):
+        """ The capture loop. Runs on the worker thread. """
+        period = 1.0 / self.rate
+        next_time = time.perf_counter()
+        last_time = None
+        while self._running:
+            buf = self.backend.grab(0, 0, self.backend.width, self.backend.height)
+
+            # Fill the next slot, then publish it
+            slot = (self._latest[0] + 1) % self.ring_size
+            frame_id = self._latest[1] + 1
+            np.copyto(self._ring[slot], buf)
+            self._slot_ids[slot] = frame_id
+            now = time.perf_counter()
+            self._latest = (slot, frame_id, time.time())
+            with self._new_frame:
+                self._new_frame.notify_all()
+
+            # Statistics
+            self.frames = self.frames + 1
+            if last_time is not None:
+                self._intervals.append(now - last_time)
+            last_time = now
+
+            # Wait for the next period. If we overran, count the missed periods and resync.
+            next_time = next_time + period
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                missed = int(-delay / period)
+                self.dropped = self.dropped + missed
+                next_time = next_time + missed * period
+
+    def latest_frame(self):
+        """ Returns the latest frame without waiting.
+        @return: (frame id, time, frame) or (0, 0.0, None) if no frame has been captured yet.
+        """
+        slot, frame_id, frame_time = self._latest
+        if slot < 0:
+            return 0, 0.0, None
+        return frame_id, frame_time, self._ring[slot]
+
+    def wait_for_frame(self, after_id: int, timeout: float = 1.0):
+        """ Waits for a frame newer than the given frame id.
+        @param after_id: The last frame id seen by the caller (0 for any frame).
+        @param timeout: The time to wait in seconds.
+        @return: (frame id, time, frame) or (0, 0.0, None) on timeout.
+        """
+        with self._new_frame:
+            if not self._new_frame.wait_for(lambda: self._latest[1] > after_id or not self._running, timeout):
+                return 0, 0.0, None
+        if self._latest[1] <= after_id:
+            return 0, 0.0, None
+        return self.latest_frame()
+
+    def is_frame_valid(self, frame_id: int) -> bool:
+        """ Checks that a frame returned earlier has not since been overwritten by the writer. """
+        return frame_id in self._slot_ids
+
+    def frame_age(self) -> float:
+        """ Returns the age of the latest frame in seconds, or -1.0 if no frame has been captured. """
+        slot, frame_id, frame_time = self._latest
+        if slot < 0:
+            return -1.0
+        return time.time() - frame_time
+
+    def get_stats(self) -> dict:
+        """ Returns the capture statistics. Jitter is the standard deviation of the interval between
+        frames, in ms. Drop rate is the fraction of capture periods missed. """
+        intervals = np.array(self._intervals)
+        if len(intervals) > 1:
+            mean_ms = float(np.mean(intervals) * 1000)
+            jitter_ms = float(np.std(intervals) * 1000)
+        else:
+            mean_ms = 0.0
+            jitter_ms = 0.0
+        total = self.frames + self.dropped
+        drop_rate = self.dropped / total if total > 0 else 0.0
+        return {'frames': self.frames, 'dropped': self.dropped, 'drop_rate': drop_rate,
+                'interval_ms': mean_ms, 'jitter_ms': jitter_ms}
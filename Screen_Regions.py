@@ -1,6 +1,16 @@
+from concurrent.futures import ThreadPoolExecutor
 from numpy import array, sum
 import cv2
 
+from Screen import convert_color
+from Region_Change import RegionChangeDetector
+from Region_Evaluator import RegionEvaluator
+from Compass_Decoder import CompassDecoder
+from Region_Filters import ColorFilter, EqualizeFilter, SunFilter
+from Sun_Detector import SunDetector
+from Template_Matching import (CV2_METHODS, ENGINE_EXHAUSTIVE, ENGINE_PYRAMID, METHOD_CCOEFF, TemplateTracker,
+                               match_with_engine, match_with_method)
+
 
 """
 File:Screen_Regions.py    
@@ -9,6 +19,15 @@ Description:
   Class to rectangle areas of the screen to capture along with filters to apply. Includes functions to
   match a image template to the region using opencv 
 
+  Opt-in paths. The assists in this tree do not call these yet, a caller uses them per tick in place of
+  the per-region capture_region_filtered/match_template_in_region calls:
+    grab_regions(): One capture of the union of the regions checked in a tick, see Screen.grab_frame().
+    enable_change_gate(): Return the previous match of a region that has not changed, off by default.
+    enable_tracking(): Search near the predicted location of a template first, off by default.
+    match_templates_in_region(): Match several templates in one capture and filtering of a region.
+    sun_occupancy(): The sun occupancy grid, blob and escape direction, in place of sun_percent().
+    decode_compass(): The navpoint offset from one compass match, in place of the navpoint templates.
+
 Author: sumzer0@yahoo.com
 """
 
@@ -105,6 +124,32 @@ class Screen_Regions:
         self.blue_sco_color_range = [array([10, 0, 0]), array([100, 150, 255])]
         self.fss_color_range      = [array([95, 210, 70]),  array([105, 255, 120])]
 
+        # Template matching engine used by match_template_in_region, see Template_Matching.py.
+        # A region can override this with an 'engine' key, i.e. self.reg['target']['engine'] = ENGINE_PYRAMID
+        self.match_engine = ENGINE_EXHAUSTIVE
+        self.pyramid_scale = 0.5
+
+        # Template matching method, see the METHOD_ constants in Template_Matching.py. A region can override
+        # this with a 'method' key. All regions use TM_CCOEFF_NORMED, which their thresholds are tuned for.
+        # Compare the methods with matching_method_benchmark() in Test_Routines.py before changing this.
+        self.match_method = METHOD_CCOEFF
+
+        # Optional tracking of template locations between calls, see enable_tracking().
+        self.tracker = None
+
+        # Threads for batch matching. cv2.matchTemplate releases the GIL, so templates match in parallel.
+        self._match_executor = None
+
+        # Navpoint dot decoding inside the matched compass, see decode_compass().
+        self.compass_decoder = CompassDecoder()
+
+        # Sun occupancy and escape direction, see sun_occupancy().
+        self.sun_detector = SunDetector()
+
+        # Optional change detection, skips filtering and matching of unchanged regions.
+        # See enable_change_gate().
+        self.change_gate = None
+
         self.reg = {}
         # regions with associated filter and color ranges
         # The rect is [L, T, R, B] top left x, y, and bottom right x, y in fraction of screen resolution
@@ -119,6 +164,10 @@ class Screen_Regions:
         self.reg['missions']    = {'rect': [0.50, 0.78, 0.65, 0.85], 'width': 1, 'height': 1, 'filterCB': self.equalize, 'filter': None}   
         self.reg['nav_panel']   = {'rect': [0.25, 0.36, 0.60, 0.85], 'width': 1, 'height': 1, 'filterCB': self.equalize, 'filter': None}  
         
+        # The colour space each filter works in. Batch matching converts once per colour space and
+        # passes the converted image to the filters.
+        self._filter_input = {self.equalize: 'gray', self.filter_by_color: 'hsv', self.filter_sun: 'gray'}
+
         # convert rect from percent of screen into pixel location, calc the width/height of the area
         for i, key in enumerate(self.reg):
             xx = self.reg[key]['rect']
@@ -127,6 +176,29 @@ class Screen_Regions:
             self.reg[key]['width']  = self.reg[key]['rect'][2] - self.reg[key]['rect'][0]
             self.reg[key]['height'] = self.reg[key]['rect'][3] - self.reg[key]['rect'][1]
 
+        # build the filter pipeline of each region at its pixel size, see Region_Filters.py
+        for key in self.reg:
+            self.reg[key]['pipeline'] = self.make_filter_pipeline(self.reg[key])
+
+    def make_filter_pipeline(self, region):
+        """ Build the filter pipeline for a region from its filter routine. The pipeline gives the same
+        result as the routine, but reuses its buffers instead of allocating per frame.
+        Returns None for regions without a filter. """
+        w, h = region['width'], region['height']
+        if region['filterCB'] == self.equalize:
+            return EqualizeFilter(w, h)
+        elif region['filterCB'] == self.filter_by_color:
+            return ColorFilter(w, h, region['filter'])
+        elif region['filterCB'] == self.filter_sun:
+            return SunFilter(w, h, lambda: self.sun_threshold)
+        return None
+
+    def grab_regions(self, region_names) -> int:
+        """ Grab one frame covering all the given regions. Following captures of these regions are
+        cropped from this frame until screen.release_frame() is called or the next frame is grabbed.
+        Returns the frame id. """
+        return self.screen.grab_frame([self.reg[name]['rect'] for name in region_names])
+
     def capture_region(self, screen, region_name):
         """ Just grab the screen based on the region name/rect.
         Returns an unfiltered image. """
@@ -134,23 +206,276 @@ class Screen_Regions:
 
     def capture_region_filtered(self, screen, region_name, inv_col=True):
         """ Grab screen region and call its filter routine.
-        Returns the filtered image. """
-        scr = screen.get_screen_region(self.reg[region_name]['rect'], inv_col)
+        Returns the filtered image. This is the region's filter buffer, which is overwritten by the next
+        capture of the region, so copy it if it must be kept. """
         if self.reg[region_name]['filterCB'] == None:
             # return the screen region untouched in BGRA format.
-            return scr
+            return screen.get_screen_region(self.reg[region_name]['rect'], inv_col)
+
+        scr, fmt = self._capture_region_raw(screen, region_name, inv_col)
+        return self._filter_region(screen, region_name, scr, fmt)
+
+    def _capture_region_raw(self, screen, region_name, inv_col=True):
+        """ Grab the screen region for filtering. Returns the image and its channel layout. """
+        if inv_col:
+            # Capture in the native BGRA format and let the filter do a single conversion to the
+            # layout it needs.
+            rect = self.reg[region_name]['rect']
+            scr = screen.get_screen_native(int(rect[0]), int(rect[1]), int(rect[2]), int(rect[3]))
+            return scr, 'BGRA'
         else:
-            # return the screen region in the format returned by the filter.
-            return self.reg[region_name]['filterCB'] (scr, self.reg[region_name]['filter'])          
+            return screen.get_screen_region(self.reg[region_name]['rect'], inv_col), 'BGR'
+
+    def _filter_region(self, screen, region_name, scr, fmt):
+        """ Apply the region filter to a captured region. """
+        # return the screen region in the format returned by the filter.
+        pipeline = self.reg[region_name].get('pipeline')
+        if pipeline is not None:
+            # The output buffer of the pipeline is reused on the next capture of this region
+            filtered = pipeline(scr, fmt)
+        else:
+            filtered = self.reg[region_name]['filterCB'] (scr, self.reg[region_name]['filter'], fmt)
+        screen.record_region(region_name, self.reg[region_name]['rect'], scr, filtered)
+        return filtered
+
+    def enable_change_gate(self, tolerance: float = 1.5, refresh_interval: float = 1.0):
+        """ Enable change detection in match_template_in_region. While a region is unchanged from when
+        a template was last matched in it, the previous result is returned without filtering or matching.
+        @param tolerance: The mean absolute difference (0-255) of the downsampled region below which it
+        is unchanged.
+        @param refresh_interval: The maximum age of a cached result in seconds.
+        """
+        self.change_gate = RegionChangeDetector(tolerance, refresh_interval)
+
+    def disable_change_gate(self):
+        self.change_gate = None
+
+    def get_change_gate_stats(self) -> dict:
+        """ Returns the change gate hits and misses per (region, template), see RegionChangeDetector. """
+        if self.change_gate is None:
+            return {}
+        return self.change_gate.get_stats()
 
     def match_template_in_region(self, region_name, templ_name, inv_col=True):
         """ Attempt to match the given template in the given region which is filtered using the region filter.
-        Returns the filtered image, detail of match and the match mask. """
-        img_region = self.capture_region_filtered(self.screen, region_name, inv_col)    # which would call, reg.capture_region('compass') and apply defined filter
-        match = cv2.matchTemplate(img_region, self.templates.template[templ_name]['image'], cv2.TM_CCOEFF_NORMED)
-        (minVal, maxVal, minLoc, maxLoc) = cv2.minMaxLoc(match)
-        return img_region, (minVal, maxVal, minLoc, maxLoc), match 
-    
+        Returns the filtered image, detail of match and the match mask.
+        The filtered image is the region's filter buffer, which is overwritten by the next capture of the region.
+        With the change gate enabled, the returned values may be the cached values of a previous call, so
+        do not modify them. """
+        if self.change_gate is None or self.reg[region_name]['filterCB'] is None:
+            img_region = self.capture_region_filtered(self.screen, region_name, inv_col)    # which would call, reg.capture_region('compass') and apply defined filter
+            (minVal, maxVal, minLoc, maxLoc), match = self._match_region(region_name, img_region, templ_name)
+            return img_region, (minVal, maxVal, minLoc, maxLoc), match
+
+        # Return the previous result if the region has not changed
+        scr, fmt = self._capture_region_raw(self.screen, region_name, inv_col)
+        key = (region_name, templ_name)
+        result, sig = self.change_gate.get(key, scr)
+        if result is not None:
+            return result
+
+        img_region = self._filter_region(self.screen, region_name, scr, fmt)
+        (minVal, maxVal, minLoc, maxLoc), match = self._match_region(region_name, img_region, templ_name)
+        # Copy the filtered image, as the filter pipeline reuses its buffer
+        result = (img_region.copy(), (minVal, maxVal, minLoc, maxLoc), match)
+        self.change_gate.put(key, sig, result)
+        return result
+
+    def _match_region(self, region_name, img_region, templ_name):
+        """ Match the template in the filtered region image with the region's match engine.
+        Returns (minVal, maxVal, minLoc, maxLoc), match. """
+        engine = self.reg[region_name].get('engine', self.match_engine)
+        method = self.reg[region_name].get('method', self.match_method)
+        options = {'scale': self.pyramid_scale} if engine == ENGINE_PYRAMID else {}
+        templ = self.templates.template[templ_name]
+
+        threshold = self.get_match_threshold(templ_name)
+        if threshold is not None and self.templates.needs_scale_search(templ_name):
+            return self._match_scale_space(region_name, img_region, templ_name, threshold, engine, method, options)
+
+        if self.tracker is not None and threshold is not None and method in CV2_METHODS:
+            # Search near the last location first, falling back to the engine for the full region
+            return self.tracker.match((region_name, templ_name), img_region, templ['image'], threshold,
+                                      CV2_METHODS[method],
+                                      lambda img, tmp, cv_method: match_with_engine(img, tmp, engine, cv_method,
+                                                                                    **options))
+
+        return match_with_method(img_region, templ, method, engine, **options)
+
+    def match_templates_in_region(self, region_name, templ_names, inv_col=True, parallel=True) -> dict:
+        """ Match several templates in one capture of a region. The region is captured once, each distinct
+        filter is applied once and filters needing the same colour conversion (i.e. HSV) share it.
+        @param region_name: The region to capture.
+        @param templ_names: A list of template names to match with the region's filter, or (region name,
+        template name) tuples to match with another region's filter. Those regions must have the same rect,
+        i.e. ('target_occluded', 'target_occluded') with 'target'.
+        @param inv_col: As match_template_in_region.
+        @param parallel: Match the templates on worker threads.
+        @return: A dict keyed by the items of templ_names, with the same values as match_template_in_region,
+        (filtered image, (minVal, maxVal, minLoc, maxLoc), match).
+        """
+        rect = self.reg[region_name]['rect']
+        jobs = []
+        for item in templ_names:
+            reg_name, templ_name = item if isinstance(item, tuple) else (region_name, item)
+            if self.reg[reg_name]['rect'] != rect:
+                raise ValueError(f"Region '{reg_name}' does not have the same rect as '{region_name}'.")
+            jobs.append((item, reg_name, templ_name))
+
+        # Capture once
+        if inv_col:
+            scr, fmt = self._capture_region_raw(self.screen, region_name, inv_col)
+        else:
+            scr, fmt = self.screen.get_screen_region(rect, inv_col), 'BGR'
+
+        # Filter once per distinct filter, converting once per colour space
+        converted = {}
+        filtered = {}
+        for item, reg_name, templ_name in jobs:
+            reg = self.reg[reg_name]
+            filter_key = (reg['filterCB'], str(reg['filter']))
+            if filter_key in filtered:
+                continue
+            if reg['filterCB'] is None:
+                filtered[filter_key] = self.screen.get_screen_region(rect, inv_col)
+                continue
+            target = self._filter_input.get(reg['filterCB'])
+            if target is None:
+                img = reg['filterCB'](scr, reg['filter'], fmt)
+            else:
+                if target not in converted:
+                    converted[target] = convert_color(scr, fmt, target)
+                if reg.get('pipeline') is not None:
+                    img = reg['pipeline'](converted[target], target.upper())
+                else:
+                    img = reg['filterCB'](converted[target], reg['filter'], target.upper())
+            self.screen.record_region(reg_name, rect, scr, img)
+            filtered[filter_key] = img
+
+        def match_job(job):
+            item, reg_name, templ_name = job
+            img = filtered[(self.reg[reg_name]['filterCB'], str(self.reg[reg_name]['filter']))]
+            (minVal, maxVal, minLoc, maxLoc), match = self._match_region(reg_name, img, templ_name)
+            return item, (img, (minVal, maxVal, minLoc, maxLoc), match)
+
+        if parallel and len(jobs) > 1:
+            if self._match_executor is None:
+                self._match_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="match")
+            results = self._match_executor.map(match_job, jobs)
+        else:
+            results = map(match_job, jobs)
+        return dict(results)
+
+    def _match_scale_space(self, region_name, img_region, templ_name, threshold, engine, method, options):
+        """ Match every scale of the template and return the best. Once the best match reaches the threshold,
+        that scale is locked and used from then on. """
+        best = None
+        best_factor = None
+        for factor, templ in self.templates.get_scale_space(templ_name):
+            if templ['height'] > img_region.shape[0] or templ['width'] > img_region.shape[1]:
+                continue
+            res = match_with_method(img_region, templ, method, engine, **options)
+            if best is None or res[0][1] > best[0][1]:
+                best = res
+                best_factor = factor
+
+        if best is None:
+            return match_with_method(img_region, self.templates.template[templ_name], method, engine, **options)
+
+        if best[0][1] >= threshold:
+            self.templates.lock_scale(templ_name, best_factor)
+        return best
+
+    def decode_compass(self, inv_col=True):
+        """ Find the compass and decode the navpoint dot in it. Only the compass is template matched, the
+        dot position and front/behind state are read from the dial directly (see Compass_Decoder.py) instead
+        of matching the navpoint and navpoint-behind templates.
+        @return: (nav offset, compass maxVal). The nav offset is None if the compass or the dot was not
+        found, else the dict returned by CompassDecoder.decode.
+        """
+        scr, fmt = self._capture_region_raw(self.screen, 'compass', inv_col)
+        img_region = self._filter_region(self.screen, 'compass', scr, fmt)
+        (minVal, maxVal, minLoc, maxLoc), match = self._match_region('compass', img_region, 'compass')
+        if maxVal < self.compass_match_thresh:
+            return None, maxVal
+
+        # Decode the dot in the unfiltered dial
+        c_wid = self.templates.template['compass']['width']
+        c_hgt = self.templates.template['compass']['height']
+        dial = scr[maxLoc[1]:maxLoc[1] + c_hgt, maxLoc[0]:maxLoc[0] + c_wid]
+        return self.compass_decoder.decode(dial, fmt), maxVal
+
+    def create_region_evaluator(self, workers=None) -> RegionEvaluator:
+        """ Create a process pool evaluator for evaluate_regions(), with the current templates. Call its
+        shutdown() when done, else it is shut down when the application exits. """
+        templates = {name: {'image': templ['image'], 'binary': templ['binary']}
+                     for name, templ in self.templates.template.items() if templ['image'] is not None}
+        return RegionEvaluator(templates, self.screen.screen_width, self.screen.screen_height, workers)
+
+    def make_region_job(self, region_name, templ_name, frame_rect) -> dict:
+        """ Describe a region check for the RegionEvaluator.
+        @param region_name: The region to filter.
+        @param templ_name: The template to match, or None for the percent of lit pixels (i.e. the sun).
+        @param frame_rect: The [L, T, R, B] of the frame in screen pixels.
+        """
+        region = self.reg[region_name]
+        rect = region['rect']
+        if region['filterCB'] == self.equalize:
+            filt = ('equalize', None)
+        elif region['filterCB'] == self.filter_by_color:
+            filt = ('color', region['filter'])
+        elif region['filterCB'] == self.filter_sun:
+            filt = ('sun', self.sun_threshold)
+        else:
+            filt = None
+        return {'name': region_name if templ_name is None else f"{region_name}:{templ_name}",
+                'rect': [int(rect[0]) - frame_rect[0], int(rect[1]) - frame_rect[1],
+                         int(rect[2]) - frame_rect[0], int(rect[3]) - frame_rect[1]],
+                'filter': filt,
+                'template': templ_name,
+                'method': region.get('method', self.match_method)}
+
+    def evaluate_regions(self, evaluator: RegionEvaluator, checks) -> dict:
+        """ Grab one frame covering the regions of the checks and evaluate the checks in parallel in the
+        evaluator's worker processes, i.e.:
+            futures = scr_reg.evaluate_regions(evaluator, [('target', 'target'), ('disengage', 'disengage'),
+                                                           ('sun', None)])
+            (minVal, maxVal, minLoc, maxLoc) = futures['target:target'].result()
+            sun_pct = futures['sun'].result()
+        @param evaluator: The evaluator, see create_region_evaluator().
+        @param checks: A list of (region name, template name or None).
+        @return: A dict of Futures by job name, 'region:template' or 'region' for checks without a template.
+        """
+        self.grab_regions([region_name for region_name, templ_name in checks])
+        try:
+            frame, frame_rect = self.screen.current_frame()
+            jobs = [self.make_region_job(region_name, templ_name, frame_rect) for region_name, templ_name in checks]
+            return evaluator.submit(frame, jobs)
+        finally:
+            # The frame was copied to shared memory, release it so later captures grab the screen again
+            self.screen.release_frame()
+
+    def get_match_threshold(self, templ_name):
+        """ Returns the match threshold used for the template, or None if it has no fixed threshold. """
+        thresholds = {'compass': self.compass_match_thresh,
+                      'navpoint': self.navpoint_match_thresh,
+                      'navpoint-behind': self.navpoint_match_thresh,
+                      'target': self.target_thresh,
+                      'target_occluded': self.target_occluded_thresh,
+                      'disengage': self.disengage_thresh}
+        return thresholds.get(templ_name)
+
+    def enable_tracking(self, margin: int = 24):
+        """ Enable tracking in match_template_in_region. Templates with a match threshold are searched for
+        in a window around their predicted location first, and the full region is only searched when the
+        window match is below the threshold.
+        @param margin: Pixels to search either side of the predicted location.
+        """
+        self.tracker = TemplateTracker(margin)
+
+    def disable_tracking(self):
+        self.tracker = None
+
     def match_template_in_image(self, image, template):
         """ Attempt to match the given template in the (unfiltered) image.
         Returns the original image, detail of match and the match mask. """
@@ -159,29 +484,29 @@ class Screen_Regions:
         return image, (minVal, maxVal, minLoc, maxLoc), match     
     
 
-    def equalize(self, image=None, noOp=None):
+    def equalize(self, image=None, noOp=None, fmt='BGR'):
         # Load the image in greyscale
-        img_gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        img_gray = convert_color(image, fmt, 'gray')
         # create a CLAHE object (Arguments are optional).  Histogram equalization, improves constrast
         clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
         img_out = clahe.apply(img_gray)
 
         return img_out
         
-    def filter_by_color(self, image, color_range):
+    def filter_by_color(self, image, color_range, fmt='BGR'):
         """Filters an image based on a given color range.
         Returns the filtered image. Pixels within the color range are returned
         their original color, otherwise black."""
-        # converting from BGR to HSV color space
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        # converting from BGR (or native BGRA) to HSV color space
+        hsv = convert_color(image, fmt, 'hsv')
         # filter passed in color low, high
         filtered = cv2.inRange(hsv, color_range[0], color_range[1])
 
         return filtered
  
     # not used
-    def filter_bright(self, image=None, noOp=None):
-        equalized = self.equalize(image)
+    def filter_bright(self, image=None, noOp=None, fmt='BGR'):
+        equalized = self.equalize(image, noOp, fmt)
         equalized = cv2.cvtColor(equalized, cv2.COLOR_GRAY2BGR)    #hhhmm, equalize() already converts to gray
         equalized = cv2.cvtColor(equalized, cv2.COLOR_BGR2HSV)
         filtered  = cv2.inRange(equalized, array([0, 0, 215]), array([0, 0, 255]))  #only high value
@@ -192,8 +517,8 @@ class Screen_Regions:
         self.sun_threshold = thresh
 
     # need to compare filter_sun with filter_bright
-    def filter_sun(self, image=None, noOp=None):
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    def filter_sun(self, image=None, noOp=None, fmt='BGR'):
+        hsv = convert_color(image, fmt, 'gray')
         
         # set low end of filter to 25 to pick up the dull red Class L stars
         (thresh, blackAndWhiteImage) = cv2.threshold(hsv, self.sun_threshold, 255, cv2.THRESH_BINARY)
@@ -203,10 +528,18 @@ class Screen_Regions:
     # percent the image is white
     def sun_percent(self, screen):
         blackAndWhiteImage = self.capture_region_filtered(screen, 'sun')
- 
-        wht = sum(blackAndWhiteImage == 255)     
-        blk = sum(blackAndWhiteImage != 255)
+
+        # The image is binary (0 or 255), so count the white pixels instead of comparing the full array
+        wht = cv2.countNonZero(blackAndWhiteImage)
+        blk = blackAndWhiteImage.size - wht
 
         result = int((wht / (wht+blk))*100)
 
         return result
+
+    def sun_occupancy(self, screen, inv_col=True) -> dict:
+        """ Detect the sun in the sun region. Faster than sun_percent and also returns where the sun is
+        and the shortest direction to turn away from it. See SunDetector.detect for the returned dict.
+        """
+        scr, fmt = self._capture_region_raw(screen, 'sun', inv_col)
+        return self.sun_detector.detect(scr, self.sun_threshold, fmt)
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import cv2
+import numpy as np
+
+from Screen import convert_color
+
+"""
+File:Sun_Detector.py
+
+Description:
+  Fast sun detection for sun avoidance. The sun region is sampled on a coarse grid of pixels and
+  thresholded on brightness. From that small binary image, an integral image gives the occupancy of each
+  cell of a grid, and connected components give the centroid and size of the largest bright blob. From
+  the blob, the shortest pitch or yaw direction to move the sun out of the region is returned, instead of
+  always pitching up.
+"""
+
+
+class SunDetector:
+    def __init__(self, sample_width: int = 160, grid=(6, 8)):
+        """
+        @param sample_width: The approximate width of the sampled image. The same pixel step is used in x
+        and y, so the cost is about the same at any screen resolution.
+        @param grid: The occupancy grid size (rows, cols).
+        """
+        self.sample_width = sample_width
+        self.grid = grid
+
+    def detect(self, image, threshold: int, fmt: str = 'BGR') -> dict:
+        """ Detect the sun in the image of the sun region.
+        @param image: The sun region image.
+        @param threshold: The brightness (0-255) above which a pixel is part of the sun.
+        @param fmt: The channel layout of the image, see Screen.convert_color.
+        @return: A dict with:
+            'percent': The percentage of the region that is bright (0-100).
+            'grid': The fraction (0.0-1.0) of each grid cell that is bright, array of (rows, cols).
+            'centroid': The (x, y) centre of the largest bright blob in region pixels, or None.
+            'size': The fraction of the region covered by the largest blob.
+            'bbox': The (x0, y0, x1, y1) of the largest blob in region pixels, or None.
+            'escape': The shortest direction to turn the ship to move the blob out of the region,
+                'pitch_up', 'pitch_down', 'yaw_left', 'yaw_right' or None if no sun.
+            'escape_dist': The distance the blob must move to leave the region, as a fraction of the region.
+        """
+        h, w = image.shape[:2]
+        step = max(1, w // self.sample_width)
+
+        # Sample a coarse grid of pixels (a strided view, no full size conversion)
+        small = np.ascontiguousarray(image[step // 2::step, step // 2::step])
+        gray = convert_color(small, fmt, 'gray')
+        ret, binary = cv2.threshold(gray, threshold, 1, cv2.THRESH_BINARY)
+        sh, sw = binary.shape
+
+        # Integral image, then the sum of each grid cell from its four corners
+        integral = cv2.integral(binary)
+        rows, cols = self.grid
+        ys = np.linspace(0, sh, rows + 1).astype(int)
+        xs = np.linspace(0, sw, cols + 1).astype(int)
+        cell_sum = (integral[ys[1:, None], xs[None, 1:]] - integral[ys[:-1, None], xs[None, 1:]]
+                    - integral[ys[1:, None], xs[None, :-1]] + integral[ys[:-1, None], xs[None, :-1]])
+        cell_area = np.outer(np.diff(ys), np.diff(xs))
+        grid = cell_sum / np.maximum(cell_area, 1)
+
+        total = int(integral[-1, -1])
+        result = {'percent': int((total / (sh * sw)) * 100), 'grid': grid,
+                  'centroid': None, 'size': 0.0, 'bbox': None, 'escape': None, 'escape_dist': 0.0}
+        if total == 0:
+            return result
+
+        # Largest bright blob
+        count, labels, stats, centroids = cv2.connectedComponentsWithStats(binary, connectivity=8)
+        largest = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))
+        bx, by, bw, bh, area = stats[largest]
+
+        # Back to region pixels. The samples are at step // 2 + n * step.
+        off = step // 2
+        cx, cy = centroids[largest]
+        result['centroid'] = (int(cx * step + off), int(cy * step + off))
+        result['size'] = float(area / (sh * sw))
+        x0, y0 = bx * step, by * step
+        x1, y1 = min(w, (bx + bw) * step), min(h, (by + bh) * step)
+        result['bbox'] = (int(x0), int(y0), int(x1), int(y1))
+
+        # Distance the blob must travel to leave each edge. Pitching up moves the scene down on screen,
+        # so the sun leaves by the bottom edge, yawing right moves it out by the left edge, etc.
+        escapes = {'pitch_up': (h - y0) / h,
+                   'pitch_down': y1 / h,
+                   'yaw_right': x1 / w,
+                   'yaw_left': (w - x0) / w}
+        direction = min(escapes, key=escapes.get)
+        result['escape'] = direction
+        result['escape_dist'] = float(escapes[direction])
+        return result
@@ -0,0 +1,263 @@
+from __future__ import annotations
+
+import math
+import time
+
+import cv2
+import numpy as np
+
+"""
+File:Template_Matching.py
+
+Description:
+  Template matching engines. All engines return the same values as cv2.minMaxLoc on the result of
+  cv2.matchTemplate, (minVal, maxVal, minLoc, maxLoc), along with a match result map, so they can be
+  swapped without changing the callers.
+"""
+
+# Match engines
+ENGINE_EXHAUSTIVE = 'exhaustive'  # Full resolution cv2.matchTemplate over the whole image
+ENGINE_PYRAMID = 'pyramid'  # Coarse match on a downscaled image, then refine at full resolution
+
+# Match methods. All give a score where higher is better, so maxVal/maxLoc is the best match.
+METHOD_CCOEFF = 'ccoeff_normed'  # cv2.TM_CCOEFF_NORMED, the most robust and the costliest
+METHOD_CCORR = 'ccorr_normed'  # cv2.TM_CCORR_NORMED, no mean removal
+METHOD_SQDIFF_BINARY = 'sqdiff_binary'  # cv2.TM_SQDIFF of binary masks, scored 1 - fraction of differing pixels
+METHOD_BOX = 'box_score'  # Fraction of lit pixels in a template sized box from a downsampled integral image
+
+# cv2 methods for the methods that map directly onto cv2.matchTemplate
+CV2_METHODS = {METHOD_CCOEFF: cv2.TM_CCOEFF_NORMED,
+               METHOD_CCORR: cv2.TM_CCORR_NORMED}
+
+
+def match_template(image, templ, method=cv2.TM_CCOEFF_NORMED):
+    """ Exhaustive full resolution template match.
+    @return: (minVal, maxVal, minLoc, maxLoc), match
+    """
+    match = cv2.matchTemplate(image, templ, method)
+    return cv2.minMaxLoc(match), match
+
+
+def match_template_pyramid(image, templ, method=cv2.TM_CCOEFF_NORMED, scale: float = 0.5, margin: int = 4,
+                           min_templ_size: int = 8):
+    """ Coarse to fine template match. The image and template are downscaled by the scale factor and
+    matched, then the best location is refined by matching at full resolution in a small window around it.
+    Falls back to the exhaustive match if the downscaled template would be smaller than min_templ_size.
+    The best value and location (maxVal/maxLoc, or minVal/minLoc for the SQDIFF methods) are from the full
+    resolution refinement. The other value and location and the returned match map are from the coarse
+    match, scaled up to full resolution.
+    @param image: The image to search.
+    @param templ: The template to find.
+    @param method: The cv2 match method.
+    @param scale: The downscale factor for the coarse match, i.e. 0.5 or 0.25.
+    @param margin: Extra pixels around the coarse location to search at full resolution.
+    @param min_templ_size: The minimum template width or height after downscaling.
+    @return: (minVal, maxVal, minLoc, maxLoc), match
+    """
+    ih, iw = image.shape[:2]
+    th, tw = templ.shape[:2]
+    if min(th, tw) * scale < min_templ_size or th > ih or tw > iw:
+        return match_template(image, templ, method)
+
+    # Coarse match
+    small_img = cv2.resize(image, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    small_templ = cv2.resize(templ, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    if small_templ.shape[0] > small_img.shape[0] or small_templ.shape[1] > small_img.shape[1]:
+        return match_template(image, templ, method)
+    coarse = cv2.matchTemplate(small_img, small_templ, method)
+    (c_minVal, c_maxVal, c_minLoc, c_maxLoc) = cv2.minMaxLoc(coarse)
+
+    sqdiff = method in (cv2.TM_SQDIFF, cv2.TM_SQDIFF_NORMED)
+    best = c_minLoc if sqdiff else c_maxLoc
+
+    # Refine in a window around the coarse location at full resolution
+    pad = int(math.ceil(1.0 / scale)) + margin
+    x0 = max(0, int(best[0] / scale) - pad)
+    y0 = max(0, int(best[1] / scale) - pad)
+    x1 = min(iw, int(best[0] / scale) + tw + pad)
+    y1 = min(ih, int(best[1] / scale) + th + pad)
+    fine = cv2.matchTemplate(image[y0:y1, x0:x1], templ, method)
+    (f_minVal, f_maxVal, f_minLoc, f_maxLoc) = cv2.minMaxLoc(fine)
+
+    # Scale the coarse match map up to the size of a full resolution match map
+    match = cv2.resize(coarse, (iw - tw + 1, ih - th + 1), interpolation=cv2.INTER_LINEAR)
+
+    if sqdiff:
+        minVal, minLoc = f_minVal, (f_minLoc[0] + x0, f_minLoc[1] + y0)
+        maxVal, maxLoc = c_maxVal, (int(c_maxLoc[0] / scale), int(c_maxLoc[1] / scale))
+    else:
+        maxVal, maxLoc = f_maxVal, (f_maxLoc[0] + x0, f_maxLoc[1] + y0)
+        minVal, minLoc = c_minVal, (int(c_minLoc[0] / scale), int(c_minLoc[1] / scale))
+    return (minVal, maxVal, minLoc, maxLoc), match
+
+
+def match_with_engine(image, templ, engine: str = ENGINE_EXHAUSTIVE, method=cv2.TM_CCOEFF_NORMED, **kwargs):
+    """ Match a template using the named engine.
+    @param engine: ENGINE_EXHAUSTIVE or ENGINE_PYRAMID.
+    @param kwargs: Engine options, i.e. scale for the pyramid engine.
+    @return: (minVal, maxVal, minLoc, maxLoc), match
+    """
+    if engine == ENGINE_PYRAMID:
+        return match_template_pyramid(image, templ, method, **kwargs)
+    return match_template(image, templ, method)
+
+
+def match_sqdiff_binary(image, templ_binary):
+    """ Squared difference of binary (0/255) masks, the cheapest cv2 method as it needs no normalization.
+    The image is thresholded if it is not already binary (i.e. an equalized grayscale region).
+    @param image: The filtered region.
+    @param templ_binary: The binary template, see Image_Templates.template_stats.
+    @return: (minVal, maxVal, minLoc, maxLoc), score map. The score is 1 - the fraction of differing pixels.
+    """
+    if cv2.countNonZero(cv2.inRange(image, 1, 254)) > 0:
+        ret, image = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    sqdiff = cv2.matchTemplate(image, templ_binary, cv2.TM_SQDIFF)
+    th, tw = templ_binary.shape[:2]
+    score = 1.0 - sqdiff / (th * tw * 255.0 * 255.0)
+    return cv2.minMaxLoc(score), score
+
+
+def match_box_score(image, templ_binary, scale: float = 0.25):
+    """ Compares the fraction of lit pixels in every template sized box of the image with that of the
+    template. The box sums come from the integral image of a downsampled binary image, so the cost is
+    independent of the template size. This only finds blobs of about the right size and density, it does
+    not compare shapes.
+    @param image: The filtered region.
+    @param templ_binary: The binary template, see Image_Templates.template_stats.
+    @param scale: The downsample factor.
+    @return: (minVal, maxVal, minLoc, maxLoc), score map (at the downsampled resolution). The score is
+    min(box, template) / max(box, template) of the lit fractions.
+    """
+    small = cv2.resize(image, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    ret, small = cv2.threshold(small, 127, 1, cv2.THRESH_BINARY)
+    th = max(1, int(round(templ_binary.shape[0] * scale)))
+    tw = max(1, int(round(templ_binary.shape[1] * scale)))
+    if th > small.shape[0] or tw > small.shape[1]:
+        return (0.0, 0.0, (0, 0), (0, 0)), np.zeros((1, 1), dtype=np.float32)
+
+    integral = cv2.integral(small).astype(np.float32)
+    box = integral[th:, tw:] - integral[:-th, tw:] - integral[th:, :-tw] + integral[:-th, :-tw]
+    box = box / (th * tw)
+    templ_frac = max(cv2.countNonZero(templ_binary) / templ_binary.size, 1e-6)
+    score = np.minimum(box, templ_frac) / np.maximum(box, templ_frac)
+    (minVal, maxVal, minLoc, maxLoc) = cv2.minMaxLoc(score)
+    # Locations back to full resolution
+    minLoc = (int(minLoc[0] / scale), int(minLoc[1] / scale))
+    maxLoc = (int(maxLoc[0] / scale), int(maxLoc[1] / scale))
+    return (minVal, maxVal, minLoc, maxLoc), score
+
+
+def match_with_method(image, templ: dict, method: str = METHOD_CCOEFF, engine: str = ENGINE_EXHAUSTIVE,
+                      **kwargs):
+    """ Match a template with the named method.
+    @param image: The filtered region.
+    @param templ: The template dict from Image_Templates, with 'image' and 'binary'.
+    @param method: One of the METHOD_ constants.
+    @param engine: The engine for the cv2 methods, ENGINE_EXHAUSTIVE or ENGINE_PYRAMID.
+    @param kwargs: Engine options.
+    @return: (minVal, maxVal, minLoc, maxLoc), match. The best match is maxVal/maxLoc for all methods.
+    """
+    if method == METHOD_SQDIFF_BINARY:
+        return match_sqdiff_binary(image, templ['binary'])
+    if method == METHOD_BOX:
+        return match_box_score(image, templ['binary'])
+    return match_with_engine(image, templ['image'], engine, CV2_METHODS[method], **kwargs)
+
+
+class TemplateTracker:
+    """ Searches for a template near where it was last found. Each track keeps the last match location
+    and an alpha-beta (smoothed constant velocity) estimate of its velocity, which predicts where the
+    template will be on the next call. Only a window around the prediction is searched. If the best match
+    in the window is below the threshold, or there is no track yet, the full image is searched. """
+
+    def __init__(self, margin: int = 24, alpha: float = 0.85, beta: float = 0.3, max_age: float = 2.0):
+        """
+        @param margin: Pixels to search either side of the predicted location.
+        @param alpha: Position smoothing (1.0 = use the measured location).
+        @param beta: Velocity smoothing (0.0 = no velocity).
+        @param max_age: Seconds after which a track is too old to predict from.
+        """
+        self.margin = margin
+        self.alpha = alpha
+        self.beta = beta
+        self.max_age = max_age
+        self._tracks = {}  # key: {'loc': (x, y), 'vel': (vx, vy), 'time': t}
+        self.window_hits = 0  # Matches found in the window
+        self.full_searches = 0  # Matches that needed the full image
+
+    def predict(self, key, now: float):
+        """ Returns the predicted (x, y) location for the key, or None if there is no recent track. """
+        track = self._tracks.get(key)
+        if track is None or now - track['time'] > self.max_age:
+            return None
+        dt = now - track['time']
+        return (track['loc'][0] + track['vel'][0] * dt, track['loc'][1] + track['vel'][1] * dt)
+
+    def match(self, key, image, templ, threshold: float, method=cv2.TM_CCOEFF_NORMED, full_match=None, now=None):
+        """ Match the template, first in a window around the predicted location.
+        @param key: The track key, i.e. (region name, template name).
+        @param image: The image to search.
+        @param templ: The template to find.
+        @param threshold: The match value needed to accept a window match.
+        @param method: The cv2 match method. Only the CCORR/CCOEFF methods are tracked.
+        @param full_match: Optional function (image, templ, method) -> (values, match) for the full search.
+        Defaults to match_template.
+        @param now: The current time, defaults to time.time().
+        @return: (minVal, maxVal, minLoc, maxLoc), match. For a window match, the match map covers the
+        window only.
+        """
+        if now is None:
+            now = time.time()
+        if full_match is None:
+            full_match = match_template
+
+        ih, iw = image.shape[:2]
+        th, tw = templ.shape[:2]
+        sqdiff = method in (cv2.TM_SQDIFF, cv2.TM_SQDIFF_NORMED)
+
+        pred = None if sqdiff else self.predict(key, now)
+        if pred is not None:
+            x0 = max(0, int(pred[0]) - self.margin)
+            y0 = max(0, int(pred[1]) - self.margin)
+            x1 = min(iw, int(pred[0]) + tw + self.margin)
+            y1 = min(ih, int(pred[1]) + th + self.margin)
+            if x1 - x0 >= tw and y1 - y0 >= th:
+                match = cv2.matchTemplate(image[y0:y1, x0:x1], templ, method)
+                (minVal, maxVal, minLoc, maxLoc) = cv2.minMaxLoc(match)
+                if maxVal >= threshold:
+                    maxLoc = (maxLoc[0] + x0, maxLoc[1] + y0)
+                    minLoc = (minLoc[0] + x0, minLoc[1] + y0)
+                    self._update(key, maxLoc, now)
+                    self.window_hits = self.window_hits + 1
+                    return (minVal, maxVal, minLoc, maxLoc), match
+
+        # Full search
+        self.full_searches = self.full_searches + 1
+        (minVal, maxVal, minLoc, maxLoc), match = full_match(image, templ, method)
+        if not sqdiff and maxVal >= threshold:
+            self._update(key, maxLoc, now)
+        else:
+            # Lost the target, start again on the next good match
+            self._tracks.pop(key, None)
+        return (minVal, maxVal, minLoc, maxLoc), match
+
+    def _update(self, key, loc, now: float):
+        """ Update the track with a measured location (alpha-beta filter). """
+        track = self._tracks.get(key)
+        if track is None or now - track['time'] > self.max_age:
+            self._tracks[key] = {'loc': loc, 'vel': (0.0, 0.0), 'time': now}
+            return
+
+        dt = max(now - track['time'], 1e-3)
+        pred = (track['loc'][0] + track['vel'][0] * dt, track['loc'][1] + track['vel'][1] * dt)
+        res = (loc[0] - pred[0], loc[1] - pred[1])
+        new_loc = (pred[0] + self.alpha * res[0], pred[1] + self.alpha * res[1])
+        new_vel = (track['vel'][0] + self.beta * res[0] / dt, track['vel'][1] + self.beta * res[1] / dt)
+        self._tracks[key] = {'loc': new_loc, 'vel': new_vel, 'time': now}
+
+    def reset(self, key=None):
+        """ Drop the track for the key, or all tracks if no key is given. """
+        if key is None:
+            self._tracks.clear()
+        else:
+            self._tracks.pop(key, None)
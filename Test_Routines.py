@@ -7,6 +7,7 @@ from Screen_Regions import *
 from Overlay import *
 from Screen import *
 from Image_Templates import *
+from Threshold_Tuner import test_image_sets
 from time import sleep
 import numpy as np
 
@@ -55,6 +56,42 @@ def main():
     # wanted_regions = ["compass", "target", "nav_panel", "disengage"]  # The more common regions for navigation
     #show_regions(wanted_regions)
 
+    # Capture allocation benchmark...
+    # Compares bytes allocated per frame for the old double colour conversion capture path
+    # against the native BGRA path.
+    #
+    # Does NOT require Elite Dangerous to be running.
+    # ===============================================
+    # capture_alloc_benchmark(3440, 1440)
+
+    # Filter allocation benchmark...
+    # Compares bytes allocated per frame by the region filter routines against the filter pipelines.
+    #
+    # Does NOT require Elite Dangerous to be running.
+    # ===============================================
+    # filter_alloc_benchmark(3440, 1440)
+
+    # Matching engine benchmark...
+    # Compares the pyramid matching engine against the exhaustive matcher on the test screenshots.
+    #
+    # Does NOT require Elite Dangerous to be running.
+    # ===============================================
+    # matching_engine_benchmark(0.5)
+
+    # Matching method benchmark...
+    # Compares the accuracy and latency of the template matching methods on the test screenshots.
+    #
+    # Does NOT require Elite Dangerous to be running.
+    # ===============================================
+    # matching_method_benchmark()
+
+    # Threshold tuning...
+    # Recommends the match thresholds and HSV ranges from the test screenshots. Run Threshold_Tuner.py,
+    # optionally with a file name to save the report as JSON.
+    #
+    # Does NOT require Elite Dangerous to be running.
+    # ===============================================
+
     # HSV Tester...
     #
     # Does NOT require Elite Dangerous to be running.
@@ -284,6 +321,187 @@ def rescale_screenshots(directory, scalex, scaley):
             cv2.imwrite(image_out_path, image)
 
 
+def capture_alloc_benchmark(width, height, frames=20):
+    """ Measure bytes allocated per frame by the capture path before and after the native BGRA change.
+    A synthetic BGRA buffer stands in for the mss grab buffer.
+    :param width: The screen width in pixels.
+    :param height: The screen height in pixels.
+    :param frames: The number of frames to average over. """
+    import tracemalloc
+    import time
+
+    raw = bytearray(np.random.randint(0, 255, (height, width, 4), dtype=np.uint8).tobytes())
+
+    def old_full():
+        # array(mss.grab()) -> RGB2BGR in get_screen -> BGR2RGB in get_screen_full
+        image = np.array(np.frombuffer(raw, dtype=np.uint8).reshape(height, width, 4))
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+    def new_full():
+        image = np.frombuffer(raw, dtype=np.uint8).reshape(height, width, 4)
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+
+    def old_filtered():
+        # array(mss.grab()) -> RGB2BGR in get_screen -> BGR2HSV in filter_by_color
+        image = np.array(np.frombuffer(raw, dtype=np.uint8).reshape(height, width, 4))
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+        return cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+
+    def new_filtered():
+        image = np.frombuffer(raw, dtype=np.uint8).reshape(height, width, 4)
+        return convert_color(image, 'BGRA', 'hsv')
+
+    for name, func in [('full (old)', old_full), ('full (new)', new_full),
+                       ('filtered (old)', old_filtered), ('filtered (new)', new_filtered)]:
+        # The peak traced memory during one frame is used as the bytes allocated by that frame. It
+        # under counts the old path slightly, as its first image is freed before the last is allocated.
+        peak_total = 0
+        elapsed = 0.0
+        tracemalloc.start()
+        for i in range(frames):
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            start = time.perf_counter()
+            func()
+            elapsed = elapsed + time.perf_counter() - start
+            peak_total = peak_total + tracemalloc.get_traced_memory()[1] - base
+        tracemalloc.stop()
+
+        print(f"{name:16} {width}x{height}: {peak_total / frames / 1e6:8.2f} MB allocated per frame, "
+              f"{elapsed / frames * 1000:6.2f} ms")
+
+
+def filter_alloc_benchmark(width, height, frames=50):
+    """ Measure bytes allocated per frame by the region filters, comparing the filter routines
+    (Screen_Regions.equalize, etc.) with the preallocated filter pipelines (Region_Filters.py).
+    A synthetic BGRA capture stands in for the screen.
+    :param width: The screen width in pixels.
+    :param height: The screen height in pixels.
+    :param frames: The number of frames to average over. """
+    import tracemalloc
+    import time
+    from Screen_Capture import StillImageBackend
+
+    capture = np.random.randint(0, 255, (height, width, 4), dtype=np.uint8)
+    scr = Screen(cb=None, backend=StillImageBackend(capture))
+    scr_reg = Screen_Regions(scr, None)
+
+    for region_name in ['compass', 'target', 'sun']:
+        reg = scr_reg.reg[region_name]
+        rect = reg['rect']
+        image = capture[rect[1]:rect[3], rect[0]:rect[2]]
+
+        routine = lambda: reg['filterCB'](image, reg['filter'], 'BGRA')
+        pipeline = lambda: reg['pipeline'](image, 'BGRA')
+        pipeline()  # First call allocates the buffers
+
+        for name, func in [('routine', routine), ('pipeline', pipeline)]:
+            allocated = 0
+            elapsed = 0.0
+            tracemalloc.start()
+            for i in range(frames):
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+                start = time.perf_counter()
+                func()
+                elapsed = elapsed + time.perf_counter() - start
+                allocated = allocated + tracemalloc.get_traced_memory()[1] - base
+            tracemalloc.stop()
+            print(f"{region_name:10} {name:10} {reg['width']}x{reg['height']}: "
+                  f"{allocated / frames / 1e3:10.1f} kB allocated per frame, {elapsed / frames * 1000:6.2f} ms")
+
+
+def matching_engine_benchmark(scale=0.5, repeat=20):
+    """ Benchmark the pyramid matching engine against the exhaustive matcher on the screenshots in
+    the test folder. Reports the latency of each engine and whether the best match location agrees.
+    The screenshots are at 3440x1440 scaling, so the templates are not scaled.
+    :param scale: The pyramid downscale factor.
+    :param repeat: The number of times to repeat each match for timing. """
+    import time
+    from Screen_Capture import StillImageBackend, to_bgra
+    from Template_Matching import match_template, match_template_pyramid
+
+    templ = Image_Templates(1.0, 1.0, 1.0)
+
+    for folder, (region_name, template) in test_image_sets.items():
+        directory = os.path.join('test', folder)
+        for filename in sorted(os.listdir(directory)):
+            if not filename.endswith('.png'):
+                continue
+            image = cv2.imread(os.path.join(directory, filename))
+            scr = Screen(cb=None, backend=StillImageBackend(image))
+            scr_reg = Screen_Regions(scr, templ)
+            reg = scr_reg.reg[region_name]
+            # Filter as the live capture, which is native BGRA
+            filtered = reg['filterCB'](to_bgra(image), reg['filter'], 'BGRA')
+            templ_image = templ.template[template]['image']
+
+            start = time.perf_counter()
+            for i in range(repeat):
+                (ex_min, ex_max, ex_minloc, ex_maxloc), match = match_template(filtered, templ_image)
+            ex_time = (time.perf_counter() - start) / repeat * 1000
+
+            start = time.perf_counter()
+            for i in range(repeat):
+                (py_min, py_max, py_minloc, py_maxloc), match = match_template_pyramid(filtered, templ_image,
+                                                                                        scale=scale)
+            py_time = (time.perf_counter() - start) / repeat * 1000
+
+            dist = np.hypot(ex_maxloc[0] - py_maxloc[0], ex_maxloc[1] - py_maxloc[1])
+            print(f"{folder:16} {template:16} exhaustive {ex_time:7.2f} ms {ex_max:5.2f} at {ex_maxloc}, "
+                  f"pyramid {py_time:7.2f} ms {py_max:5.2f} at {py_maxloc}, "
+                  f"{'agree' if dist <= 2 else f'DIFFER by {dist:.0f} px'}")
+
+
+def matching_method_benchmark(repeat=20):
+    """ Compare the template matching methods on the screenshots in the test folder, used to choose the
+    region 'method' defaults in Screen_Regions. For each method, reports the latency, the best score and
+    its distance from the TM_CCOEFF_NORMED location, and the best score on the screenshots of the other
+    regions (which do not contain the template). A good method finds the same location with a clear margin
+    over the negatives. The screenshots are filtered as native BGRA captures, as the live capture is.
+    The screenshots are at 3440x1440 scaling, so the templates are not scaled.
+    :param repeat: The number of times to repeat each match for timing. """
+    import time
+    from Screen_Capture import StillImageBackend, to_bgra
+    from Template_Matching import METHOD_BOX, METHOD_CCOEFF, METHOD_CCORR, METHOD_SQDIFF_BINARY, match_with_method
+
+    templ = Image_Templates(1.0, 1.0, 1.0)
+    images = {}
+    for folder in test_image_sets:
+        directory = os.path.join('test', folder)
+        images[folder] = [cv2.imread(os.path.join(directory, f)) for f in sorted(os.listdir(directory))
+                          if f.endswith('.png')]
+
+    for folder, (region_name, template) in test_image_sets.items():
+        t = templ.template[template]
+        for image in images[folder]:
+            scr = Screen(cb=None, backend=StillImageBackend(image))
+            scr_reg = Screen_Regions(scr, templ)
+            reg = scr_reg.reg[region_name]
+            # Filter as the live capture, which is native BGRA
+            filtered = reg['filterCB'](to_bgra(image), reg['filter'], 'BGRA')
+
+            # Screenshots of other regions, filtered as this region, as negatives
+            negatives = [reg['filterCB'](to_bgra(neg), reg['filter'], 'BGRA')
+                         for other, (other_region, other_templ) in test_image_sets.items() if other_region != region_name
+                         for neg in images[other]
+                         if neg.shape[0] >= t['height'] and neg.shape[1] >= t['width']]
+
+            ref_loc = None
+            for method in [METHOD_CCOEFF, METHOD_CCORR, METHOD_SQDIFF_BINARY, METHOD_BOX]:
+                start = time.perf_counter()
+                for i in range(repeat):
+                    (minVal, maxVal, minLoc, maxLoc), match = match_with_method(filtered, t, method)
+                elapsed = (time.perf_counter() - start) / repeat * 1000
+                if ref_loc is None:
+                    ref_loc = maxLoc
+                dist = np.hypot(maxLoc[0] - ref_loc[0], maxLoc[1] - ref_loc[1])
+                neg_max = max([match_with_method(neg, t, method)[0][1] for neg in negatives], default=0.0)
+                print(f"{folder:16} {method:14} {elapsed:7.2f} ms  score {maxVal:5.3f} at {str(maxLoc):11} "
+                      f"({dist:4.0f} px)  negatives {neg_max:5.3f}")
+
+
 def callback(value):
     print(value)
 
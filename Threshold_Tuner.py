@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+from Image_Templates import Image_Templates
+from Screen import Screen
+from Screen_Capture import StillImageBackend, to_bgra
+from Screen_Regions import Screen_Regions
+from Template_Matching import match_with_method
+
+"""
+File:Threshold_Tuner.py
+
+Description:
+  Batch tuning of the template match thresholds and HSV filter ranges over labeled screenshots.
+  Each region/template pair is matched on its positive screenshots (test/<folder>, which contain the
+  template) and negative screenshots (test/<folder>-negative if present, plus the screenshots of the other
+  regions). ROC curves are computed over all thresholds at once and the threshold with the best F1 score
+  is recommended, with its precision, recall and the per image latency. For regions filtered by colour,
+  a grid of HSV ranges around the current range is also tried.
+  The screenshots are filtered as native BGRA captures, the same colour conversions as the live capture.
+  The screenshots are at 3440x1440 scaling, so the templates are not scaled.
+
+  Run from the EDAPGui folder:
+    python Threshold_Tuner.py [report.json]
+
+  Does NOT require Elite Dangerous to be running.
+"""
+
+# Test screenshot folders with the region (filter) and template to match in them
+test_image_sets = {
+    'compass': ('compass', 'compass'),
+    'navpoint': ('compass', 'navpoint'),
+    'navpoint-behind': ('compass', 'navpoint-behind'),
+    'target': ('target', 'target'),
+    'disengage': ('disengage', 'disengage'),
+}
+
+
+def load_images(directory) -> list:
+    """ Returns the png images in the directory, or an empty list if it does not exist. """
+    if not os.path.isdir(directory):
+        return []
+    return [cv2.imread(os.path.join(directory, f)) for f in sorted(os.listdir(directory)) if f.endswith('.png')]
+
+
+def roc(pos_scores, neg_scores, thresholds=None) -> dict:
+    """ Computes the ROC of match scores over all thresholds at once. A score at or above the threshold
+    is a detection.
+    @param pos_scores: The best match score of each positive image.
+    @param neg_scores: The best match score of each negative image.
+    @param thresholds: The thresholds to evaluate, defaults to 0.00 to 1.00 in steps of 0.01.
+    @return: A dict of arrays, 'threshold', 'tp', 'fp', 'precision', 'recall', 'fpr' and 'f1'.
+    """
+    if thresholds is None:
+        thresholds = np.round(np.linspace(0.0, 1.0, 101), 2)
+    pos = np.asarray(pos_scores, dtype=np.float64)
+    neg = np.asarray(neg_scores, dtype=np.float64)
+    tp = (pos[None, :] >= thresholds[:, None]).sum(axis=1)
+    fp = (neg[None, :] >= thresholds[:, None]).sum(axis=1)
+    precision = np.where(tp + fp > 0, tp / np.maximum(tp + fp, 1), 1.0)
+    recall = tp / max(len(pos), 1)
+    fpr = fp / max(len(neg), 1)
+    f1 = np.where(precision + recall > 0, 2 * precision * recall / np.maximum(precision + recall, 1e-12), 0.0)
+    return {'threshold': thresholds, 'tp': tp, 'fp': fp, 'precision': precision, 'recall': recall,
+            'fpr': fpr, 'f1': f1}
+
+
+def recommend_threshold(curve: dict) -> int:
+    """ Returns the index in the ROC of the recommended threshold: the best F1 score, and of those the
+    threshold in the middle of the range, which leaves the most margin either side. """
+    best = np.flatnonzero(curve['f1'] >= curve['f1'].max() - 1e-9)
+    return int(best[len(best) // 2])
+
+
+def hsv_candidates(color_range, step: int = 20):
+    """ Returns HSV ranges around the given range: the saturation and value bounds moved by -step, 0
+    and +step (the hue is left alone). """
+    lower, upper = np.asarray(color_range[0]), np.asarray(color_range[1])
+    candidates = []
+    for dl in (-step, 0, step):
+        for du in (-step, 0, step):
+            lo = lower.copy()
+            up = upper.copy()
+            lo[1:] = np.clip(lo[1:] + dl, 0, 255)
+            up[1:] = np.clip(up[1:] + du, 0, 255)
+            if np.all(lo <= up):
+                candidates.append([lo, up])
+    return candidates
+
+
+class ThresholdTuner:
+    def __init__(self, root: str = 'test', sets=None):
+        """
+        @param root: The folder of the screenshot folders.
+        @param sets: Dict of folder: (region name, template name), defaults to test_image_sets.
+        """
+        self.root = root
+        self.sets = test_image_sets if sets is None else sets
+        self.templates = Image_Templates(1.0, 1.0, 1.0)
+        self.images = {folder: load_images(os.path.join(root, folder)) for folder in self.sets}
+
+        # Only the filters, thresholds and region settings are used, the screen image is not.
+        blank = np.zeros((1440, 3440, 3), dtype=np.uint8)
+        self.scr_reg = Screen_Regions(Screen(cb=None, backend=StillImageBackend(blank)), self.templates)
+
+    def corpus(self, folder):
+        """ Returns the (positive, negative) images for the screenshot folder. """
+        region_name = self.sets[folder][0]
+        negatives = load_images(os.path.join(self.root, folder + '-negative'))
+        negatives = negatives + [image for other, (other_region, templ_name) in self.sets.items()
+                                 if other_region != region_name for image in self.images[other]]
+        return self.images[folder], negatives
+
+    def score_images(self, images, region_name, templ_name, color_range=None):
+        """ Filter and match each image.
+        @return: (best scores, latencies in ms).
+        """
+        reg = self.scr_reg.reg[region_name]
+        templ = self.templates.template[templ_name]
+        method = reg.get('method', self.scr_reg.match_method)
+        color_range = reg['filter'] if color_range is None else color_range
+
+        scores = []
+        latencies = []
+        for image in images:
+            if image.shape[0] < templ['height'] or image.shape[1] < templ['width']:
+                continue
+            # Filter as the live capture, which is native BGRA
+            image = to_bgra(image)
+            start = time.perf_counter()
+            filtered = reg['filterCB'](image, color_range, 'BGRA')
+            (minVal, maxVal, minLoc, maxLoc), match = match_with_method(filtered, templ, method)
+            latencies.append((time.perf_counter() - start) * 1000)
+            scores.append(maxVal)
+        return scores, latencies
+
+    def tune(self, folder) -> dict:
+        """ Tune the threshold (and HSV range for colour filtered regions) for a screenshot folder. """
+        region_name, templ_name = self.sets[folder]
+        reg = self.scr_reg.reg[region_name]
+        positives, negatives = self.corpus(folder)
+
+        candidates = [None]
+        if reg['filterCB'] == self.scr_reg.filter_by_color:
+            candidates = candidates + hsv_candidates(reg['filter'])
+
+        best = None
+        for color_range in candidates:
+            pos_scores, pos_lat = self.score_images(positives, region_name, templ_name, color_range)
+            neg_scores, neg_lat = self.score_images(negatives, region_name, templ_name, color_range)
+            curve = roc(pos_scores, neg_scores)
+            i = recommend_threshold(curve)
+            margin = (min(pos_scores) - max(neg_scores)) if pos_scores and neg_scores else 0.0
+            result = {'folder': folder, 'region': region_name, 'template': templ_name,
+                      'current_threshold': self.scr_reg.get_match_threshold(templ_name),
+                      'threshold': float(curve['threshold'][i]),
+                      'precision': float(curve['precision'][i]),
+                      'recall': float(curve['recall'][i]),
+                      'f1': float(curve['f1'][i]),
+                      'margin': float(margin),
+                      'positives': len(pos_scores), 'negatives': len(neg_scores),
+                      'latency_ms': float(np.mean(pos_lat + neg_lat)) if pos_lat + neg_lat else 0.0,
+                      'color_range': None if color_range is None else [c.tolist() for c in color_range]}
+            if best is None or (result['f1'], result['margin']) > (best['f1'], best['margin']):
+                best = result
+        return best
+
+    def run(self) -> list:
+        """ Tune every screenshot folder. Returns the list of recommendations. """
+        return [self.tune(folder) for folder in self.sets if self.images[folder]]
+
+
+def main(report_file=None):
+    results = ThresholdTuner().run()
+    for r in results:
+        print(f"{r['folder']:16} {r['template']:16} threshold {r['threshold']:4.2f} (now {r['current_threshold']}) "
+              f"precision {r['precision']:4.2f} recall {r['recall']:4.2f} margin {r['margin']:+5.2f} "
+              f"{r['latency_ms']:6.2f} ms/image ({r['positives']}+/{r['negatives']}-)"
+              + (f" HSV {r['color_range']}" if r['color_range'] is not None else ""))
+    if report_file is not None:
+        with open(report_file, 'w') as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == "__main__":
+    import sys
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,319 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from Image_Templates import Image_Templates
+from Result_Cache import ocr_cache, shared_cache
+from Screen import Screen
+from Screen_Capture import StillImageBackend
+from Screen_Regions import Screen_Regions
+from Threshold_Tuner import load_images, test_image_sets
+
+"""
+File:Vision_Benchmark.py
+
+Description:
+  Non-interactive benchmark of the vision stack (Screen, Screen_Regions, Image_Templates and OCR) on the
+  screenshots in the test folder. Records the latency percentiles and the memory allocated per call of
+  each operation, and the match accuracy of each screenshot set, to a JSON report. A report can be
+  compared to a baseline report, to catch regressions before they reach a rig.
+
+  Each screenshot is served through Screen.set_screen_image, with the region set to the whole
+  screenshot, so the capture, filter pipeline and matching run as they do in the game.
+  The screenshots are at 3440x1440 scaling, so the templates are not scaled.
+
+  OCR is benchmarked if PaddleOCR is installed and test/ocr exists, with a labels.json of
+  {file name: expected text}.
+
+  The report is compared to vision_baseline.json in the screenshot root folder if it exists, and the exit code is 1 on a regression.
+  The committed baseline only holds the accuracy, as latencies are only comparable on the same machine.
+  Pass --baseline with a full report from the same machine to also compare latencies and allocations.
+  Detections, false positives and the worst positive and negative scores of each screenshot set are
+  compared, so a set that is not detected at its threshold is still checked for a drop in its score.
+
+  Run from the EDAPGui folder:
+    python Vision_Benchmark.py [--repeat 20] [--report report.json] [--baseline baseline.json]
+    python Vision_Benchmark.py --save-baseline test/vision_baseline.json
+
+  Does NOT require Elite Dangerous to be running.
+"""
+
+
+def percentiles(times_ms) -> dict:
+    """ Returns the count, mean, p50, p90, p99 and max of the latencies. """
+    t = np.asarray(times_ms, dtype=np.float64)
+    if t.size == 0:
+        return {'count': 0}
+    p50, p90, p99 = np.percentile(t, [50, 90, 99])
+    return {'count': int(t.size), 'mean_ms': float(t.mean()), 'p50_ms': float(p50), 'p90_ms': float(p90),
+            'p99_ms': float(p99), 'max_ms': float(t.max())}
+
+
+class VisionBenchmark:
+    def __init__(self, root: str = 'test', sets=None, repeat: int = 20):
+        """
+        @param root: The folder of the screenshot folders.
+        @param sets: Dict of folder: (region name, template name), defaults to test_image_sets.
+        @param repeat: The number of times each operation is timed per screenshot.
+        """
+        self.root = root
+        self.sets = test_image_sets if sets is None else sets
+        self.repeat = repeat
+        self.images = {folder: load_images(os.path.join(root, folder)) for folder in self.sets}
+        self.templates = None
+        self.screen = None
+        self.scr_reg = None
+        self.times = {}  # operation: [ms]
+        self.allocations = {}  # operation: [bytes]
+
+    def measure(self, operation: str, func):
+        """ Time the function repeat times, then measure the memory it allocates once.
+        @return: The result of the last call.
+        """
+        times = self.times.setdefault(operation, [])
+        result = None
+        for i in range(self.repeat):
+            start = time.perf_counter()
+            result = func()
+            times.append((time.perf_counter() - start) * 1000)
+
+        tracemalloc.start()
+        func()
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.allocations.setdefault(operation, []).append(peak)
+        return result
+
+    def use_image(self, image, region_name):
+        """ Serve the image as the screen, with the region covering all of it. """
+        self.screen.set_screen_image(image)
+        h, w = image.shape[:2]
+        reg = self.scr_reg.reg[region_name]
+        reg['rect'] = [0, 0, w, h]
+        reg['width'] = w
+        reg['height'] = h
+        reg['pipeline'] = self.scr_reg.make_filter_pipeline(reg)
+
+    def run_templates(self):
+        """ Time loading the active templates, from the files and from the template cache. """
+        self.templates = Image_Templates(1.0, 1.0, 1.0)
+        self.templates.use_cache = False
+        self.measure('templates_load', lambda: self.templates.reload_templates(1.0, 1.0, 1.0))
+        self.templates.use_cache = True
+        self.measure('templates_load_cached', lambda: self.templates.reload_templates(1.0, 1.0, 1.0))
+
+    def run_regions(self) -> dict:
+        """ Time capturing, filtering and matching each screenshot set, and check the matches.
+        @return: The accuracy per screenshot set.
+        """
+        first = next((images[0] for images in self.images.values() if images), None)
+        if first is None:
+            return {}
+        self.screen = Screen(cb=None, backend=StillImageBackend(first))
+        self.scr_reg = Screen_Regions(self.screen, self.templates)
+
+        accuracy = {}
+        for folder, (region_name, templ_name) in self.sets.items():
+            threshold = self.scr_reg.get_match_threshold(templ_name)
+            t = self.templates.template[templ_name]
+            detected = 0
+            false_positives = 0
+            negatives = 0
+            scores = []
+            negative_scores = []
+
+            for image in self.images[folder]:
+                self.use_image(image, region_name)
+                self.measure('capture_filter',
+                             lambda: self.scr_reg.capture_region_filtered(self.screen, region_name))
+                filtered = self.scr_reg.capture_region_filtered(self.screen, region_name)
+                (minVal, maxVal, minLoc, maxLoc), match = self.measure(
+                    f'match:{templ_name}', lambda: self.scr_reg._match_region(region_name, filtered, templ_name))
+                self.measure('match_template_in_region',
+                             lambda: self.scr_reg.match_template_in_region(region_name, templ_name))
+                scores.append(maxVal)
+                if maxVal >= threshold:
+                    detected = detected + 1
+
+            # Screenshots of the other regions do not contain the template
+            for other, (other_region, other_templ) in self.sets.items():
+                if other_region == region_name:
+                    continue
+                for image in self.images[other]:
+                    if image.shape[0] < t['height'] or image.shape[1] < t['width']:
+                        continue
+                    self.use_image(image, region_name)
+                    img_region, (minVal, maxVal, minLoc, maxLoc), match = \
+                        self.scr_reg.match_template_in_region(region_name, templ_name)
+                    negatives = negatives + 1
+                    negative_scores.append(maxVal)
+                    if maxVal >= threshold:
+                        false_positives = false_positives + 1
+
+            positives = len(self.images[folder])
+            accuracy[folder] = {'template': templ_name, 'threshold': threshold,
+                                'positives': positives, 'detected': detected,
+                                'recall': detected / positives if positives > 0 else 0.0,
+                                'negatives': negatives, 'false_positives': false_positives,
+                                'min_score': float(min(scores)) if scores else None,
+                                'max_negative_score': float(max(negative_scores)) if negative_scores else None}
+
+        # Sun detection on every screenshot
+        for images in self.images.values():
+            for image in images:
+                self.use_image(image, 'sun')
+                self.measure('sun_occupancy', lambda: self.scr_reg.sun_occupancy(self.screen))
+        return accuracy
+
+    def run_ocr(self) -> dict | None:
+        """ Time OCR of the screenshots in <root>/ocr and check the text found.
+        @return: The OCR accuracy, or None if not benchmarked.
+        """
+        directory = os.path.join(self.root, 'ocr')
+        labels_file = os.path.join(directory, 'labels.json')
+        if not os.path.isfile(labels_file):
+            return None
+        try:
+            from OCR import OCR
+        except ImportError:
+            print("PaddleOCR is not installed, OCR is not benchmarked.")
+            return None
+
+        with open(labels_file) as fp:
+            labels = json.load(fp)
+
+        ocr = OCR(self.screen)
+        correct = 0
+        for file_name, expected in labels.items():
+            image = cv2.imread(os.path.join(directory, file_name))
+            textlist = self.measure('ocr', lambda: ocr.image_simple_ocr(image))
+            if expected.upper() in str(textlist).upper():
+                correct = correct + 1
+        return {'images': len(labels), 'correct': correct,
+                'accuracy': correct / len(labels) if labels else 0.0}
+
+    def run(self) -> dict:
+        """ Run the benchmark and return the report. """
+        # Cached results would time the cache, not the operation
+        cache_enabled = (shared_cache.enabled, ocr_cache.enabled)
+        shared_cache.enabled = False
+        ocr_cache.enabled = False
+        try:
+            self.times = {}
+            self.allocations = {}
+            self.run_templates()
+            accuracy = self.run_regions()
+            ocr_accuracy = self.run_ocr()
+        finally:
+            shared_cache.enabled, ocr_cache.enabled = cache_enabled
+
+        operations = {}
+        for operation, times in self.times.items():
+            operations[operation] = percentiles(times)
+            operations[operation]['alloc_kb'] = float(np.max(self.allocations[operation]) / 1024)
+
+        return {'meta': {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+                         'opencv': cv2.__version__, 'numpy': np.__version__, 'machine': platform.machine(),
+                         'processor': platform.processor(), 'repeat': self.repeat},
+                'operations': operations,
+                'accuracy': accuracy,
+                'ocr': ocr_accuracy}
+
+
+def compare(report: dict, baseline: dict, tolerance: float = 0.25, min_ms: float = 0.2,
+            score_tolerance: float = 0.02) -> list[str]:
+    """ Compare a report to a baseline report.
+    @param tolerance: The fraction the p50 latency or allocations may increase by.
+    @param min_ms: Latency increases below this are timing noise, not regressions.
+    @param score_tolerance: The amount the worst positive score may drop, or the worst negative score rise.
+    @return: A list of the regressions, empty if none.
+    """
+    regressions = []
+    for operation, base in baseline.get('operations', {}).items():
+        new = report['operations'].get(operation)
+        if new is None or base.get('count', 0) == 0:
+            continue
+        if new['p50_ms'] > base['p50_ms'] * (1 + tolerance) and new['p50_ms'] - base['p50_ms'] > min_ms:
+            regressions.append(f"{operation}: p50 {new['p50_ms']:.2f} ms, was {base['p50_ms']:.2f} ms")
+        if new['alloc_kb'] > base['alloc_kb'] * (1 + tolerance) + 1:
+            regressions.append(f"{operation}: allocates {new['alloc_kb']:.1f} kB, was {base['alloc_kb']:.1f} kB")
+
+    for folder, base in baseline.get('accuracy', {}).items():
+        new = report['accuracy'].get(folder)
+        if new is None:
+            regressions.append(f"{folder}: not benchmarked")
+            continue
+        if new['detected'] < base['detected']:
+            regressions.append(f"{folder}: detected {new['detected']}/{new['positives']}, "
+                               f"was {base['detected']}/{base['positives']}")
+        if new['false_positives'] > base['false_positives']:
+            regressions.append(f"{folder}: {new['false_positives']} false positives, was {base['false_positives']}")
+        if base.get('min_score') is not None and new['min_score'] is not None \
+                and new['min_score'] < base['min_score'] - score_tolerance:
+            regressions.append(f"{folder}: worst score {new['min_score']:.3f}, was {base['min_score']:.3f}")
+        if base.get('max_negative_score') is not None and new['max_negative_score'] is not None \
+                and new['max_negative_score'] > base['max_negative_score'] + score_tolerance:
+            regressions.append(f"{folder}: worst negative score {new['max_negative_score']:.3f}, "
+                               f"was {base['max_negative_score']:.3f}")
+
+    base_ocr = baseline.get('ocr')
+    if base_ocr is not None and report.get('ocr') is not None and report['ocr']['correct'] < base_ocr['correct']:
+        regressions.append(f"ocr: {report['ocr']['correct']} correct, was {base_ocr['correct']}")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the vision stack on the test screenshots.")
+    parser.add_argument('--root', default='test', help="The folder of the screenshot folders.")
+    parser.add_argument('--repeat', type=int, default=20, help="Times each operation is timed per screenshot.")
+    parser.add_argument('--report', help="Save the report to this JSON file.")
+    parser.add_argument('--baseline', help="Compare to this report, defaults to vision_baseline.json in the root "
+                                           "folder if it exists. Exits with 1 on a regression.")
+    parser.add_argument('--save-baseline', help="Save the accuracy of this run as the baseline to this file.")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed fractional increase.")
+    args = parser.parse_args(argv)
+
+    report = VisionBenchmark(args.root, repeat=args.repeat).run()
+
+    for operation, stats in report['operations'].items():
+        print(f"{operation:28} p50 {stats['p50_ms']:8.2f} ms  p90 {stats['p90_ms']:8.2f} ms  "
+              f"p99 {stats['p99_ms']:8.2f} ms  {stats['alloc_kb']:9.1f} kB")
+    for folder, acc in report['accuracy'].items():
+        print(f"{folder:16} {acc['template']:16} detected {acc['detected']}/{acc['positives']}  "
+              f"false positives {acc['false_positives']}/{acc['negatives']}")
+    if report['ocr'] is not None:
+        print(f"ocr {report['ocr']['correct']}/{report['ocr']['images']} correct")
+
+    if args.report:
+        with open(args.report, 'w') as fp:
+            json.dump(report, fp, indent=2)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as fp:
+            json.dump({'meta': report['meta'], 'accuracy': report['accuracy'], 'ocr': report['ocr']}, fp, indent=2)
+        return 0
+
+    baseline_file = args.baseline
+    if baseline_file is None and os.path.isfile(os.path.join(args.root, 'vision_baseline.json')):
+        baseline_file = os.path.join(args.root, 'vision_baseline.json')
+    if baseline_file:
+        print(f"Comparing to {baseline_file}")
+        with open(baseline_file) as fp:
+            regressions = compare(report, json.load(fp), args.tolerance)
+        for r in regressions:
+            print(f"REGRESSION {r}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
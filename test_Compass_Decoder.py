@@ -0,0 +1,63 @@
+import unittest
+
+import cv2
+import numpy as np
+
+from Compass_Decoder import CompassDecoder
+
+
+def make_dial(dot=None, behind=False):
+    """ An orange compass dial with an optional dot at dot (x, y), a white dot in front or a cyan ring
+    behind. """
+    dial = np.zeros((82, 85, 3), dtype=np.uint8)
+    cv2.circle(dial, (42, 41), 38, (10, 110, 200), 3)
+    if dot is not None:
+        if behind:
+            cv2.circle(dial, dot, 6, (220, 160, 10), 2)
+        else:
+            cv2.circle(dial, dot, 6, (220, 230, 200), -1)
+    return dial
+
+
+class CompassDecoderTestCase(unittest.TestCase):
+    def test_front_dot(self):
+        """ A filled dot up and right of centre is in front. """
+        nav = CompassDecoder().decode(make_dial((60, 20)))
+        self.assertEqual(nav['z'], 1)
+        self.assertGreater(nav['x'], 0)
+        self.assertGreater(nav['y'], 0)
+        self.assertTrue(0 < nav['roll'] < 90)
+
+    def test_behind_dot(self):
+        """ A cyan ring is behind. """
+        nav = CompassDecoder().decode(make_dial((30, 55), behind=True))
+        self.assertEqual(nav['z'], -1)
+        self.assertLess(nav['x'], 0)
+        self.assertLess(nav['y'], 0)
+
+    def test_centred_dot(self):
+        nav = CompassDecoder().decode(make_dial((42, 41)))
+        self.assertLess(nav['dist'], 5)
+
+    def test_no_dot(self):
+        """ The dial ring is outside the mask and is not taken for the dot. """
+        self.assertIsNone(CompassDecoder().decode(make_dial()))
+
+    def test_screenshots(self):
+        """ The front and behind states of the screenshots are told apart by the dot colour. """
+        front = CompassDecoder().decode(cv2.imread('test/navpoint/Screenshot 2024-07-04 20-02-01.png'))
+        behind = CompassDecoder().decode(cv2.imread('test/navpoint-behind/Screenshot 2024-07-04 20-01-33.png'))
+        self.assertEqual(front['z'], 1)
+        self.assertEqual(behind['z'], -1)
+        self.assertGreater(front['x'], 0)
+        self.assertGreater(behind['y'], 0)
+
+    def test_gray(self):
+        """ A gray image has no colour, so the front/behind state is not known. """
+        dial = cv2.cvtColor(make_dial((60, 20)), cv2.COLOR_BGR2GRAY)
+        nav = CompassDecoder().decode(dial, 'GRAY')
+        self.assertEqual(nav['z'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
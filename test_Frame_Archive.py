@@ -0,0 +1,58 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from Frame_Archive import FrameArchiveWriter, FrameArchiveReader
+
+
+class FrameArchiveTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_round_trip(self):
+        """ Recorded regions read back with the same metadata and pixels. """
+        raw = np.random.randint(0, 255, (40, 60, 4), dtype=np.uint8)
+        filtered = np.random.randint(0, 255, (40, 60), dtype=np.uint8)
+
+        writer = FrameArchiveWriter(self.path, 640, 480)
+        writer.record('compass', [10, 20, 70, 60], 1, 123.5, raw, filtered)
+        writer.record('target', [0, 0, 60, 40], 1, 123.5, raw, None)
+        writer.close()
+
+        reader = FrameArchiveReader(self.path)
+        self.assertEqual(len(reader), 2)
+        self.assertEqual(reader.frame_ids(), [1])
+
+        rec = reader.read(0)
+        self.assertEqual(rec['name'], 'compass')
+        self.assertEqual(rec['rect'], [10, 20, 70, 60])
+        self.assertTrue(np.array_equal(rec['raw'], raw))
+        self.assertTrue(np.array_equal(rec['filtered'], filtered))
+        self.assertIsNone(reader.read(1)['filtered'])
+
+    def test_size_limit(self):
+        """ The oldest chunks are deleted to keep the archive under its size limit. """
+        writer = FrameArchiveWriter(self.path, 640, 480, chunk_bytes=10000, max_bytes=50000, compress_level=0)
+        for i in range(30):
+            img = np.full((50, 50, 4), i, dtype=np.uint8)
+            writer.record('sun', [0, 0, 50, 50], i, float(i), img)
+        writer.close()
+
+        chunks = [f for f in os.listdir(self.path) if f.startswith('chunk_')]
+        size = sum(os.path.getsize(os.path.join(self.path, f)) for f in chunks)
+        self.assertLessEqual(size, 50000)
+
+        # The newest frames are kept and still readable
+        reader = FrameArchiveReader(self.path)
+        self.assertEqual(reader.frame_ids()[-1], 29)
+        self.assertEqual(reader.read(len(reader) - 1)['raw'][0, 0, 0], 29)
+
+
+if __name__ == '__main__':
+    unittest.main()
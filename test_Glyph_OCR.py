@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+from Glyph_OCR import GlyphOCR
+
+
+def text_line(text, inverted=False):
+    """ A line of text, orange on black like the HUD, or black on orange like a highlighted row. """
+    image = np.zeros((34, 20 * len(text) + 20, 3), dtype=np.uint8)
+    cv2.putText(image, text, (6, 24), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 140, 255), 1, cv2.LINE_AA)
+    if inverted:
+        image = 255 - image
+    return image
+
+
+class GlyphOCRTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.glyph_ocr = GlyphOCR()
+        for text in ["ABCDEFGHIJKLM", "NOPQRSTUVWXYZ", "0123456789"]:
+            cls.glyph_ocr.learn(text_line(text), text)
+
+    def test_recognize(self):
+        """ Text made of the learned glyphs is read back, on a dark or highlighted background. """
+        for text in ["ROBIGO MINES", "SIRIUS ATMOSPHERICS", "HIP 12345"]:
+            for inverted in (False, True):
+                actual, confidence = self.glyph_ocr.recognize(text_line(text, inverted))
+                self.assertEqual(actual, text)
+                self.assertGreater(confidence, 0.9)
+
+    def test_learn_rejects_mismatch(self):
+        """ Glyphs are not learned if the characters found do not agree with the text. """
+        glyph_ocr = GlyphOCR()
+        self.assertFalse(glyph_ocr.learn(text_line("ROBIGO"), "ROBIG0 1"))
+        self.assertEqual(len(glyph_ocr.labels), 0)
+        self.assertEqual(glyph_ocr.recognize(text_line("ROBIGO")), ('', 0.0))
+
+    def test_save_and_load(self):
+        """ Saved glyphs load back, a folder is created for them and a failed save is not fatal. """
+        with tempfile.TemporaryDirectory() as tmp:
+            file_name = os.path.join(tmp, 'EDAPGui', 'glyphs_en.npz')
+            self.assertTrue(self.glyph_ocr.save(file_name))
+            glyph_ocr = GlyphOCR()
+            self.assertTrue(glyph_ocr.load(file_name))
+            self.assertEqual(glyph_ocr.labels, self.glyph_ocr.labels)
+
+            # A file where the folder should be
+            self.assertFalse(self.glyph_ocr.save(os.path.join(file_name, 'glyphs_en.npz')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+
+from Image_Templates import Image_Templates
+
+
+class ImageTemplatesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_templates(self, use_cache=False) -> Image_Templates:
+        return Image_Templates(1.0, 1.0, 1.0, use_cache=use_cache, cache_dir=os.path.join(self.tmp.name, 'cache'))
+
+    def test_released_set_is_evicted(self):
+        templates = self.make_templates()
+        templates.use_set('robigo')
+        templates.use_set('missions')
+        # In use, so kept over the budget
+        self.assertGreater(templates.memory_used(), templates.budget())
+        self.assertIn('robigo', templates.loaded_sets)
+
+        templates.release_set('robigo')
+        templates.release_set('missions')
+        # Inactive sets are evicted, least recently used first, until within the budget
+        self.assertNotIn('robigo', templates.loaded_sets)
+        self.assertIn('missions', templates.loaded_sets)
+        self.assertIn('navigation', templates.loaded_sets)
+        self.assertLessEqual(templates.memory_used(), templates.budget())
+
+        # And loaded again on first use
+        self.assertGreater(templates.template['sirius_atmos']['width'], 0)
+        self.assertIn('robigo', templates.loaded_sets)
+
+    def test_scale_space_built_on_load(self):
+        templates = self.make_templates()
+        base = templates.template['compass']
+        space = templates.get_scale_space('compass')
+        self.assertEqual([f for f, t in space], list(templates.scale_factors))
+        for f, t in space:
+            if f == 1.0:
+                self.assertIs(t, base)
+            else:
+                self.assertEqual(t['width'], round(base['width'] * f))
+                self.assertEqual(t['binary'].shape, t['image'].shape)
+        self.assertTrue(templates.needs_scale_search('compass'))
+        self.assertFalse(templates.needs_scale_search('target'))
+
+        templates.lock_scale('compass', 1.1)
+        self.assertFalse(templates.needs_scale_search('compass'))
+        self.assertIs(templates.template['compass'], space[3][1])
+
+    def test_template_cache(self):
+        templates = self.make_templates(use_cache=True)
+        file_name = os.path.join(self.tmp.name, 'compass.png')
+        shutil.copy('templates/compass.png', file_name)
+
+        templ = templates.load_template(file_name, 0.5, 0.5)
+        cache_file = templates.cache_file_name(file_name, 0.5, 0.5)
+        self.assertEqual(os.path.dirname(cache_file), templates.cache_dir)
+        self.assertTrue(os.path.isfile(cache_file))
+        cached = templates.load_cached_template(file_name, 0.5, 0.5)
+        np.testing.assert_array_equal(cached['image'], templ['image'])
+        self.assertEqual(cached['norm'], templ['norm'])
+
+        # A changed template file is not loaded from the old cache
+        st = os.stat(file_name)
+        os.utime(file_name, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+        self.assertNotEqual(templates.cache_file_name(file_name, 0.5, 0.5), cache_file)
+        self.assertIsNone(templates.load_cached_template(file_name, 0.5, 0.5))
+
+    def test_concurrent_first_use_loads_once(self):
+        templates = self.make_templates()
+        loads = []
+        load_template = templates.load_template
+
+        def counting_load(file_name, scaleX, scaleY):
+            loads.append(file_name)
+            return load_template(file_name, scaleX, scaleY)
+
+        templates.load_template = counting_load
+        start = threading.Barrier(8)
+
+        def use():
+            start.wait()
+            templates.template['robigo_mines']
+
+        threads = [threading.Thread(target=use) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(loads), len(templates.template_sets['robigo']))
+        self.assertEqual(list(templates.loaded_sets).count('robigo'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+
+import cv2
+import numpy as np
+
+from Image_Templates import Image_Templates
+from Region_Evaluator import RegionEvaluator, SharedFrame
+from Screen import Screen
+from Screen_Capture import StillImageBackend
+from Screen_Regions import Screen_Regions
+
+
+class RegionEvaluatorTestCase(unittest.TestCase):
+    def test_shared_frame(self):
+        """ A second handle attached by name sees the written image. """
+        frame = SharedFrame((20, 30, 4))
+        other = SharedFrame((20, 30, 4), name=frame.name)
+        image = np.full((10, 15, 4), 7, dtype=np.uint8)
+        size = frame.write(image)
+        self.assertTrue(np.array_equal(other.view(*size), image))
+        other.close()
+        frame.close()
+
+    def test_evaluate(self):
+        """ Template and sun jobs of one frame evaluated in the workers. """
+        rng = np.random.default_rng(2)
+        templ = cv2.GaussianBlur(rng.integers(0, 255, (30, 40), dtype=np.uint8), (5, 5), 0)
+        frame = np.zeros((200, 300, 4), dtype=np.uint8)
+        frame[50:80, 120:160, :3] = templ[:, :, None]
+        frame[150:200, 0:100] = 255
+
+        jobs = [{'name': 'target', 'rect': [100, 20, 250, 120], 'filter': ('equalize', None), 'template': 'tmp'},
+                {'name': 'sun', 'rect': [0, 100, 200, 200], 'filter': ('sun', 125), 'template': None}]
+        image = cv2.createCLAHE(2.0, (8, 8)).apply(templ)
+        templates = {'tmp': {'image': image, 'binary': (image > 127).astype(np.uint8)}}
+        evaluator = RegionEvaluator(templates, 300, 200, workers=2)
+        try:
+            for i in range(3):
+                results = evaluator.evaluate(frame, jobs)
+                (minVal, maxVal, minLoc, maxLoc) = results['target']
+                self.assertEqual(maxLoc, (20, 30))
+                self.assertEqual(results['sun'], 25)
+        finally:
+            evaluator.shutdown()
+
+    def test_evaluate_regions_releases_frame(self):
+        """ The frame grabbed for the evaluator is not served to later captures. """
+        backend = StillImageBackend(np.zeros((1440, 3440, 3), dtype=np.uint8))
+        screen = Screen(cb=None, backend=backend)
+        scr_reg = Screen_Regions(screen, Image_Templates(1.0, 1.0, 1.0, use_cache=False))
+        evaluator = scr_reg.create_region_evaluator(workers=1)
+        try:
+            futures = scr_reg.evaluate_regions(evaluator, [('sun', None), ('target', 'target')])
+            self.assertEqual(futures['sun'].result(), 0)
+            self.assertEqual(screen.current_frame(), (None, None))
+
+            backend.image[:] = 255
+            self.assertEqual(scr_reg.sun_percent(screen), 100)
+        finally:
+            evaluator.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import time
+import unittest
+
+import cv2
+import numpy as np
+
+from Result_Cache import ResultCache, cached
+
+cache = ResultCache(max_entries=2)
+ocr_like_cache = ResultCache(max_entries=8, ttl=0.05, perceptual=True)
+
+
+class Counter:
+    def __init__(self, language='en'):
+        self.calls = 0
+        self.language = language
+
+    @cached(cache)
+    def total(self, image, scale=1):
+        self.calls = self.calls + 1
+        return int(image.sum()) * scale
+
+    @cached(ocr_like_cache)
+    def read(self, image):
+        self.calls = self.calls + 1
+        return self.calls
+
+    @cached(cache, state=lambda self: (self.language,))
+    def words(self, image):
+        self.calls = self.calls + 1
+        return [self.language, int(image.sum())]
+
+
+def text_image(text, value=140):
+    image = np.zeros((30, 400, 3), dtype=np.uint8)
+    cv2.putText(image, text, (5, 22), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (value, value, value), 2)
+    return image
+
+
+class ResultCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        cache.clear()
+        cache.reset_stats()
+
+    def test_identical_content_hits(self):
+        """ A different array with the same content is a hit, different content or arguments are not. """
+        c = Counter()
+        image = np.arange(12, dtype=np.uint8).reshape(3, 4)
+        self.assertEqual(c.total(image), 66)
+        self.assertEqual(c.total(image.copy()), 66)
+        self.assertEqual(c.calls, 1)
+        self.assertEqual(c.total(image, scale=2), 132)
+        self.assertEqual(c.total(image + 1), 78)
+        self.assertEqual(c.calls, 3)
+        stats = cache.get_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 3))
+
+    def test_argument_binding(self):
+        """ Arguments passed by position, by keyword or left to their default share the entry. """
+        c = Counter()
+        image = np.arange(12, dtype=np.uint8).reshape(3, 4)
+        self.assertEqual(c.total(image), 66)
+        self.assertEqual(c.total(image, 1), 66)
+        self.assertEqual(c.total(image, scale=1), 66)
+        self.assertEqual(c.total(image=image, scale=1), 66)
+        self.assertEqual(c.calls, 1)
+
+    def test_lru_eviction(self):
+        c = Counter()
+        a, b, d = (np.full((2, 2), v, dtype=np.uint8) for v in (1, 2, 3))
+        c.total(a)
+        c.total(b)
+        c.total(a)  # a is now the most recently used
+        c.total(d)  # evicts b
+        c.total(a)
+        self.assertEqual(c.calls, 3)
+        c.total(b)
+        self.assertEqual(c.calls, 4)
+        self.assertEqual(cache.get_stats()['evictions'], 2)
+
+    def test_perceptual_key(self):
+        """ Noise hits a perceptual cache, a changed character or a fade does not. """
+        ocr_like_cache.clear()
+        c = Counter()
+        image = text_image("ROBIGO MINES")
+        noise = np.random.default_rng(1).integers(-6, 7, image.shape)
+        noisy = np.clip(image.astype(int) + noise, 0, 255).astype(np.uint8)
+        self.assertEqual(c.read(image), 1)
+        self.assertEqual(c.read(noisy), 1)
+        self.assertEqual(c.read(text_image("ROBIGO MINER")), 2)
+        self.assertEqual(c.read(text_image("ROBIGO MINES", value=60)), 3)
+
+    def test_ttl(self):
+        ocr_like_cache.clear()
+        c = Counter()
+        image = text_image("SOL")
+        c.read(image)
+        c.read(image)
+        self.assertEqual(c.calls, 1)
+        time.sleep(0.1)
+        c.read(image)
+        self.assertEqual(c.calls, 2)
+        self.assertEqual(ocr_like_cache.get_stats()['expired'], 1)
+
+    def test_instance_state(self):
+        """ Instances in different states do not share results, and a changed result is not cached. """
+        en, de = Counter('en'), Counter('de')
+        image = np.ones((2, 2), dtype=np.uint8)
+        self.assertEqual(en.words(image), ['en', 4])
+        self.assertEqual(de.words(image), ['de', 4])
+        self.assertEqual((en.calls, de.calls), (1, 1))
+
+        en.words(image).append('changed')
+        self.assertEqual(en.words(image), ['en', 4])
+        self.assertEqual(en.calls, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
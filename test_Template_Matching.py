@@ -0,0 +1,66 @@
+import unittest
+
+import cv2
+import numpy as np
+
+from Template_Matching import TemplateTracker, match_template, match_template_pyramid
+
+
+def make_scene(w=400, h=300, x=250, y=120):
+    """ A noisy scene with a textured template pasted at (x, y). """
+    rng = np.random.default_rng(1)
+    scene = rng.integers(0, 60, (h, w), dtype=np.uint8)
+    templ = rng.integers(0, 255, (40, 50), dtype=np.uint8)
+    templ = cv2.GaussianBlur(templ, (5, 5), 0)
+    scene[y:y + templ.shape[0], x:x + templ.shape[1]] = templ
+    return scene, templ
+
+
+class TemplateMatchingTestCase(unittest.TestCase):
+    def test_pyramid_agrees_with_exhaustive(self):
+        """ The pyramid engine finds the same best location and value as the exhaustive match. """
+        scene, templ = make_scene()
+        (ex_min, ex_max, ex_minloc, ex_maxloc), ex_match = match_template(scene, templ)
+        for scale in [0.5, 0.25]:
+            (py_min, py_max, py_minloc, py_maxloc), py_match = match_template_pyramid(scene, templ, scale=scale)
+            self.assertEqual(py_maxloc, ex_maxloc)
+            self.assertAlmostEqual(py_max, ex_max, places=4)
+            self.assertEqual(py_match.shape, ex_match.shape)
+
+    def test_pyramid_sqdiff(self):
+        """ For SQDIFF the minimum is refined. """
+        scene, templ = make_scene()
+        (ex_min, ex_max, ex_minloc, ex_maxloc), ex_match = match_template(scene, templ, cv2.TM_SQDIFF_NORMED)
+        (py_min, py_max, py_minloc, py_maxloc), py_match = match_template_pyramid(scene, templ, cv2.TM_SQDIFF_NORMED)
+        self.assertEqual(py_minloc, ex_minloc)
+
+    def test_pyramid_small_template_falls_back(self):
+        """ Templates too small to downscale use the exhaustive match. """
+        scene, templ = make_scene()
+        small = templ[:10, :10]
+        self.assertEqual(match_template_pyramid(scene, small)[0], match_template(scene, small)[0])
+
+    def test_tracker_follows_moving_template(self):
+        """ After the first full search, a template moving steadily is found in the window. """
+        tracker = TemplateTracker(margin=12)
+        for i in range(6):
+            x = 100 + i * 10
+            scene, templ = make_scene(x=x, y=120)
+            (minVal, maxVal, minLoc, maxLoc), match = tracker.match('target', scene, templ, 0.8, now=i * 0.1)
+            self.assertEqual(maxLoc, (x, 120))
+        self.assertEqual(tracker.full_searches, 1)
+        self.assertEqual(tracker.window_hits, 5)
+
+    def test_tracker_falls_back_when_lost(self):
+        """ A template that jumps outside the window is found by the full search. """
+        tracker = TemplateTracker(margin=12)
+        scene, templ = make_scene(x=50, y=50)
+        tracker.match('target', scene, templ, 0.8, now=0.0)
+        scene, templ = make_scene(x=300, y=200)
+        (minVal, maxVal, minLoc, maxLoc), match = tracker.match('target', scene, templ, 0.8, now=0.1)
+        self.assertEqual(maxLoc, (300, 200))
+        self.assertEqual(tracker.full_searches, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()